@@ -0,0 +1,205 @@
+import os
+import sys
+
+import numpy as np
+
+
+def index_path_for(db_path):
+    """Return the path of the ANN index file that sits next to `db_path`"""
+    return os.path.splitext(db_path)[0] + ".ann.npz"
+
+
+def _nearest_centroids(vectors, centroids, chunk_size=8192):
+    """Index of the closest centroid for every row of `vectors`"""
+    centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        block = vectors[start:start + chunk_size]
+        # |c|^2 - 2 v.c ranks centroids the same way as |v - c|^2
+        scores = centroid_sq_norms - 2.0 * (block @ centroids.T)
+        assignments[start:start + chunk_size] = np.argmin(scores, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """Inverted-file index over face encodings.
+
+    A k-means coarse quantizer splits the encoding space into `nlist`
+    cells and every enrolled id is filed under its nearest centroid. A
+    query only visits the `nprobe` closest cells, which is the recall/speed
+    knob: raising it returns more candidates and misses fewer true
+    neighbours. The index only produces a shortlist of ids; callers compute
+    exact distances for those ids before applying any threshold.
+    """
+
+    def __init__(self, centroids, nprobe=8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nprobe = nprobe
+        self._lists = [[] for _ in range(len(self.centroids))]
+        self._list_by_id = {}
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self._list_by_id)
+
+    def __contains__(self, user_id):
+        return int(user_id) in self._list_by_id
+
+    @classmethod
+    def train(cls, vectors, nlist=None, nprobe=8, iterations=10, max_samples=65536, seed=0):
+        """Fit the coarse quantizer with k-means on (a sample of) `vectors`"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+        if nlist == 0:
+            raise ValueError("Cannot train an index without any vectors")
+
+        rng = np.random.default_rng(seed)
+        if len(vectors) > max_samples:
+            sample = vectors[rng.choice(len(vectors), max_samples, replace=False)]
+        else:
+            sample = vectors
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = _nearest_centroids(sample, centroids)
+            counts = np.bincount(assignments, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            # Re-seed empty cells from random samples so no centroid is wasted
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                centroids[empty] = sample[rng.choice(len(sample), len(empty))]
+
+        return cls(centroids, nprobe=nprobe)
+
+    def add(self, user_ids, vectors):
+        """File each id under its nearest centroid"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(user_ids), -1)
+        if len(vectors) == 0:
+            return
+        for user_id, cell in zip(user_ids, _nearest_centroids(vectors, self.centroids)):
+            user_id = int(user_id)
+            if user_id in self._list_by_id:
+                self.remove(user_id)
+            self._lists[cell].append(user_id)
+            self._list_by_id[user_id] = int(cell)
+
+    def remove(self, user_id):
+        """Drop `user_id` from its inverted list. Returns True if it was present"""
+        cell = self._list_by_id.pop(int(user_id), None)
+        if cell is None:
+            return False
+        self._lists[cell].remove(int(user_id))
+        return True
+
+    def clear(self):
+        """Empty every inverted list but keep the trained centroids"""
+        self._lists = [[] for _ in range(self.nlist)]
+        self._list_by_id.clear()
+
+    def candidates(self, query, nprobe=None):
+        """Ids filed under the `nprobe` centroids closest to `query`"""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        query = np.asarray(query, dtype=np.float32).ravel()
+        scores = np.einsum("ij,ij->i", self.centroids, self.centroids) - 2.0 * (self.centroids @ query)
+        if nprobe < self.nlist:
+            cells = np.argpartition(scores, nprobe - 1)[:nprobe]
+        else:
+            cells = range(self.nlist)
+
+        shortlist = []
+        for cell in cells:
+            shortlist.extend(self._lists[cell])
+        return np.array(shortlist, dtype=np.int64)
+
+    def sync(self, gallery):
+        """Reconcile the index with `gallery` after loading it from disk.
+
+        Ids missing from the gallery are dropped and ids the index has not
+        seen yet are added, so a stale file only costs the difference.
+        """
+        gallery_ids = set(int(user_id) for user_id in gallery.ids)
+        for user_id in [user_id for user_id in self._list_by_id if user_id not in gallery_ids]:
+            self.remove(user_id)
+
+        missing = [user_id for user_id in gallery_ids if user_id not in self._list_by_id]
+        if missing:
+            self.add(missing, np.array(gallery.get_encodings(missing)))
+
+    def save(self, path):
+        """Write the index to `path` as an uncompressed .npz archive"""
+        lengths = np.array([len(ids) for ids in self._lists], dtype=np.int64)
+        ids = np.array([user_id for ids in self._lists for user_id in ids], dtype=np.int64)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, lengths=lengths, ids=ids,
+                     nprobe=np.int64(self.nprobe))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index previously written by `save`"""
+        with np.load(path) as data:
+            index = cls(data["centroids"], nprobe=int(data["nprobe"]))
+            offsets = np.concatenate(([0], np.cumsum(data["lengths"])))
+            ids = data["ids"]
+        for cell in range(index.nlist):
+            cell_ids = ids[offsets[cell]:offsets[cell + 1]].tolist()
+            index._lists[cell] = cell_ids
+            for user_id in cell_ids:
+                index._list_by_id[user_id] = cell
+        return index
+
+
+def load_or_build_index(path, gallery, nprobe=8):
+    """Load the index at `path` and sync it with `gallery`, or train a new one.
+
+    A freshly trained index is written to `path` straight away.
+    """
+    if os.path.exists(path):
+        try:
+            index = IVFIndex.load(path)
+            index.nprobe = nprobe
+            index.sync(gallery)
+            return index
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = IVFIndex.train(gallery.encodings, nprobe=nprobe)
+    index.add(gallery.ids, gallery.encodings)
+    index.save(path)
+    return index
+
+
+def rebuild_index(db_path=None, nlist=None, nprobe=8):
+    """Train a fresh index from the users table and save it next to `db_path`"""
+    import storage
+
+    db_path = db_path or storage.DEFAULT_DB_PATH
+    conn = storage.connect(db_path)
+    try:
+        gallery = storage.load_gallery(conn)
+    finally:
+        conn.close()
+    if len(gallery) == 0:
+        print("No users found, nothing to index")
+        return None
+
+    index = IVFIndex.train(gallery.encodings, nlist=nlist, nprobe=nprobe)
+    index.add(gallery.ids, gallery.encodings)
+    path = index_path_for(db_path)
+    index.save(path)
+    print(f"Indexed {len(index)} encodings into {index.nlist} cells at {path}")
+    return index
+
+
+if __name__ == "__main__":
+    rebuild_index(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -1,95 +1,81 @@
+import ipaddress
 import os
 import sqlite3
 import tkinter as tk
-from tkinter import messagebox, simpledialog
-import cv2
-import numpy as np
-import face_recognition
-from PIL import Image, ImageTk
+from tkinter import messagebox
 import threading
-import time
+import multiprocessing
+import queue
 import webbrowser
-from flask import Flask, redirect, url_for
-import subprocess
 import sys
-import dlib
+from startup import StartupTimer
 
-def resource_path(relative_path):
-    """ Get absolute path to resource, works for dev and for PyInstaller """
-    try:
-        # PyInstaller creates a temp folder and stores path in _MEIPASS
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.path.abspath(".")
-    
-    # Try multiple possible locations for the model file
-    possible_paths = [
-        os.path.join(base_path, relative_path),  # Direct path
-        os.path.join(base_path, "face_recognition_models", "models", "shape_predictor_68_face_landmarks.dat"),  # Nested path
-        os.path.join(os.path.dirname(os.path.abspath(__file__)), relative_path),  # Script directory
-        os.path.join(os.path.dirname(os.path.abspath(__file__)), "face_recognition_models", "models", "shape_predictor_68_face_landmarks.dat")  # Script directory nested
-    ]
-    
-    # Try each path
-    for path in possible_paths:
-        if os.path.exists(path):
-            return path
-            
-    # If no path works, return the first attempted path for error reporting
-    return possible_paths[0]
+# Started before any heavy import so the startup report covers everything
+startup_timer = StartupTimer()
 
-# Create Flask app
-flask_app = Flask(__name__)
+# Embedded web server, created in the background once the UI is up
+flask_app = None
 
-# Always resolve the model path using resource_path
-PREDICTOR_MODEL_REL = "face_recognition_models/models/shape_predictor_68_face_landmarks.dat"
-predictor_path = resource_path(PREDICTOR_MODEL_REL)
+# Where the web server listens. Set FACE_AUTH_API_HOST (e.g. 0.0.0.0) to
+# serve other terminals; that also needs FACE_AUTH_API_TOKEN, which the
+# /api/* routes then require as "Authorization: Bearer <token>"
+API_HOST = os.environ.get("FACE_AUTH_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("FACE_AUTH_API_PORT", "5000"))
+API_TOKEN = os.environ.get("FACE_AUTH_API_TOKEN") or None
 
-# Load the dlib predictor ONCE, globally, for all uses
-try:
-    if not os.path.exists(predictor_path):
-        # Try to find the model in the current directory
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        model_name = "shape_predictor_68_face_landmarks.dat"
-        possible_locations = [
-            os.path.join(current_dir, model_name),
-            os.path.join(current_dir, "face_recognition_models", "models", model_name),
-            os.path.join(current_dir, "models", model_name)
-        ]
-        
-        for loc in possible_locations:
-            if os.path.exists(loc):
-                predictor_path = loc
-                break
-        else:
-            raise FileNotFoundError(f"Could not find face predictor model at any of these locations:\n" + 
-                                  "\n".join(possible_locations))
-    
-    dlib_predictor = dlib.shape_predictor(predictor_path)
-except Exception as e:
-    tk.Tk().withdraw()
-    messagebox.showerror("Model Load Error", 
-                        f"Failed to load dlib model:\n{e}\n\n"
-                        f"Please ensure the model file 'shape_predictor_68_face_landmarks.dat' is present in the same directory as the executable.")
-    sys.exit(1)
+def is_loopback(host):
+    """True if `host` is only reachable from this machine"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
 
-@flask_app.route('/logout')
-def logout():
-    # Restart the Python application
-    python = sys.executable
-    os.execl(python, python, *sys.argv)
-    return "Logging out..."
+def create_flask_app(db_path, api_token=None):
+    """Create the Flask app and register its routes, serving the users in `db_path`"""
+    from flask import Flask, Response
+    app = Flask(__name__)
+    
+    @app.route('/logout')
+    def logout():
+        # Restart the Python application
+        python = sys.executable
+        os.execl(python, python, *sys.argv)
+        return "Logging out..."
+    
+    @app.route('/')
+    def index():
+        return "Face Authentication System"
+    
+    @app.route('/metrics')
+    def metrics_endpoint():
+        # Pipeline counters and latency histograms in the Prometheus text format
+        from metrics import REGISTRY
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+    
+    # Identify / verify endpoints for terminals that offload matching
+    import verification_api
+    verification_api.register_routes(app, db_path=db_path, token=api_token)
+    
+    return app
 
-def run_flask():
-    flask_app.run(port=5000)
+def run_flask(host=API_HOST, port=API_PORT):
+    flask_app.run(host=host, port=port)
 
-# Start Flask server in a separate thread
-flask_thread = threading.Thread(target=run_flask, daemon=True)
-flask_thread.start()
+def start_server(db_path, host=API_HOST, port=API_PORT, api_token=API_TOKEN):
+    """Create the Flask app and start it in a separate thread.
 
-@flask_app.route('/')
-def index():
-    return "Face Authentication System"
+    Raises ValueError when asked to listen beyond this machine without an
+    API token, since /api/identify names whoever is in a posted photo.
+    """
+    global flask_app
+    if not is_loopback(host) and not api_token:
+        raise ValueError(f"Refusing to serve on {host} without FACE_AUTH_API_TOKEN")
+    flask_app = create_flask_app(db_path, api_token=api_token)
+    flask_thread = threading.Thread(target=run_flask, args=(host, port), daemon=True)
+    flask_thread.start()
+    return flask_thread
 
 class DashboardWindow:
     def __init__(self, parent, username):
@@ -165,26 +151,21 @@ class DashboardWindow:
             messagebox.showerror("Error", f"Failed to open browser: {str(e)}")
 
 class FaceAuthSystem:
+    """Tkinter front end for FaceAuthEngine.
+    
+    The engine runs the pipeline; this class only collects input, draws
+    frames and turns engine events into labels and dialogs.
+    """
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("Face Recognition Authentication")
         # Make window fullscreen (Linux compatible)
         self.root.attributes('-fullscreen', True)
         
-        # Initialize database
-        self.init_database()
-        
-        # Initialize camera
-        self.camera = None
-        self.is_camera_active = False
-        
-        # Enhanced camera performance settings
-        self.camera_fps = 60  # Increased target FPS for smoother video
-        self.frame_interval = int(1000 / self.camera_fps)  # Interval between frames in ms
-        self.last_frame_time = 0
-        self.frame_skip = 1  # Process every frame for smoother experience
-        self.frame_count = 0
-        self.target_resolution = (800, 600)  # Higher resolution for better quality
+        # Display settings
+        self.idle_poll_interval = 5  # ms to wait when no new frame has arrived
+        self.display_size = (640, 480)
+        self.max_display_fps = 30  # Redraw limit, independent of the camera frame rate
         
         # Create main frame
         self.main_frame = tk.Frame(self.root)
@@ -193,73 +174,94 @@ class FaceAuthSystem:
         # Create buttons
         self.create_widgets()
         
-        # Face recognition parameters
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.face_locations = []
-        self.face_encodings = []
-        self.face_names = []
-        self.process_this_frame = True
-        
-        # Registration parameters
-        self.registration_images = []
-        self.registration_count = 0
-        self.registration_required = 5
-        
-        # Login parameters
-        self.login_attempts = 0
-        self.max_login_attempts = 3
-        self.recognition_threshold = 0.4  # Lower threshold for stricter matching
-        
-        # Timing parameters for 10-second delay
-        self.camera_start_time = None
-        self.recognition_delay = 4 # 4 seconds delay before recognition starts
-        self.countdown_active = False
-        
-        # Lighting parameters
-        self.low_light_threshold = 40  # Adjust this value based on testing
-        self.consecutive_low_light_frames = 0
-        self.max_low_light_frames = 10
-        
-        # Load known faces
-        self.load_known_faces()
-        
-    def check_lighting_conditions(self, frame):
-        """Check if the lighting conditions are adequate"""
-        # Convert frame to grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Calculate average brightness
-        brightness = np.mean(gray)
-        
-        if brightness < self.low_light_threshold:
-            self.consecutive_low_light_frames += 1
-            if self.consecutive_low_light_frames >= self.max_low_light_frames:
-                return False, "Low light detected. Please improve lighting conditions."
-        else:
-            self.consecutive_low_light_frames = 0
-            
-        return True, ""
-        
-    def init_database(self):
-        """Initialize SQLite database and create necessary tables"""
+        # The recognition engine (models, database, known faces) and the web
+        # server are loaded in the background after the window has painted
+        self.engine = None
+        self.load_error = None
+        self.ready = threading.Event()
+        self.pending_events = queue.Queue()
+        self.timer = startup_timer
+        self.profile_startup = ("--profile-startup" in sys.argv
+                                or bool(os.environ.get("FACE_AUTH_PROFILE_STARTUP")))
+        self.status_label.config(text="Loading face recognition models...")
+        self.root.after_idle(self.start_background_loading)
+        
+    def start_background_loading(self):
+        """Start loading the heavy parts once the first frame has painted"""
+        self.timer.mark("first paint")
+        threading.Thread(target=self.load_in_background, name="StartupLoader", daemon=True).start()
+        self.root.after(50, self.check_ready)
+        
+    def load_in_background(self):
+        """Import the recognition stack, create the engine and start the web server"""
         try:
-            self.conn = sqlite3.connect('face_auth.db')
-            self.cursor = self.conn.cursor()
+            # cv2, dlib and face_recognition are imported by auth_engine anyway;
+            # importing them one by one here only makes their cost visible
+            with self.timer.phase("import cv2"):
+                import cv2
+            with self.timer.phase("import dlib"):
+                import dlib
+            with self.timer.phase("import face_recognition"):
+                import face_recognition
+            with self.timer.phase("import PIL"):
+                from PIL import Image, ImageTk
+            with self.timer.phase("import auth_engine"):
+                from auth_engine import FaceAuthEngine
+            with self.timer.phase("engine init"):
+                # The connection is handed to the Tk thread once ready
+                self.engine = FaceAuthEngine(listener=self.queue_event,
+                                             timer=self.timer, check_same_thread=False,
+                                             gallery_precision=os.environ.get("FACE_AUTH_GALLERY_PRECISION") or None,
+                                             use_recognition_worker=bool(os.environ.get("FACE_AUTH_RECOGNITION_WORKER")))
+        except Exception as e:
+            self.load_error = e
+        finally:
+            self.ready.set()
             
-            # Create users table if it doesn't exist
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    face_encoding BLOB NOT NULL
-                )
-            ''')
-            self.conn.commit()
-        except sqlite3.Error as e:
-            messagebox.showerror("Database Error", f"Failed to initialize database: {str(e)}")
+        if self.load_error is None:
+            try:
+                with self.timer.phase("start web server"):
+                    start_server(self.engine.db_path)
+            except Exception as e:
+                print(f"Failed to start web server: {e}")
+            
+    def queue_event(self, event, data):
+        """Engine listener used while loading; events are replayed on the Tk thread"""
+        self.pending_events.put((event, data))
+        
+    def check_ready(self):
+        """Poll the background loader and enable the UI when it is done"""
+        if not self.ready.is_set():
+            self.root.after(50, self.check_ready)
+            return
+            
+        if self.load_error is not None:
+            if isinstance(self.load_error, sqlite3.Error):
+                messagebox.showerror("Database Error", f"Failed to initialize database: {str(self.load_error)}")
+            else:
+                messagebox.showerror("Model Load Error", 
+                                    f"Failed to load dlib model:\n{self.load_error}\n\n"
+                                    f"Please ensure the model file 'shape_predictor_68_face_landmarks.dat' is present in the same directory as the executable.")
             self.root.destroy()
+            sys.exit(1)
             
+        self.engine.listener = self.handle_event
+        # cv2 and PIL were imported by the background loader, so this is cheap
+        from rendering import FrameRenderer
+        self.renderer = FrameRenderer(self.video_frame, self.display_size, max_fps=self.max_display_fps)
+        self.display_seconds = self.engine.metrics.histogram(
+            "face_auth_display_seconds", "Time to resize and draw one frame")
+        self.status_label.config(text="")
+        while not self.pending_events.empty():
+            self.handle_event(*self.pending_events.get_nowait())
+        self.register_btn.config(state=tk.NORMAL)
+        self.login_btn.config(state=tk.NORMAL)
+        self.verify_btn.config(state=tk.NORMAL)
+        
+        self.timer.mark("ready")
+        if self.profile_startup:
+            print(self.timer.report())
+        
     def create_widgets(self):
         """Create GUI widgets"""
         # Welcome message
@@ -279,22 +281,34 @@ class FaceAuthSystem:
         button_frame.pack(pady=40)
         
         # Register button
-        register_btn = tk.Button(button_frame, 
+        self.register_btn = tk.Button(button_frame, 
                                text="Register", 
                                command=self.start_registration,
                                width=20, 
                                height=3,
-                               font=("Arial", 12, "bold"))
-        register_btn.pack(side=tk.LEFT, padx=20)
+                               font=("Arial", 12, "bold"),
+                               state=tk.DISABLED)
+        self.register_btn.pack(side=tk.LEFT, padx=20)
         
         # Login button
-        login_btn = tk.Button(button_frame, 
+        self.login_btn = tk.Button(button_frame, 
                             text="Login", 
                             command=self.start_login,
                             width=20, 
                             height=3,
-                            font=("Arial", 12, "bold"))
-        login_btn.pack(side=tk.LEFT, padx=20)
+                            font=("Arial", 12, "bold"),
+                            state=tk.DISABLED)
+        self.login_btn.pack(side=tk.LEFT, padx=20)
+        
+        # Verify button: login as a given user (1:1 match)
+        self.verify_btn = tk.Button(button_frame, 
+                             text="Login As...", 
+                             command=self.start_verification,
+                             width=20, 
+                             height=3,
+                             font=("Arial", 12, "bold"),
+                             state=tk.DISABLED)
+        self.verify_btn.pack(side=tk.LEFT, padx=20)
         
         # Video frame
         self.video_frame = tk.Label(self.main_frame)
@@ -312,48 +326,19 @@ class FaceAuthSystem:
         self.lighting_label = tk.Label(self.main_frame, text="", font=("Arial", 12), fg="red")
         self.lighting_label.pack(pady=5)
         
-    def load_known_faces(self):
-        """Load known faces from database"""
-        try:
-            self.cursor.execute("SELECT username, face_encoding FROM users")
-            for username, face_encoding in self.cursor.fetchall():
-                self.known_face_names.append(username)
-                self.known_face_encodings.append(np.frombuffer(face_encoding))
-        except sqlite3.Error as e:
-            messagebox.showerror("Database Error", f"Failed to load known faces: {str(e)}")
-    
-    def check_face_already_registered(self, new_face_encoding):
-        """Check if the face is already registered in the database"""
-        if not self.known_face_encodings:
-            return False, ""
-    
-        # Compare with all existing face encodings
-        face_distances = face_recognition.face_distance(
-            self.known_face_encodings,
-        new_face_encoding
-    )
-        # Find the closest match
-        min_distance = np.min(face_distances)
-        closest_match_index = np.argmin(face_distances)
-        
-        # If the face is too similar to an existing one
-        duplicate_threshold = 0.5  # Adjust this value as needed
-        
-        if min_distance < duplicate_threshold:
-            existing_username = self.known_face_names[closest_match_index]
-            return True, existing_username
-        
-        return False, ""
-            
     def start_registration(self):
         """Start the registration process"""
-        if self.is_camera_active:
+        if self.engine.is_camera_active:
             messagebox.showwarning("Warning", "Camera is already in use. Please wait.")
             return
             
+        self.ask_username("Registration", self.register_user)
+        
+    def ask_username(self, title, on_submit):
+        """Show a dialog asking for a username and pass it to `on_submit`"""
         # Create a custom dialog for username input
         dialog = tk.Toplevel(self.root)
-        dialog.title("Registration")
+        dialog.title(title)
         dialog.geometry("400x200")
         
         # Center the dialog
@@ -378,7 +363,7 @@ class FaceAuthSystem:
             username = username_var.get().strip()
             if username:
                 dialog.destroy()
-                self.register_user(username)
+                on_submit(username)
             else:
                 messagebox.showwarning("Warning", "Please enter a username")
         
@@ -396,287 +381,98 @@ class FaceAuthSystem:
         
         # Set focus to entry
         entry.focus_set()
-        
-    def register_user(self, username):
-        """Handle user registration process"""
-        self.current_username = username
-        self.registration_images = []
-        self.registration_count = 0
-        
-        # Initialize camera if not already done
-        if self.camera is None:
-            self.camera = cv2.VideoCapture(0)
-            if not self.camera.isOpened():
-                messagebox.showerror("Error", "Could not open camera! Please check if it's connected and not in use by another application.")
-                return
                 
-            # Set camera properties for better performance
-            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.target_resolution[0])
-            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.target_resolution[1])
-            self.camera.set(cv2.CAP_PROP_FPS, self.camera_fps)
-            self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Reduce buffer size for real-time processing
-                
-        self.is_camera_active = True
-        self.camera_start_time = time.time()
-        self.countdown_active = True
-        
-        # Start camera feed
-        self.update_camera_feed()
-        
-    def update_camera_feed(self):
-        """Update camera feed and handle face detection with improved performance"""
-        if not self.is_camera_active:
-            return
-            
-        # Calculate time since camera started
-        if self.camera_start_time is not None:
-            elapsed_time = time.time() - self.camera_start_time
-            remaining_time = max(0, self.recognition_delay - elapsed_time)
-            
-            if remaining_time > 0 and self.countdown_active:
-                self.countdown_label.config(text=f"Please wait... Recognition starts in {int(remaining_time + 1)} seconds")
-                can_recognize = False
-            else:
-                self.countdown_label.config(text="")
-                can_recognize = True
-                self.countdown_active = False
-        else:
-            can_recognize = True
-            
-        ret, frame = self.camera.read()
-        if not ret:
-            self.status_label.config(text="Failed to capture frame. Please check camera connection.")
-            self.root.after(10, self.update_camera_feed)
-            return
-            
-        # Check lighting conditions
-        lighting_ok, lighting_message = self.check_lighting_conditions(frame)
-        if not lighting_ok:
-            self.lighting_label.config(text=lighting_message)
-            if can_recognize:
-                self.status_label.config(text="Waiting for better lighting conditions...")
-        else:
-            self.lighting_label.config(text="")
-            
-        # Convert frame to RGB for face_recognition
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # Process face detection with improved performance
-        self.frame_count += 1
-        if self.frame_count % self.frame_skip == 0 and lighting_ok:
-            # Detect faces with optimized settings
-            face_locations = face_recognition.face_locations(rgb_frame, model="hog", number_of_times_to_upsample=1)
-            
-            if len(face_locations) == 0:
-                if can_recognize:
-                    self.status_label.config(text="No face detected. Please position your face in the camera view.")
-            elif len(face_locations) > 1:
-                if can_recognize:
-                    self.status_label.config(text="Multiple faces detected. Please ensure only one face is visible.")
-            else:
-                # Draw rectangle around face
-                top, right, bottom, left = face_locations[0]
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+    def handle_event(self, event, data):
+        """Reflect engine events in the UI"""
+        if event == "status":
+            self.status_label.config(text=data["text"])
+        elif event == "countdown":
+            self.countdown_label.config(text=data["text"])
+        elif event == "lighting":
+            self.lighting_label.config(text=data["text"])
+        elif event == "error":
+            messagebox.showerror(data["title"], data["message"])
+        elif event == "info":
+            messagebox.showinfo(data["title"], data["message"])
+        elif event == "camera_stopped":
+            # Clear the video frame
+            self.renderer.clear()
+        elif event == "registration_completed":
+            messagebox.showinfo("Success", "Registration completed successfully!")
+        elif event == "registration_failed":
+            messagebox.showerror("Error", data["message"])
+        elif event == "login_succeeded":
+            # Open dashboard (which will handle the redirect)
+            DashboardWindow(self.root, data["username"])
+        elif event == "login_failed":
+            if data["final"]:
+                messagebox.showerror("Error", data["message"])
+            elif not data["retrying"]:
+                # A streaming login moves on to the next attempt by itself and
+                # only updates the status label, so this is the single-frame mode
+                messagebox.showerror("User Not Found", data["message"])
+                # Restart login for another attempt once the current frame is done
+                self.root.after(0, self.retry_login)
                 
-                # Only process recognition after the delay
-                if can_recognize:
-                    # If in registration mode, capture face
-                    if hasattr(self, 'current_username'):
-                        if self.registration_count < self.registration_required:
-                            face_encodings = face_recognition.face_encodings(rgb_frame, [face_locations[0]])
-                            if face_encodings:
-                                face_encoding = face_encodings[0]
-                                self.registration_images.append(face_encoding)
-                                self.registration_count += 1
-                                
-                                if self.registration_count < self.registration_required:
-                                    self.status_label.config(text=f"Registration in progress... Capture {self.registration_count + 1}/{self.registration_required}")
-                                else:
-                                    self.complete_registration()
-                                    return
-                    # If in login mode, verify face
-                    elif hasattr(self, 'login_mode'):
-                        face_encodings = face_recognition.face_encodings(rgb_frame, [face_locations[0]])
-                        if face_encodings:
-                            face_encoding = face_encodings[0]
-                            self.verify_face(face_encoding)
-                            return
-                else:
-                    if hasattr(self, 'current_username'):
-                        self.status_label.config(text=f"Get ready for registration... {int(remaining_time + 1)} seconds remaining")
-                    elif hasattr(self, 'login_mode'):
-                        self.status_label.config(text=f"Get ready for login... {int(remaining_time + 1)} seconds remaining")
-                        
-        # Convert frame to PhotoImage with better quality
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        image = Image.fromarray(frame_rgb)
-        # Resize image to fit the display area better
-        display_size = (640, 480)
-        image = image.resize(display_size, Image.Resampling.LANCZOS)
-        photo = ImageTk.PhotoImage(image=image)
-        
-        # Update video frame
-        self.video_frame.config(image=photo)
-        self.video_frame.image = photo
-        
-        # Schedule next update with minimal delay for smoother video
-        self.root.after(1, self.update_camera_feed)
-        
-    def complete_registration(self):
-        """Complete the registration process"""
-        # Stop camera and clear display first
-        self.stop_camera_and_clear_display()
-        
-        if len(self.registration_images) == self.registration_required:
-            # Calculate average face encoding
-            avg_encoding = np.mean(self.registration_images, axis=0)
-
-            # Check if this face is already registered
-            is_duplicate, existing_username = self.check_face_already_registered(avg_encoding)
-            if is_duplicate:
-                messagebox.showerror("Error", f"This face is already registered with username: {existing_username}")
-                self.status_label.config(text="Registration failed - Face already exists")
-                # Cleanup
-                if hasattr(self, 'current_username'):
-                    delattr(self, 'current_username')
-                return
-            
-            # Verify the quality of the registration
-            face_distances = []
-            for encoding in self.registration_images:
-                distance = face_recognition.face_distance([avg_encoding], encoding)[0]
-                face_distances.append(distance)
-            
-            # Check if the registration samples are consistent
-            if max(face_distances) > 0.3:  # If samples vary too much
-                messagebox.showerror("Error", "Registration failed. Please try again with more consistent face positioning.")
-                self.status_label.config(text="Registration failed - inconsistent samples")
-                return
+    def register_user(self, username):
+        """Handle user registration process"""
+        if self.engine.start_registration(username):
+            # Start camera feed
+            self.update_camera_feed()
             
-            try:
-                # Save to database
-                self.cursor.execute(
-                    "INSERT INTO users (username, face_encoding) VALUES (?, ?)",
-                    (self.current_username, avg_encoding.tobytes())
-                )
-                self.conn.commit()
-                
-                # Update known faces
-                self.known_face_names.append(self.current_username)
-                self.known_face_encodings.append(avg_encoding)
-                
-                messagebox.showinfo("Success", "Registration completed successfully!")
-                self.status_label.config(text="Registration completed")
-                
-            except sqlite3.Error as e:
-                messagebox.showerror("Error", f"Failed to save registration: {str(e)}")
-                
-        # Cleanup
-        if hasattr(self, 'current_username'):
-            delattr(self, 'current_username')
-        
-    def stop_camera_and_clear_display(self):
-        """Stop camera and clear the video display"""
-        self.is_camera_active = False
-        if self.camera is not None:
-            self.camera.release()
-            self.camera = None
-        
-        # Clear the video frame
-        self.video_frame.config(image="")
-        self.video_frame.image = None
-        
-        # Clear status labels
-        self.countdown_label.config(text="")
-        self.lighting_label.config(text="")
-        
-        # Reset timing variables
-        self.camera_start_time = None
-        self.countdown_active = False
-        
     def start_login(self):
         """Start the login process"""
-        if self.is_camera_active:
+        if self.engine.is_camera_active:
             messagebox.showwarning("Warning", "Camera is already in use. Please wait.")
             return
             
-        if not self.known_face_names:
+        # Pick up users registered or deleted elsewhere before checking
+        self.engine.sync_gallery()
+        if len(self.engine.gallery) == 0:
             messagebox.showinfo("Info", "No registered users found. Please register first.")
             return
             
-        self.login_mode = True
-        self.login_attempts = 0
-        
-        # Initialize camera if not already done
-        if self.camera is None:
-            self.camera = cv2.VideoCapture(0)
-            if not self.camera.isOpened():
-                messagebox.showerror("Error", "Could not open camera! Please check if it's connected and not in use by another application.")
-                return
-                
-            # Set camera properties for better performance
-            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.target_resolution[0])
-            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.target_resolution[1])
-            self.camera.set(cv2.CAP_PROP_FPS, self.camera_fps)
-            self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-                
-        self.is_camera_active = True
-        self.camera_start_time = time.time()
-        self.countdown_active = True
-        
-        # Start camera feed
-        self.update_camera_feed()
-        
-    def verify_face(self, face_encoding):
-        """Verify face against known faces"""
-        if not hasattr(self, 'login_mode'):
-            return
+        if self.engine.start_login():
+            # Start camera feed
+            self.update_camera_feed()
             
-        # Stop camera and clear display first
-        self.stop_camera_and_clear_display()
-        
-        # Compare face with known faces
-        face_distances = face_recognition.face_distance(
-            self.known_face_encodings, 
-            face_encoding
-        )
-        
-        # Get the best match
-        best_match_index = np.argmin(face_distances)
-        best_match_distance = face_distances[best_match_index]
-        
-        # Check if the best match is within threshold
-        if best_match_distance <= self.recognition_threshold:
-            username = self.known_face_names[best_match_index]
-            
-            self.status_label.config(text=f"Face recognized as {username}")
+    def start_verification(self):
+        """Start a login that only checks the face against the named user"""
+        if self.engine.is_camera_active:
+            messagebox.showwarning("Warning", "Camera is already in use. Please wait.")
+            return
             
-            # Cleanup login mode
-            if hasattr(self, 'login_mode'):
-                delattr(self, 'login_mode')
+        self.ask_username("Login As", self.verify_user)
+        
+    def verify_user(self, username):
+        """Handle a claimed-identity login for `username`"""
+        # Pick up users registered or deleted elsewhere before the lookup
+        self.engine.sync_gallery()
+        if self.engine.start_login(claimed_username=username):
+            # Start camera feed
+            self.update_camera_feed()
             
-            # Open dashboard (which will handle the redirect)
-            DashboardWindow(self.root, username)
+    def retry_login(self):
+        """Start another login attempt without resetting the attempt counter"""
+        if self.engine.start_login(reset_attempts=False):
+            self.update_camera_feed()
+        
+    def update_camera_feed(self):
+        """Run the engine on the newest frame and display the result"""
+        frame = self.engine.process_frame()
+        if not self.engine.is_camera_active:
+            return
+        if frame is None:
+            self.root.after(self.idle_poll_interval, self.update_camera_feed)
+            return
             
-        else:
-            self.login_attempts += 1
-            if self.login_attempts >= self.max_login_attempts:
-                messagebox.showerror("Error", "Maximum login attempts reached. Please try again later.")
-                self.status_label.config(text="Login failed")
-                
-                # Cleanup
-                if hasattr(self, 'login_mode'):
-                    delattr(self, 'login_mode')
-            else:
-                messagebox.showerror("User Not Found", "User not found in the database. Please try again or register first.")
-                self.status_label.config(text=f"User not found in the database. Attempt {self.login_attempts}/{self.max_login_attempts}")
-                # Restart login process for another attempt
-                self.start_login()
+        # Reuse the engine's RGB frame; the renderer skips frames above its FPS cap
+        if self.renderer.is_due():
+            with self.display_seconds.time():
+                self.renderer.render(self.engine.last_rgb_frame, self.engine.last_face_box)
         
-    def check_username_exists(self, username):
-        """Check if username already exists in database"""
-        self.cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-        return self.cursor.fetchone() is not None
+        # Schedule next update with minimal delay for smoother video
+        self.root.after(1, self.update_camera_feed)
         
     def run(self):
         """Start the application"""
@@ -684,14 +480,13 @@ class FaceAuthSystem:
         
     def cleanup(self):
         """Cleanup resources"""
-        if self.camera is not None:
-            self.camera.release()
-        if hasattr(self, 'conn'):
-            self.conn.close()
+        if self.engine is not None:
+            self.engine.cleanup()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Needed for the recognition worker in PyInstaller builds
     app = FaceAuthSystem()
     try:
         app.run()
     finally:
-        app.cleanup()
\ No newline at end of file
+        app.cleanup()
@@ -0,0 +1,296 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import storage
+from thresholds import DUPLICATE_THRESHOLD
+
+# Width of the pair-distance histogram bins; distances between encodings stay below 2
+HISTOGRAM_BIN_WIDTH = 0.005
+HISTOGRAM_MAX_DISTANCE = 2.0
+DEFAULT_THRESHOLDS = (0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6)
+
+
+class UnionFind:
+    """Disjoint sets over row numbers, used to group duplicate pairs into clusters"""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        root = self.parent.setdefault(item, item)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        # Path compression
+        while item != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    def groups(self):
+        """Members of every set with more than one element"""
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return [sorted(members) for members in groups.values() if len(members) > 1]
+
+
+class DuplicateAudit:
+    """All-pairs distance audit of the enrolled encodings.
+
+    Distances are computed `block_size` x `block_size` at a time over the
+    upper triangle, so memory stays at one block plus a few per-user
+    arrays however large the gallery is. Each block updates every user's
+    nearest other user, adds to a histogram of all pair distances, and
+    keeps the pairs closer than `duplicate_threshold` (at most
+    `max_pairs`) for clustering.
+    """
+
+    def __init__(self, encodings, duplicate_threshold=DUPLICATE_THRESHOLD, block_size=2048,
+                 max_pairs=1000000):
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+        self.duplicate_threshold = duplicate_threshold
+        self.block_size = block_size
+        self.max_pairs = max_pairs
+
+        count = len(self.encodings)
+        self.sq_norms = np.einsum("ij,ij->i", self.encodings, self.encodings)
+        self.nearest_distance = np.full(count, np.inf, dtype=np.float32)
+        self.nearest_row = np.full(count, -1, dtype=np.int64)
+        self.histogram = np.zeros(int(round(HISTOGRAM_MAX_DISTANCE / HISTOGRAM_BIN_WIDTH)), dtype=np.int64)
+        self.pairs = []
+        self.pairs_truncated = False
+        self.elapsed = 0.0
+
+    @property
+    def pair_count(self):
+        return int(self.histogram.sum())
+
+    def block_distances(self, rows, cols):
+        """Distance matrix between two row ranges"""
+        sq_distances = self.encodings[rows] @ self.encodings[cols].T
+        sq_distances *= -2.0
+        sq_distances += self.sq_norms[rows, None]
+        sq_distances += self.sq_norms[None, cols]
+        np.maximum(sq_distances, 0.0, out=sq_distances)
+        return np.sqrt(sq_distances, out=sq_distances)
+
+    def _update_nearest(self, users, distances, axis, offset):
+        """Fold a block's per-row (axis=1) or per-column (axis=0) minima into
+        the running nearest neighbours of `users`; `offset` is the first row
+        of the other side of the block"""
+        best = distances.argmin(axis=axis)
+        best_distance = distances.min(axis=axis)
+        closer = best_distance < self.nearest_distance[users]
+        indices = np.arange(users.start, users.stop)[closer]
+        self.nearest_distance[indices] = best_distance[closer]
+        self.nearest_row[indices] = best[closer] + offset
+
+    def run(self, progress=None):
+        """Scan every block pair once. `progress(done, total)` is called per block row"""
+        start_time = time.perf_counter()
+        count = len(self.encodings)
+        starts = range(0, count, self.block_size)
+        inv_width = 1.0 / HISTOGRAM_BIN_WIDTH
+        last_bin = len(self.histogram) - 1
+
+        for block_index, row_start in enumerate(starts):
+            rows = slice(row_start, min(row_start + self.block_size, count))
+            for col_start in range(row_start, count, self.block_size):
+                cols = slice(col_start, min(col_start + self.block_size, count))
+                distances = self.block_distances(rows, cols)
+                diagonal = col_start == row_start
+                if diagonal:
+                    # Only pairs above the diagonal; a user is not its own neighbour
+                    np.fill_diagonal(distances, np.inf)
+                    upper = np.triu(np.ones(distances.shape, dtype=bool), k=1)
+                    pair_distances = distances[upper]
+                else:
+                    pair_distances = distances.ravel()
+
+                bins = np.minimum((pair_distances * inv_width).astype(np.int64), last_bin)
+                self.histogram += np.bincount(bins, minlength=len(self.histogram))
+
+                # Nearest other user, from both sides of the block
+                self._update_nearest(rows, distances, axis=1, offset=col_start)
+                if not diagonal:
+                    self._update_nearest(cols, distances, axis=0, offset=row_start)
+
+                close_rows, close_cols = np.nonzero(distances < self.duplicate_threshold)
+                if diagonal:
+                    keep = close_rows < close_cols
+                    close_rows, close_cols = close_rows[keep], close_cols[keep]
+                room = self.max_pairs - len(self.pairs)
+                if len(close_rows) > room:
+                    self.pairs_truncated = True
+                    close_rows, close_cols = close_rows[:room], close_cols[:room]
+                self.pairs.extend(zip((close_rows + row_start).tolist(), (close_cols + col_start).tolist(),
+                                      distances[close_rows, close_cols].tolist()))
+            if progress is not None:
+                progress(block_index + 1, len(starts))
+        self.elapsed = time.perf_counter() - start_time
+
+    def clusters(self):
+        """Rows grouped into clusters of suspected duplicates"""
+        union_find = UnionFind()
+        for row_a, row_b, _ in self.pairs:
+            union_find.union(row_a, row_b)
+        return union_find.groups()
+
+    def false_accept_rates(self, thresholds):
+        """Per threshold: share of all pairs of distinct users closer than it
+        (pair FAR) and share of users whose nearest other user is (the
+        chance a login by that user could be matched to someone else)"""
+        cumulative = np.cumsum(self.histogram)
+        total = max(self.pair_count, 1)
+        users = max(len(self.encodings), 1)
+        rates = []
+        for threshold in thresholds:
+            bins_below = min(int(round(threshold / HISTOGRAM_BIN_WIDTH)), len(cumulative))
+            pairs_below = int(cumulative[bins_below - 1]) if bins_below > 0 else 0
+            users_below = int(np.count_nonzero(self.nearest_distance < threshold))
+            rates.append({
+                "threshold": threshold,
+                "pairs_below": pairs_below,
+                "pair_far": pairs_below / total,
+                "users_with_impostor_below": users_below,
+                "user_far": users_below / users,
+            })
+        return rates
+
+
+def build_report(audit, ids, usernames, recognition_threshold, thresholds, worst=20):
+    """Collect clusters, impostor margins and threshold statistics as plain data"""
+    groups = audit.clusters()
+    cluster_of = {row: index for index, rows in enumerate(groups) for row in rows}
+    pair_distances = [[] for _ in groups]
+    for row_a, _, distance in audit.pairs:
+        pair_distances[cluster_of[row_a]].append(distance)
+    clusters = [{
+        "members": [{"id": ids[row], "username": usernames[row]} for row in rows],
+        "min_distance": min(distances),
+        "max_distance": max(distances),
+    } for rows, distances in zip(groups, pair_distances)]
+    clusters.sort(key=lambda cluster: cluster["min_distance"])
+
+    finite = np.isfinite(audit.nearest_distance)
+    margins = audit.nearest_distance[finite] - recognition_threshold
+    closest = []
+    seen = set()
+    for row in np.argsort(audit.nearest_distance, kind="stable").tolist():
+        if len(closest) >= worst or not finite[row]:
+            break
+        nearest = int(audit.nearest_row[row])
+        # Mutual nearest neighbours are listed once
+        if (nearest, row) in seen:
+            continue
+        seen.add((row, nearest))
+        closest.append({
+            "id": ids[row],
+            "username": usernames[row],
+            "nearest_id": ids[nearest],
+            "nearest_username": usernames[nearest],
+            "distance": float(audit.nearest_distance[row]),
+            "margin": float(audit.nearest_distance[row] - recognition_threshold),
+        })
+
+    return {
+        "users": len(ids),
+        "pairs": audit.pair_count,
+        "elapsed_seconds": audit.elapsed,
+        "duplicate_threshold": audit.duplicate_threshold,
+        "recognition_threshold": recognition_threshold,
+        "duplicate_pairs": len(audit.pairs),
+        "duplicate_pairs_truncated": audit.pairs_truncated,
+        "clusters": clusters,
+        "margin_percentiles": {
+            str(p): float(np.percentile(margins, p)) for p in (1, 5, 25, 50)
+        } if len(margins) else {},
+        "users_below_recognition_threshold": int(np.count_nonzero(margins < 0)),
+        "closest_users": closest,
+        "thresholds": audit.false_accept_rates(thresholds),
+    }
+
+
+def print_report(report, max_clusters=20):
+    """Print a human-readable summary of `report`"""
+    print("\n=== Duplicate Audit ===")
+    print(f"Users: {report['users']}, pairs compared: {report['pairs']} in {report['elapsed_seconds']:.1f} s")
+    print(f"Suspected duplicate pairs (< {report['duplicate_threshold']}): {report['duplicate_pairs']}"
+          + (" (truncated)" if report["duplicate_pairs_truncated"] else ""))
+    print(f"Clusters: {len(report['clusters'])}")
+    for cluster in report["clusters"][:max_clusters]:
+        names = ", ".join(f"{member['username']} (#{member['id']})" for member in cluster["members"])
+        print(f"  {cluster['min_distance']:.3f}-{cluster['max_distance']:.3f}: {names}")
+    if len(report["clusters"]) > max_clusters:
+        print(f"  ... {len(report['clusters']) - max_clusters} more")
+
+    print(f"\nNearest-impostor margin (distance - {report['recognition_threshold']}):")
+    for percentile, value in report["margin_percentiles"].items():
+        print(f"  p{percentile}: {value:+.3f}")
+    print(f"Users whose nearest other user is within the recognition threshold: "
+          f"{report['users_below_recognition_threshold']}")
+    if report["closest_users"]:
+        print("Closest users:")
+        for entry in report["closest_users"]:
+            print(f"  {entry['username']} <-> {entry['nearest_username']}: {entry['distance']:.3f} "
+                  f"(margin {entry['margin']:+.3f})")
+
+    print("\nThreshold   pairs below   pair FAR      users at risk   user FAR")
+    for rate in report["thresholds"]:
+        print(f"{rate['threshold']:9.2f}   {rate['pairs_below']:11d}   {rate['pair_far']:.3e}   "
+              f"{rate['users_with_impostor_below']:13d}   {rate['user_far']:.3e}")
+    print("(One encoding is stored per user, so there are no genuine pairs to estimate FRR from.)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find duplicate and easily confused users in the database")
+    parser.add_argument("--db", default=storage.DEFAULT_DB_PATH, help="Path to the SQLite database")
+    parser.add_argument("--duplicate-threshold", type=float, default=DUPLICATE_THRESHOLD,
+                        help="Pairs closer than this are reported as suspected duplicates")
+    parser.add_argument("--recognition-threshold", type=float, default=0.4,
+                        help="Login threshold the impostor margins are measured against")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=list(DEFAULT_THRESHOLDS),
+                        help="Candidate thresholds for the false-accept table")
+    parser.add_argument("--block-size", type=int, default=2048,
+                        help="Rows per distance block; memory use grows with its square")
+    parser.add_argument("--max-pairs", type=int, default=1000000, help="Suspected duplicate pairs to keep")
+    parser.add_argument("--output", help="Write the full report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    conn = storage.connect(args.db)
+    try:
+        ids, usernames, encodings = storage.load_encodings(conn)
+    finally:
+        conn.close()
+    if len(ids) < 2:
+        print("Fewer than two users registered, nothing to audit")
+        return 0
+
+    audit = DuplicateAudit(encodings, duplicate_threshold=args.duplicate_threshold,
+                           block_size=args.block_size, max_pairs=args.max_pairs)
+
+    def progress(done, total):
+        print(f"\rScanning blocks: {done}/{total}", end="", file=sys.stderr, flush=True)
+
+    audit.run(progress=progress)
+    print(file=sys.stderr)
+
+    report = build_report(audit, ids, usernames, args.recognition_threshold, sorted(args.thresholds))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+    return 1 if report["clusters"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
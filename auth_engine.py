@@ -0,0 +1,964 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+import cv2
+import dlib
+import face_recognition
+import numpy as np
+
+import metrics
+import storage
+from gallery import FaceGallery
+from gallery_snapshot import (SnapshotError, load_gallery_from_snapshot, open_snapshot, snapshot_path_for,
+                              write_snapshot)
+from gallery_sync import GallerySync
+from quantized_gallery import QuantizedGallery
+from sharded_gallery import ShardedGallery
+from ann_index import index_path_for, load_or_build_index
+from capture import FrameGrabber
+from frame_sources import CAPTURE_RESOLUTION, SessionRecorder, open_source
+from detection import FaceDetector
+from encoding_cache import EncodingCache, crop_signature
+from quality import REASON_MESSAGES, QualityGate
+from streaming_verifier import ACCEPT, StreamingVerifier
+from user_lookup import UserLookup
+from recognition_worker import RecognitionWorker
+from thresholds import DUPLICATE_THRESHOLD, MAX_SAMPLE_DISTANCE
+
+PREDICTOR_MODEL_NAME = "shape_predictor_68_face_landmarks.dat"
+PREDICTOR_MODEL_REL = "face_recognition_models/models/shape_predictor_68_face_landmarks.dat"
+
+
+def resource_path(relative_path):
+    """ Get absolute path to resource, works for dev and for PyInstaller """
+    try:
+        # PyInstaller creates a temp folder and stores path in _MEIPASS
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+
+    # Try multiple possible locations for the model file
+    possible_paths = [
+        os.path.join(base_path, relative_path),  # Direct path
+        os.path.join(base_path, "face_recognition_models", "models", PREDICTOR_MODEL_NAME),  # Nested path
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), relative_path),  # Script directory
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "face_recognition_models", "models", PREDICTOR_MODEL_NAME)  # Script directory nested
+    ]
+
+    # Try each path
+    for path in possible_paths:
+        if os.path.exists(path):
+            return path
+
+    # If no path works, return the first attempted path for error reporting
+    return possible_paths[0]
+
+
+def load_predictor():
+    """Load the dlib 68-point landmark predictor.
+
+    Raises FileNotFoundError if the model file cannot be found; callers
+    decide how to report it.
+    """
+    predictor_path = resource_path(PREDICTOR_MODEL_REL)
+    if not os.path.exists(predictor_path):
+        # Try to find the model in the current directory
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        possible_locations = [
+            os.path.join(current_dir, PREDICTOR_MODEL_NAME),
+            os.path.join(current_dir, "face_recognition_models", "models", PREDICTOR_MODEL_NAME),
+            os.path.join(current_dir, "models", PREDICTOR_MODEL_NAME)
+        ]
+
+        for loc in possible_locations:
+            if os.path.exists(loc):
+                predictor_path = loc
+                break
+        else:
+            raise FileNotFoundError(f"Could not find face predictor model at any of these locations:\n" +
+                                  "\n".join(possible_locations))
+
+    return dlib.shape_predictor(predictor_path)
+
+
+class FaceAuthEngine:
+    """Face registration and login pipeline without any UI.
+
+    The engine owns the database, gallery, camera and recognition stages.
+    Progress is reported through `listener(event, data)`, where `event` is
+    one of:
+
+    - "status", "countdown", "lighting": {"text"} (only sent on change)
+    - "error", "info": {"title", "message"}
+    - "camera_stopped": {}
+    - "registration_completed": {"username", "quality"} (mean sample quality score)
+    - "registration_failed": {"username", "reason", "message"}
+    - "login_succeeded": {"username", "distance"}
+    - "login_failed": {"attempts", "max_attempts", "final", "retrying", "message"}
+      ("retrying" means the camera is still running the next attempt)
+
+    A front end drives it by calling `start_registration` or `start_login`
+    and then `process_frame` repeatedly until `is_camera_active` is False.
+    """
+
+    def __init__(self, db_path=storage.DEFAULT_DB_PATH, listener=None, timer=None, check_same_thread=True,
+                 metrics_registry=None, gallery_precision=None, gallery_shards=None, use_gallery_snapshot=True,
+                 use_recognition_worker=False):
+        self.db_path = db_path
+        self.listener = listener
+        self._last_text = {}
+        # Optional startup.StartupTimer that records the init phases below
+        self.timer = timer
+        # False lets a front end create the engine on a loader thread and
+        # then drive it from its UI thread
+        self.check_same_thread = check_same_thread
+
+        # Load the dlib landmark model up front so a missing file fails fast
+        with self.startup_phase("load landmark model"):
+            self.predictor = load_predictor()
+
+        # Initialize database (raises sqlite3.Error on failure)
+        with self.startup_phase("open database"):
+            self.init_database()
+
+        # Initialize camera
+        self.camera = None
+        self.frame_grabber = None
+        self.is_camera_active = False
+        self.last_frame_seq = 0
+        self.camera_index = 0
+        # Video file, image directory or callable returning a frame source
+        # to read instead of the camera (see frame_sources.open_source)
+        self.frame_source = None
+        self.replay_realtime = True  # False replays recordings as fast as the pipeline runs
+        self.replay_loop = False
+        self.record_sessions_dir = None  # Save every session's frames under this directory
+
+        # Enhanced camera performance settings
+        self.camera_fps = 60  # Increased target FPS for smoother video
+        self.frame_skip = 1  # Process every frame for smoother experience
+        self.frame_count = 0
+        self.target_resolution = CAPTURE_RESOLUTION  # Higher resolution for better quality
+        self.max_capture_failures = 30  # Consecutive failed reads before warning the user
+
+        # Face recognition parameters. "int8" or "float16" keeps the gallery
+        # compact and re-ranks the closest users with their stored encodings;
+        # `gallery_shards` spreads the gallery over that many worker processes
+        if gallery_precision is not None and gallery_shards is not None:
+            raise ValueError("gallery_precision and gallery_shards cannot be combined")
+        if gallery_shards is not None:
+            self.gallery = ShardedGallery(num_shards=gallery_shards)
+        elif gallery_precision is None:
+            self.gallery = FaceGallery()
+        else:
+            self.gallery = QuantizedGallery(precision=gallery_precision,
+                                            loader=lambda user_ids: storage.load_users(self.conn, user_ids))
+        self.face_detector = FaceDetector(downscale=0.5, redetect_interval=10)
+        # Run detection/encoding in a separate process
+        self.use_recognition_worker = use_recognition_worker
+        self.recognition_worker = None
+        self.face_locations = []
+        # Encodings of tracked faces, reused while a face does not change.
+        # The TTL doubles as the minimum spacing of identical registration samples
+        self.encoding_cache = EncodingCache(ttl=0.5)
+        self.login_reuse_ttl = 30.0  # How long a failed login's encoding blocks an unchanged retry
+        # RGB version of the latest frame and the face box drawn on it, so
+        # a front end can display it without converting the frame again
+        self.last_rgb_frame = None
+        self.last_face_box = None
+
+        # Registration parameters
+        self.registration_images = []
+        self.registration_qualities = []
+        self.registration_count = 0
+        self.registration_required = 5
+
+        # Login parameters
+        self.login_attempts = 0
+        self.max_login_attempts = 3
+        self.claimed_identity = None  # (user_id, username, encoding) in 1:1 mode
+        self.recognition_threshold = 0.4  # Lower threshold for stricter matching
+        # Decide logins from several frames as soon as the evidence is clear,
+        # retrying without reopening the camera
+        self.use_streaming_login = True
+        self.streaming_login_delay = 0.5  # Shorter than recognition_delay; the test itself waits for evidence
+        self.streaming_retry_pause = 1.0  # Seconds between attempts on the same camera session
+        self.streaming_candidates = 3  # Users tracked per frame by the sequential test
+        self.streaming_verifier = StreamingVerifier(threshold=self.recognition_threshold)
+
+        # Approximate nearest-neighbour index for large galleries
+        self.use_ann_index = gallery_shards is None  # Shards always scan exactly
+        self.ann_min_gallery_size = 10000  # Exact scan is fast enough below this
+        self.ann_nprobe = 8  # Cells visited per query; raise for recall, lower for speed
+        self.ann_index_path = index_path_for(db_path)
+
+        # Memory-mapped copy of the gallery for fast startup, see gallery_snapshot.py
+        self.use_gallery_snapshot = use_gallery_snapshot
+        self.gallery_snapshot_path = snapshot_path_for(db_path)
+        self.snapshot_error = None  # Set by the background checksum of a mapped snapshot
+
+        # Pick up users added or deleted by other tools while running
+        self.use_gallery_sync = True
+        self.gallery_sync_interval = 0.5  # Seconds between database checks
+        self.gallery_sync = None
+
+        # Timing parameters for the delay before recognition starts
+        self.camera_start_time = None
+        self.recognition_delay = 4 # 4 seconds delay before recognition starts
+        self.session_delay = self.recognition_delay
+        self.countdown_active = False
+
+        # Lighting parameters
+        self.low_light_threshold = 40  # Adjust this value based on testing
+        self.consecutive_low_light_frames = 0
+        self.max_low_light_frames = 10
+
+        # Frame and face quality limits checked before detection and encoding
+        self.quality_gate = QualityGate(min_brightness=self.low_light_threshold)
+        self.frame_quality_ok = True
+        self.registration_min_quality = 0.5  # Combined 0..1 score a registration sample needs
+
+        # Counters and latency histograms, served on /metrics by the app
+        self.init_metrics(metrics_registry or metrics.REGISTRY)
+
+        # Load known faces
+        with self.startup_phase("load gallery"):
+            self.load_known_faces()
+        with self.startup_phase("ANN index"):
+            self.init_ann_index()
+
+    def startup_phase(self, name):
+        """Time an init phase if a startup timer was given"""
+        return self.timer.phase(name) if self.timer is not None else nullcontext()
+
+    def init_metrics(self, registry):
+        """Register the pipeline metrics on `registry`"""
+        self.metrics = registry
+        self.frames_processed = registry.counter(
+            "face_auth_frames_processed_total", "Camera frames run through the pipeline")
+        self.frames_dropped = registry.counter(
+            "face_auth_frames_dropped_total", "Camera frames replaced by a newer one before the pipeline read them")
+        self.low_light_frames = registry.counter(
+            "face_auth_low_light_frames_total", "Frames below the low-light brightness threshold")
+        self.no_face_frames = registry.counter(
+            "face_auth_no_face_frames_total", "Frames where detection found no face")
+        self.low_quality_faces = registry.counter(
+            "face_auth_low_quality_faces_total", "Detected faces not encoded because they failed the quality gate")
+        self.multi_face_frames = registry.counter(
+            "face_auth_multi_face_frames_total", "Frames where detection found more than one face")
+        self.logins_succeeded = registry.counter(
+            "face_auth_logins_succeeded_total", "Login attempts matched to a registered user")
+        self.logins_failed = registry.counter(
+            "face_auth_logins_failed_total", "Login attempts that matched nobody")
+        self.registrations_completed = registry.counter(
+            "face_auth_registrations_completed_total", "Registrations saved to the database")
+        self.registrations_failed = registry.counter(
+            "face_auth_registrations_failed_total", "Registrations rejected or not saved")
+        self.gallery_failures = registry.counter(
+            "face_auth_gallery_failures_total", "Sharded gallery searches that failed and fell back to one process")
+
+        self.frame_seconds = registry.histogram(
+            "face_auth_frame_seconds", "Time to run the pipeline on one camera frame")
+        self.detection_seconds = registry.histogram(
+            "face_auth_detection_seconds", "Time spent in face detection per frame")
+        self.encoding_cache_hits = registry.counter(
+            "face_auth_encoding_cache_hits_total", "Face encodings reused instead of recomputed")
+        self.encoding_seconds = registry.histogram(
+            "face_auth_encoding_seconds", "Time to compute one face encoding")
+        self.match_seconds = registry.histogram(
+            "face_auth_match_seconds", "Time to search the gallery for one encoding")
+        self.verify_seconds = registry.histogram(
+            "face_auth_verify_seconds", "Time spent in verify_face")
+        self.registration_seconds = registry.histogram(
+            "face_auth_registration_seconds", "Time spent in complete_registration")
+
+        registry.gauge("face_auth_gallery_size", "Registered users held in memory",
+                       func=lambda: len(self.gallery))
+
+    def emit(self, event, **data):
+        """Send an event to the listener, if any"""
+        if self.listener is not None:
+            self.listener(event, data)
+
+    def set_text(self, kind, text):
+        """Emit a "status", "countdown" or "lighting" event if the text changed"""
+        if self._last_text.get(kind) != text:
+            self._last_text[kind] = text
+            self.emit(kind, text=text)
+
+    def check_lighting_conditions(self, frame):
+        """Check if the lighting conditions are adequate.
+
+        Exposure is scored on a subsampled frame. A frame that fails is not
+        sent to detection (`frame_quality_ok`), but the warning is only
+        returned after several poorly exposed frames in a row.
+        """
+        self.quality_gate.min_brightness = self.low_light_threshold
+        self.frame_quality_ok, reason, _ = self.quality_gate.check_frame(frame)
+
+        if not self.frame_quality_ok:
+            if reason == "too_dark":
+                self.low_light_frames.inc()
+            self.consecutive_low_light_frames += 1
+            if self.consecutive_low_light_frames >= self.max_low_light_frames:
+                return False, REASON_MESSAGES[reason]
+        else:
+            self.consecutive_low_light_frames = 0
+
+        return True, ""
+
+    def init_database(self):
+        """Open the shared database, creating or migrating the schema"""
+        self.conn = storage.connect(self.db_path, check_same_thread=self.check_same_thread)
+        self.cursor = self.conn.cursor()
+        # Per-user lookups for claimed-identity (1:1) logins
+        self.user_lookup = UserLookup(self.conn)
+
+    def load_known_faces(self, map_snapshot=True):
+        """Load known faces from the snapshot file if it is usable, else from
+        the database (always with `map_snapshot` False)"""
+        # Only the plain gallery can be backed by the mapped snapshot
+        use_snapshot = self.use_gallery_snapshot and type(self.gallery) is FaceGallery
+        try:
+            snapshot = None
+            stale = False
+            if use_snapshot and map_snapshot:
+                snapshot = open_snapshot(self.conn, self.gallery_snapshot_path,
+                                         allow_behind=self.use_gallery_sync)
+            if snapshot is not None:
+                self.gallery, change_seq = snapshot.to_gallery(), snapshot.change_seq
+                if change_seq < storage.latest_change_seq(self.conn):
+                    # Apply the delta now; it copies the mapped arrays, so the
+                    # file is rewritten and mapped again below
+                    catch_up = GallerySync(self.db_path, change_seq)
+                    catch_up.poll(self.conn)
+                    catch_up.apply_to(self.gallery)
+                    change_seq = catch_up.last_seq
+                    stale = True
+            else:
+                _, change_seq = storage.load_gallery_with_seq(self.conn, self.gallery)
+        except sqlite3.Error as e:
+            self.emit("error", title="Database Error", message=f"Failed to load known faces: {str(e)}")
+            return
+
+        if use_snapshot and (snapshot is None or stale):
+            # Regenerate it so this and later starts map a current snapshot;
+            # it was just written from memory, so no checksum pass
+            try:
+                write_snapshot(self.gallery_snapshot_path, self.gallery.ids, self.gallery.names,
+                               self.gallery.encodings, change_seq)
+                remapped = load_gallery_from_snapshot(self.conn, self.gallery_snapshot_path,
+                                                      allow_behind=False, verify=False)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                # SnapshotError is a ValueError; the SQLite gallery stays in use
+                print(f"Failed to write gallery snapshot: {e}")
+                remapped = None
+            if remapped is not None and remapped[1] == change_seq:
+                self.gallery, change_seq = remapped
+        elif snapshot is not None:
+            # Reading the whole file for the checksum would make startup
+            # O(users), so it is checked in the background instead
+            self.snapshot_error = None
+            threading.Thread(target=self.verify_snapshot, args=(snapshot,),
+                             name="SnapshotVerify", daemon=True).start()
+
+        if self.use_gallery_sync:
+            self.gallery_sync = GallerySync(self.db_path, change_seq, poll_interval=self.gallery_sync_interval)
+            self.gallery_sync.start()
+
+    def verify_snapshot(self, snapshot):
+        """Checksum the mapped snapshot; `sync_gallery` reloads from the
+        database if it fails"""
+        try:
+            snapshot.verify()
+        except SnapshotError as e:
+            self.snapshot_error = e
+
+    def sync_gallery(self):
+        """Apply user changes made by other processes since the last call"""
+        if self.snapshot_error is not None:
+            print(f"{self.snapshot_error}, reloading the gallery from the database")
+            self.snapshot_error = None
+            self.reload_gallery()
+            return
+        if self.gallery_sync is None or not self.gallery_sync.apply_to(self.gallery):
+            return
+        self.user_lookup.clear()
+        if self.gallery.index is None:
+            self.init_ann_index()
+        else:
+            self.save_ann_index()
+
+    def init_ann_index(self):
+        """Attach the persisted ANN index to the gallery once it is large enough"""
+        if not self.use_ann_index or len(self.gallery) < self.ann_min_gallery_size:
+            return
+        try:
+            self.gallery.attach_index(
+                load_or_build_index(self.ann_index_path, self.gallery, nprobe=self.ann_nprobe)
+            )
+        except (OSError, ValueError) as e:
+            # Exact search still works, just slower
+            print(f"ANN index unavailable, using exact search: {e}")
+
+    def save_ann_index(self):
+        """Persist the ANN index after the gallery changed"""
+        if self.gallery.index is None:
+            return
+        try:
+            self.gallery.index.save(self.ann_index_path)
+        except OSError as e:
+            print(f"Failed to save ANN index: {e}")
+
+    def check_face_already_registered(self, new_face_encoding):
+        """Check if the face is already registered in the database"""
+        # Find the closest existing face encoding
+        matches = self.search_gallery(new_face_encoding, k=1)
+        if not matches:
+            return False, ""
+        _, existing_username, min_distance = matches[0]
+
+        # If the face is too similar to an existing one
+        if min_distance < DUPLICATE_THRESHOLD:
+            return True, existing_username
+
+        return False, ""
+
+    def check_username_exists(self, username):
+        """Check if username already exists in database"""
+        return self.user_lookup.get(username) is not None
+
+    def open_frame_source(self):
+        """Open the configured frame source, wrapped in a recorder if enabled"""
+        spec = self.camera_index if self.frame_source is None else self.frame_source
+        source = open_source(spec, realtime=self.replay_realtime, loop=self.replay_loop,
+                             resolution=self.target_resolution, fps=self.camera_fps)
+        if self.record_sessions_dir and source.isOpened():
+            mode = "registration" if hasattr(self, 'current_username') else "login"
+            directory = os.path.join(self.record_sessions_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{mode}")
+            source = SessionRecorder(source, directory)
+        return source
+
+    def open_camera(self):
+        """Open the camera and start the background capture thread"""
+        if self.camera is None:
+            self.camera = self.open_frame_source()
+            if not self.camera.isOpened():
+                self.camera.release()
+                self.camera = None
+                if self.frame_source is None:
+                    self.emit("error", title="Error", message="Could not open camera! Please check if it's connected and not in use by another application.")
+                else:
+                    self.emit("error", title="Error", message=f"Could not open frame source: {self.frame_source}")
+                return False
+
+        if self.frame_grabber is None:
+            # Recordings replayed as fast as possible must not skip frames
+            self.frame_grabber = FrameGrabber(self.camera,
+                                              wait_for_consumer=not getattr(self.camera, "realtime", True))
+            self.frame_grabber.start()
+            self.last_frame_seq = 0
+            self.face_detector.reset()
+            self.face_locations = []
+            if self.recognition_worker is not None:
+                self.recognition_worker.reset()
+        return True
+
+    def start_camera_session(self, delay=None):
+        """Open the camera and start the recognition countdown (`recognition_delay` by default)"""
+        self.sync_gallery()
+        if not self.open_camera():
+            return False
+        self.session_delay = self.recognition_delay if delay is None else delay
+        self.is_camera_active = True
+        self.camera_start_time = time.time()
+        self.countdown_active = True
+        return True
+
+    def start_registration(self, username):
+        """Start capturing registration samples for `username`"""
+        self.current_username = username
+        self.encoding_cache.clear()
+        self.registration_images = []
+        self.registration_qualities = []
+        self.registration_count = 0
+
+        if not self.start_camera_session():
+            delattr(self, 'current_username')
+            return False
+        return True
+
+    def start_login(self, reset_attempts=True, claimed_username=None):
+        """Start the login process.
+
+        With `claimed_username` the face is only compared with that user's
+        encoding (1:1 verification) instead of searching the whole gallery.
+        A retry (`reset_attempts=False`) keeps the claim of the first attempt.
+        """
+        if reset_attempts:
+            self.claimed_identity = None
+            if claimed_username is not None:
+                self.claimed_identity = self.user_lookup.get(claimed_username)
+                if self.claimed_identity is None:
+                    self.emit("error", title="Error", message=f"Username '{claimed_username}' is not registered")
+                    return False
+
+        self.login_mode = True
+        if reset_attempts:
+            self.login_attempts = 0
+            self.encoding_cache.discard("login")
+        self.streaming_verifier.threshold = self.recognition_threshold
+        self.streaming_verifier.reset()
+
+        delay = self.streaming_login_delay if self.use_streaming_login else None
+        if not self.start_camera_session(delay):
+            delattr(self, 'login_mode')
+            return False
+        return True
+
+    def get_recognition_worker(self, frame_shape):
+        """Return the recognition worker, (re)starting it for `frame_shape`"""
+        worker = self.recognition_worker
+        if worker is not None and (worker.frame_shape != frame_shape or not worker.is_running):
+            worker.stop()
+            worker = None
+        if worker is None:
+            worker = RecognitionWorker(frame_shape, detector_options={
+                "downscale": self.face_detector.downscale,
+                "redetect_interval": self.face_detector.redetect_interval,
+            }, quality_gate=self.quality_gate)
+            worker.start()
+            self.recognition_worker = worker
+        return worker
+
+    def detect_faces(self, frame, rgb_frame, want_encoding=False):
+        """Return (face_locations, face_encodings, face_check, signature).
+
+        Inline detection returns only the locations, the rest as None, so
+        callers check and encode the face when they need to. With the
+        recognition worker the frame is handed off and the newest finished
+        result is returned instead: the worker also runs the quality check
+        and crop signature on the frame the face was found in (see
+        RecognitionWorker.poll). All four are None if the worker has
+        nothing new yet.
+        """
+        if not self.use_recognition_worker:
+            return self.face_detector.detect(rgb_frame), None, None, None
+
+        worker = self.get_recognition_worker(frame.shape)
+        worker.submit(frame, want_encoding=want_encoding)
+        result = worker.poll()
+        if result is None:
+            return None, None, None, None
+        _, face_locations, face_encodings, face_check, signature = result
+        self.face_locations = face_locations
+        return face_locations, face_encodings, face_check, signature
+
+    def process_frame(self):
+        """Run the pipeline on the newest camera frame.
+
+        Returns the BGR frame as captured (the detected face is in
+        `last_face_box`), or None if there was no new frame or the frame ended the
+        current registration/login session.
+        """
+        start = time.perf_counter()
+        last_frame_seq = self.last_frame_seq
+        frame = self._process_frame()
+        # Only ticks that actually consumed a camera frame are timed
+        if self.last_frame_seq != last_frame_seq:
+            self.frame_seconds.observe(time.perf_counter() - start)
+        return frame
+
+    def _process_frame(self):
+        """Pipeline body of `process_frame`"""
+        if not self.is_camera_active:
+            return None
+
+        # Cheap when nothing changed: just an empty queue check
+        self.sync_gallery()
+
+        # Calculate time since camera started
+        if self.camera_start_time is not None:
+            elapsed_time = time.time() - self.camera_start_time
+            remaining_time = max(0, self.session_delay - elapsed_time)
+
+            if remaining_time > 0 and self.countdown_active:
+                self.set_text("countdown", f"Please wait... Recognition starts in {int(remaining_time + 1)} seconds")
+                can_recognize = False
+            else:
+                self.set_text("countdown", "")
+                can_recognize = True
+                self.countdown_active = False
+        else:
+            can_recognize = True
+
+        # Take the newest frame from the capture thread, skipping the tick
+        # if the camera has not produced anything new since the last one
+        frame_data = self.frame_grabber.latest(after_seq=self.last_frame_seq)
+        if frame_data is None:
+            if self.frame_grabber.finished:
+                # A recorded source ran out before the session completed
+                self.stop_camera()
+                self.set_text("status", "Frame source ended")
+                if hasattr(self, 'current_username'):
+                    delattr(self, 'current_username')
+                if hasattr(self, 'login_mode'):
+                    delattr(self, 'login_mode')
+                return None
+            if self.frame_grabber.consecutive_failures >= self.max_capture_failures:
+                self.set_text("status", "Failed to capture frame. Please check camera connection.")
+            return None
+        if frame_data[0] > self.last_frame_seq + 1:
+            self.frames_dropped.inc(frame_data[0] - self.last_frame_seq - 1)
+        self.last_frame_seq, _, frame = frame_data
+        self.frames_processed.inc()
+
+        # Check lighting conditions
+        lighting_ok, lighting_message = self.check_lighting_conditions(frame)
+        if not lighting_ok:
+            self.set_text("lighting", lighting_message)
+            if can_recognize:
+                self.set_text("status", "Waiting for better lighting conditions...")
+        else:
+            self.set_text("lighting", "")
+
+        # Convert frame to RGB for face_recognition
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        self.last_rgb_frame = rgb_frame
+        self.last_face_box = None
+
+        # Process face detection with improved performance
+        self.frame_count += 1
+        if self.frame_count % self.frame_skip == 0 and lighting_ok and self.frame_quality_ok:
+            # Detect faces on a downscaled frame or around the tracked face
+            with self.detection_seconds.time():
+                face_locations, face_encodings, face_check, signature = self.detect_faces(
+                    frame, rgb_frame, want_encoding=can_recognize)
+
+            if face_locations is None:
+                # No newer result from the recognition worker yet, keep the last box on screen
+                if len(self.face_locations) == 1:
+                    self.last_face_box = self.face_locations[0]
+            elif len(face_locations) == 0:
+                self.no_face_frames.inc()
+                if can_recognize:
+                    self.set_text("status", "No face detected. Please position your face in the camera view.")
+            elif len(face_locations) > 1:
+                self.multi_face_frames.inc()
+                if can_recognize:
+                    self.set_text("status", "Multiple faces detected. Please ensure only one face is visible.")
+            else:
+                # The display draws this box on its own copy of the frame
+                self.last_face_box = face_locations[0]
+
+                # Only process recognition after the delay
+                if can_recognize:
+                    # Skip encoding faces that are too small, blurred, badly lit or turned away
+                    if face_check is None:
+                        if self.use_recognition_worker:
+                            # Submitted before recognition started; the
+                            # box does not belong to this frame
+                            return frame
+                        face_check = self.quality_gate.check_face(rgb_frame, face_locations[0])
+                    face_ok, reason, quality = face_check
+                    if not face_ok:
+                        self.low_quality_faces.inc()
+                        self.set_text("status", REASON_MESSAGES[reason])
+                    # If in registration mode, capture face
+                    elif hasattr(self, 'current_username'):
+                        if quality["score"] < self.registration_min_quality:
+                            self.set_text("status", "Hold still and look at the camera for a clearer sample.")
+                        elif self.registration_count < self.registration_required:
+                            # Only keep samples that differ from the previous one
+                            face_encoding, fresh = self.encode_face(
+                                rgb_frame, face_locations[0], face_encodings,
+                                ("registration", self.face_detector.track_id), signature=signature)
+                            if fresh:
+                                self.registration_images.append(face_encoding)
+                                self.registration_qualities.append(quality["score"])
+                                self.registration_count += 1
+
+                                if self.registration_count < self.registration_required:
+                                    self.set_text("status", f"Registration in progress... Capture {self.registration_count + 1}/{self.registration_required}")
+                                else:
+                                    with self.registration_seconds.time():
+                                        self.complete_registration()
+                                    return None
+                    # If in login mode, verify face
+                    elif hasattr(self, 'login_mode') and self.use_streaming_login:
+                        # Identical frames add no evidence, so only fresh encodings are tested
+                        face_encoding, fresh = self.encode_face(rgb_frame, face_locations[0], face_encodings, "login",
+                                                                signature=signature)
+                        if fresh:
+                            with self.verify_seconds.time():
+                                self.verify_stream(face_encoding)
+                            if not self.is_camera_active:
+                                return None
+                    elif hasattr(self, 'login_mode'):
+                        # A retry with the face unchanged since the failed
+                        # attempt would fail the same way, so wait for a change
+                        face_encoding, fresh = self.encode_face(
+                            rgb_frame, face_locations[0], face_encodings, "login", ttl=self.login_reuse_ttl,
+                            signature=signature)
+                        if fresh:
+                            with self.verify_seconds.time():
+                                self.verify_face(face_encoding)
+                            return None
+                        if face_encoding is not None:
+                            self.set_text("status", "Please adjust your position or expression to try again.")
+                else:
+                    if hasattr(self, 'current_username'):
+                        self.set_text("status", f"Get ready for registration... {int(remaining_time + 1)} seconds remaining")
+                    elif hasattr(self, 'login_mode'):
+                        self.set_text("status", f"Get ready for login... {int(remaining_time + 1)} seconds remaining")
+
+        return frame
+
+    def encode_face(self, rgb_frame, box, face_encodings, cache_key, ttl=None, signature=None):
+        """Return (encoding, fresh) for the face in `box`.
+
+        If the face has not changed since it was last encoded under
+        `cache_key`, the cached encoding comes back with fresh=False.
+        Otherwise the recognition worker's encoding, or a newly computed
+        one, is cached and returned with fresh=True. Returns (None, False)
+        if no encoding could be computed. `signature` is the worker's
+        crop_signature of the face; it is computed here when not given.
+        """
+        if signature is None:
+            signature = crop_signature(rgb_frame, box)
+        cached = self.encoding_cache.lookup(cache_key, box, signature, ttl=ttl)
+        if cached is not None:
+            self.encoding_cache_hits.inc()
+            return cached, False
+        if face_encodings is None:
+            with self.encoding_seconds.time():
+                face_encodings = face_recognition.face_encodings(rgb_frame, [box])
+        if not face_encodings:
+            return None, False
+        self.encoding_cache.store(cache_key, box, signature, face_encodings[0])
+        return face_encodings[0], True
+
+    def complete_registration(self):
+        """Complete the registration process"""
+        # Stop camera first
+        self.stop_camera()
+        username = self.current_username
+
+        if len(self.registration_images) == self.registration_required:
+            # Calculate average face encoding
+            avg_encoding = np.mean(self.registration_images, axis=0)
+
+            # Check if this face is already registered
+            is_duplicate, existing_username = self.check_face_already_registered(avg_encoding)
+            if is_duplicate:
+                self.set_text("status", "Registration failed - Face already exists")
+                self.registrations_failed.inc()
+                self.emit("registration_failed", username=username, reason="duplicate",
+                          message=f"This face is already registered with username: {existing_username}")
+                # Cleanup
+                if hasattr(self, 'current_username'):
+                    delattr(self, 'current_username')
+                return
+
+            # Verify the quality of the registration
+            face_distances = []
+            for encoding in self.registration_images:
+                distance = face_recognition.face_distance([avg_encoding], encoding)[0]
+                face_distances.append(distance)
+
+            # Check if the registration samples are consistent
+            if max(face_distances) > MAX_SAMPLE_DISTANCE:  # If samples vary too much
+                self.set_text("status", "Registration failed - inconsistent samples")
+                self.registrations_failed.inc()
+                self.emit("registration_failed", username=username, reason="inconsistent",
+                          message="Registration failed. Please try again with more consistent face positioning.")
+                delattr(self, 'current_username')
+                return
+
+            try:
+                # Save to database
+                user_id = storage.insert_user(self.conn, username, avg_encoding)
+
+                # Update known faces
+                self.gallery.add(user_id, username, avg_encoding)
+                self.save_ann_index()
+
+                self.registrations_completed.inc()
+                self.set_text("status", "Registration completed")
+                self.emit("registration_completed", username=username,
+                          quality=sum(self.registration_qualities) / len(self.registration_qualities))
+
+            except sqlite3.Error as e:
+                self.registrations_failed.inc()
+                self.emit("registration_failed", username=username, reason="database",
+                          message=f"Failed to save registration: {str(e)}")
+
+        # Cleanup
+        if hasattr(self, 'current_username'):
+            delattr(self, 'current_username')
+
+    def verify_face(self, face_encoding):
+        """Verify face against known faces"""
+        if not hasattr(self, 'login_mode'):
+            return
+
+        # Stop camera first
+        self.stop_camera()
+
+        # Get the best match among known faces
+        with self.match_seconds.time():
+            matches = self.match_candidates(face_encoding, k=1)
+        if matches:
+            _, username, best_match_distance = matches[0]
+        else:
+            username, best_match_distance = None, float("inf")
+
+        # Check if the best match is within threshold
+        if best_match_distance <= self.recognition_threshold:
+            self.accept_login(username, best_match_distance)
+        else:
+            self.reject_login()
+
+    def match_candidates(self, face_encoding, k=1):
+        """Closest users as (user_id, name, distance): only the claimed user
+        in 1:1 mode, else the top `k` of the gallery"""
+        if self.claimed_identity is not None:
+            user_id, username, encoding = self.claimed_identity
+            distance = float(np.linalg.norm(np.asarray(face_encoding, dtype=np.float32) - encoding))
+            return [(user_id, username, distance)]
+        return self.search_gallery(face_encoding, k=k)
+
+    def search_gallery(self, face_encoding, k=1):
+        """Search the gallery, replacing a failed sharded gallery with an
+        in-process one loaded from the database"""
+        try:
+            return self.gallery.search(face_encoding, k=k)
+        except RuntimeError as e:
+            if not isinstance(self.gallery, ShardedGallery):
+                raise
+            print(f"Sharded gallery failed, searching in process from now on: {e}")
+            self.gallery_failures.inc()
+            self.replace_sharded_gallery()
+            return self.gallery.search(face_encoding, k=k)
+
+    def replace_sharded_gallery(self):
+        """Close the sharded gallery and reload the users into a FaceGallery"""
+        self.gallery.close()
+        self.use_ann_index = True
+        self.reload_gallery(map_snapshot=True)
+
+    def reload_gallery(self, map_snapshot=False):
+        """Replace the gallery with a fresh FaceGallery, loaded from the
+        database unless `map_snapshot`"""
+        if self.gallery_sync is not None:
+            self.gallery_sync.stop()
+            self.gallery_sync = None
+        self.gallery = FaceGallery()
+        self.user_lookup.clear()
+        self.load_known_faces(map_snapshot=map_snapshot)
+        self.init_ann_index()
+
+    def verify_stream(self, face_encoding):
+        """Add one frame to the streaming login test and act on its decision.
+
+        The camera keeps running between attempts; it is only stopped when
+        the login succeeds or the last attempt fails.
+        """
+        if not hasattr(self, 'login_mode'):
+            return
+
+        with self.match_seconds.time():
+            matches = self.match_candidates(face_encoding, k=self.streaming_candidates)
+        decision = self.streaming_verifier.update(matches)
+        if decision is None:
+            self.set_text("status", "Verifying...")
+            return
+
+        outcome, _, username, distance = decision
+        self.streaming_verifier.reset()
+        if outcome == ACCEPT:
+            self.stop_camera()
+            self.accept_login(username, distance)
+        else:
+            self.reject_login(retrying=True)
+            if self.is_camera_active:
+                # Give the user a moment to adjust before the next attempt
+                self.camera_start_time = time.time()
+                self.session_delay = self.streaming_retry_pause
+                self.countdown_active = True
+
+    def accept_login(self, username, distance):
+        """End the login session successfully"""
+        self.set_text("status", f"Face recognized as {username}")
+
+        # Cleanup login mode
+        if hasattr(self, 'login_mode'):
+            delattr(self, 'login_mode')
+
+        self.logins_succeeded.inc()
+        self.emit("login_succeeded", username=username, distance=distance)
+
+    def reject_login(self, retrying=False):
+        """Count a failed attempt; `retrying` means the camera is still running
+        and the next attempt starts right away"""
+        self.logins_failed.inc()
+        self.login_attempts += 1
+        if self.login_attempts >= self.max_login_attempts:
+            if self.is_camera_active:
+                self.stop_camera()
+            self.set_text("status", "Login failed")
+
+            # Cleanup
+            if hasattr(self, 'login_mode'):
+                delattr(self, 'login_mode')
+            self.emit("login_failed", attempts=self.login_attempts, max_attempts=self.max_login_attempts,
+                      final=True, retrying=False, message="Maximum login attempts reached. Please try again later.")
+        elif self.claimed_identity is not None:
+            username = self.claimed_identity[1]
+            self.set_text("status", f"Face does not match {username}. Attempt {self.login_attempts}/{self.max_login_attempts}")
+            self.emit("login_failed", attempts=self.login_attempts, max_attempts=self.max_login_attempts,
+                      final=False, retrying=retrying,
+                      message=f"Face does not match {username}. Please try again.")
+        else:
+            self.set_text("status", f"User not found in the database. Attempt {self.login_attempts}/{self.max_login_attempts}")
+            self.emit("login_failed", attempts=self.login_attempts, max_attempts=self.max_login_attempts,
+                      final=False, retrying=retrying,
+                      message="User not found in the database. Please try again or register first.")
+
+    def stop_camera(self):
+        """Stop the camera and reset the session timers"""
+        self.is_camera_active = False
+        if self.frame_grabber is not None:
+            self.frame_grabber.stop()
+            self.frame_grabber = None
+        if self.camera is not None:
+            self.camera.release()
+            self.camera = None
+
+        # Clear status texts
+        self.set_text("countdown", "")
+        self.set_text("lighting", "")
+
+        # Reset timing variables
+        self.camera_start_time = None
+        self.countdown_active = False
+        self.emit("camera_stopped")
+
+    def cleanup(self):
+        """Cleanup resources"""
+        if self.gallery_sync is not None:
+            self.gallery_sync.stop()
+        if self.frame_grabber is not None:
+            self.frame_grabber.stop()
+        if self.camera is not None:
+            self.camera.release()
+        if self.recognition_worker is not None:
+            self.recognition_worker.stop()
+        if isinstance(self.gallery, ShardedGallery):
+            self.gallery.close()
+        if hasattr(self, 'conn'):
+            self.conn.close()
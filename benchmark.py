@@ -0,0 +1,352 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from ann_index import IVFIndex
+from gallery import FaceGallery
+from quantized_gallery import QuantizedGallery
+from sharded_gallery import ShardedGallery
+
+DEFAULT_GALLERY_SIZES = (1000, 10000, 100000)
+FRAME_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+DISPLAY_SIZE = (640, 480)
+RESULTS_VERSION = 1
+
+
+def summarize(samples):
+    """Reduce a list of durations in seconds to millisecond statistics"""
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "min_ms": ordered[0] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def time_calls(func, inputs, warmup=2):
+    """Call `func` on every input and return the per-call durations"""
+    for item in inputs[:warmup]:
+        func(item)
+    samples = []
+    for item in inputs:
+        start = time.perf_counter()
+        func(item)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def synthetic_frames(count, shape=None, seed=0):
+    """Deterministic BGR frames: a smooth gradient with noise and a bright oval.
+
+    By default frames are the size the engine asks the camera for.
+    """
+    if shape is None:
+        from frame_sources import CAPTURE_RESOLUTION
+
+        shape = (CAPTURE_RESOLUTION[1], CAPTURE_RESOLUTION[0], 3)
+    rng = np.random.default_rng(seed)
+    height, width = shape[:2]
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = (xx / width * 120 + yy / height * 60).astype(np.float32)
+    oval = ((xx - width / 2) / (width / 6)) ** 2 + ((yy - height / 2) / (height / 4)) ** 2 < 1
+    base[oval] += 70
+    frames = []
+    for _ in range(count):
+        noise = rng.normal(0, 8, size=shape).astype(np.float32)
+        frames.append(np.clip(base[..., None] + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+def load_frames(path, limit):
+    """Read up to `limit` BGR frames from a video file or a directory of images"""
+    import cv2
+
+    frames = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if len(frames) >= limit:
+                break
+            if name.lower().endswith(FRAME_EXTENSIONS):
+                frame = cv2.imread(os.path.join(path, name))
+                if frame is not None:
+                    frames.append(frame)
+    else:
+        capture = cv2.VideoCapture(path)
+        while len(frames) < limit:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            frames.append(frame)
+        capture.release()
+    return frames
+
+
+def synthetic_encodings(count, dim=128, clusters=256, seed=0):
+    """Clustered random encodings with roughly the spread of real face encodings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 0.09, size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    return centers[labels] + rng.normal(0, 0.05, size=(count, dim)).astype(np.float32)
+
+
+def bench_pipeline(frames, detector_options=None):
+    """Time each per-frame stage of the camera loop on `frames`"""
+    import cv2
+    import face_recognition
+    from PIL import Image
+
+    from detection import FaceDetector
+    from quality import frame_scores
+
+    results = {}
+    results["lighting_check"] = summarize(time_calls(
+        lambda frame: np.mean(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)), frames))
+    results["frame_quality_subsampled"] = summarize(time_calls(frame_scores, frames))
+    results["bgr_to_rgb"] = summarize(time_calls(
+        lambda frame: cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), frames))
+
+    rgb_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+    results["hog_detection_full"] = summarize(time_calls(
+        lambda rgb: face_recognition.face_locations(rgb, number_of_times_to_upsample=1, model="hog"),
+        rgb_frames))
+
+    # The tracking detector keeps state between frames, as in the camera loop
+    detector = FaceDetector(**(detector_options or {}))
+    results["hog_detection_tracked"] = summarize(time_calls(detector.detect, rgb_frames))
+    results["hog_detection_tracked"]["roi_detections"] = detector.roi_detections
+    results["hog_detection_tracked"]["full_detections"] = detector.full_detections
+
+    # Encode whatever was detected, or a fixed centre box on synthetic
+    # frames, so the cost is measured even without a real face
+    height, width = rgb_frames[0].shape[:2]
+    fallback = (height // 4, width * 2 // 3, height * 3 // 4, width // 3)
+    boxes = []
+    for rgb in rgb_frames:
+        locations = face_recognition.face_locations(rgb, model="hog")
+        boxes.append(locations[:1] or [fallback])
+    results["encoding"] = summarize(time_calls(
+        lambda i: face_recognition.face_encodings(rgb_frames[i], boxes[i]), list(range(len(rgb_frames)))))
+
+    results["display_resize_lanczos"] = summarize(time_calls(
+        lambda rgb: Image.fromarray(rgb).resize(DISPLAY_SIZE, Image.Resampling.LANCZOS), rgb_frames))
+    results["display_resize_area"] = summarize(time_calls(
+        lambda rgb: cv2.resize(rgb, DISPLAY_SIZE, interpolation=cv2.INTER_AREA), rgb_frames))
+    return results
+
+
+def bench_gallery(size, queries=200, k=1, nprobe=8, ann=True, shards=0, seed=0):
+    """Build a synthetic gallery of `size` encodings and time matching against it"""
+    encodings = synthetic_encodings(size, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    # Half genuine (noisy copies of enrolled encodings), half impostors
+    genuine = encodings[rng.integers(0, size, size=queries // 2)]
+    genuine = genuine + rng.normal(0, 0.02, size=genuine.shape).astype(np.float32)
+    impostors = synthetic_encodings(queries - len(genuine), seed=seed + 2)
+    query_set = list(np.vstack([genuine, impostors]))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    gallery = FaceGallery(capacity=size)
+    gallery.add_many(list(range(1, size + 1)), [f"user{i}" for i in range(1, size + 1)], encodings)
+    build_seconds = time.perf_counter() - start
+    _, build_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "size": size,
+        "build_ms": build_seconds * 1000,
+        "build_peak_bytes": build_peak,
+        "matrix_bytes": gallery.encodings.nbytes,
+        "exact": summarize(time_calls(lambda q: gallery.search(q, k=k), query_set)),
+    }
+    exact_top = [gallery.search(q, k=1)[0][0] for q in query_set]
+
+    # Quantized galleries re-rank from an in-memory copy standing in for the database
+    rows_by_id = {user_id: row for row, user_id in enumerate(range(1, size + 1))}
+
+    def loader(user_ids):
+        return user_ids, [f"user{user_id}" for user_id in user_ids], encodings[[rows_by_id[i] for i in user_ids]]
+
+    for precision in ("int8", "float16"):
+        quantized = QuantizedGallery(capacity=size, precision=precision, loader=loader, full_cache_size=0)
+        quantized.add_many(list(range(1, size + 1)), [f"user{i}" for i in range(1, size + 1)], encodings)
+        quantized_top = [quantized.search(q, k=1)[0][0] for q in query_set]
+        reranked_per_query = quantized.reranked / len(query_set)
+        result[precision] = summarize(time_calls(lambda q: quantized.search(q, k=k), query_set))
+        result[precision].update({
+            "matrix_bytes": quantized.nbytes,
+            "reranked_per_query": reranked_per_query,
+            "agreement_at_1": sum(a == b for a, b in zip(quantized_top, exact_top)) / len(query_set),
+        })
+
+    if shards:
+        # Throughput of batched queries is what scales with the shard count
+        sharded = ShardedGallery(num_shards=shards, capacity=size // shards + 1)
+        try:
+            sharded.add_many(list(range(1, size + 1)), [f"user{i}" for i in range(1, size + 1)], encodings)
+            sharded_top = [matches[0][0] for matches in sharded.search_batch(query_set, k=1)]
+            result["sharded"] = summarize(time_calls(lambda q: sharded.search(q, k=k), query_set))
+            start = time.perf_counter()
+            sharded.search_batch(query_set, k=k)
+            batch_seconds = time.perf_counter() - start
+        finally:
+            sharded.close()
+        start = time.perf_counter()
+        gallery.search_batch(query_set, k=k)
+        single_batch_seconds = time.perf_counter() - start
+        result["sharded"].update({
+            "shards": shards,
+            "batch_qps": len(query_set) / batch_seconds,
+            "single_process_batch_qps": len(query_set) / single_batch_seconds,
+            "agreement_at_1": sum(a == b for a, b in zip(sharded_top, exact_top)) / len(query_set),
+        })
+
+    if ann:
+        start = time.perf_counter()
+        index = IVFIndex.train(gallery.encodings, nprobe=nprobe)
+        index.sync(gallery)
+        gallery.attach_index(index)
+        train_seconds = time.perf_counter() - start
+        ann_top = [gallery.search(q, k=1)[0][0] for q in query_set]
+        result["ann"] = summarize(time_calls(lambda q: gallery.search(q, k=k), query_set))
+        result["ann"].update({
+            "nprobe": nprobe,
+            "build_ms": train_seconds * 1000,
+            "recall_at_1": sum(a == b for a, b in zip(ann_top, exact_top)) / len(query_set),
+        })
+    return result
+
+
+def environment():
+    """Describe the machine and library versions a run was made with"""
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+    for module_name in ("cv2", "dlib", "face_recognition"):
+        try:
+            module = __import__(module_name)
+            info[module_name] = getattr(module, "__version__", "unknown")
+        except ImportError:
+            info[module_name] = None
+    return info
+
+
+def compare(current, baseline):
+    """Return lines comparing p50 latencies of two result files"""
+    lines = []
+    for stage, stats in current.get("pipeline", {}).items():
+        old = baseline.get("pipeline", {}).get(stage)
+        if old:
+            lines.append(f"{stage:<26} {old['p50_ms']:9.3f} -> {stats['p50_ms']:9.3f} ms "
+                         f"({stats['p50_ms'] / max(old['p50_ms'], 1e-9):.2f}x)")
+    old_galleries = {entry["size"]: entry for entry in baseline.get("gallery", [])}
+    for entry in current.get("gallery", []):
+        old = old_galleries.get(entry["size"])
+        if not old:
+            continue
+        for mode in ("exact", "ann", "int8", "float16", "sharded"):
+            if mode in entry and mode in old:
+                label = f"match {mode} n={entry['size']}"
+                lines.append(f"{label:<26} {old[mode]['p50_ms']:9.3f} -> {entry[mode]['p50_ms']:9.3f} ms "
+                             f"({entry[mode]['p50_ms'] / max(old[mode]['p50_ms'], 1e-9):.2f}x)")
+    return lines
+
+
+def print_report(results):
+    """Print a human-readable summary of `results`"""
+    if results.get("pipeline"):
+        print(f"\n=== Pipeline stages ({results['config']['frames']} frames) ===")
+        print(f"{'stage':<26} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}")
+        for stage, stats in results["pipeline"].items():
+            print(f"{stage:<26} {stats['p50_ms']:9.3f} {stats['p95_ms']:9.3f} {stats['mean_ms']:9.3f}")
+    if results.get("gallery"):
+        print("\n=== Gallery matching ===")
+        print(f"{'size':>8} {'exact p50':>10} {'exact p95':>10} {'ann p50':>9} {'recall':>7} {'matrix MB':>10} "
+              f"{'int8 p50':>9} {'int8 MB':>8} {'agree':>6}")
+        for entry in results["gallery"]:
+            ann = entry.get("ann")
+            ann_p50 = f"{ann['p50_ms']:9.3f}" if ann else f"{'-':>9}"
+            recall = f"{ann['recall_at_1']:7.3f}" if ann else f"{'-':>7}"
+            int8 = entry.get("int8")
+            int8_columns = (f"{int8['p50_ms']:9.3f} {int8['matrix_bytes'] / 1e6:8.1f} {int8['agreement_at_1']:6.3f}"
+                            if int8 else f"{'-':>9} {'-':>8} {'-':>6}")
+            print(f"{entry['size']:>8} {entry['exact']['p50_ms']:10.3f} {entry['exact']['p95_ms']:10.3f} "
+                  f"{ann_p50} {recall} {entry['matrix_bytes'] / 1e6:10.1f} {int8_columns}")
+            sharded = entry.get("sharded")
+            if sharded:
+                print(f"{'':>8} {sharded['shards']} shards: {sharded['batch_qps']:.0f} queries/s batched "
+                      f"(single process {sharded['single_process_batch_qps']:.0f}), "
+                      f"p50 {sharded['p50_ms']:.3f} ms per query")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the recognition pipeline and gallery matching offline")
+    parser.add_argument("--frames", help="Video file or directory of recorded frames (default: synthetic frames)")
+    parser.add_argument("--frame-count", type=int, default=30, help="Frames to run through each pipeline stage")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_GALLERY_SIZES),
+                        help="Synthetic gallery sizes to benchmark")
+    parser.add_argument("--queries", type=int, default=200, help="Match queries per gallery size")
+    parser.add_argument("--nprobe", type=int, default=8, help="IVF cells visited per query")
+    parser.add_argument("--no-ann", action="store_true", help="Only benchmark the exact scan")
+    parser.add_argument("--shards", type=int, default=0, help="Also benchmark a gallery sharded over N processes")
+    parser.add_argument("--skip-pipeline", action="store_true",
+                        help="Skip the per-frame stages (needs only numpy)")
+    parser.add_argument("--skip-gallery", action="store_true", help="Skip the gallery matching benchmarks")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "config": {"frames": args.frames or "synthetic", "frame_count": args.frame_count,
+                   "sizes": args.sizes, "queries": args.queries, "nprobe": args.nprobe},
+        "pipeline": {},
+        "gallery": [],
+    }
+
+    if not args.skip_pipeline:
+        frames = load_frames(args.frames, args.frame_count) if args.frames else synthetic_frames(args.frame_count)
+        if not frames:
+            print(f"No frames could be read from {args.frames}")
+            return 1
+        results["config"]["frames"] = f"{args.frames or 'synthetic'} ({len(frames)})"
+        results["config"]["frame_shape"] = list(frames[0].shape)
+        results["pipeline"] = bench_pipeline(frames)
+
+    if not args.skip_gallery:
+        for size in args.sizes:
+            results["gallery"].append(bench_gallery(size, queries=args.queries, nprobe=args.nprobe,
+                                                    ann=not args.no_ann, shards=args.shards))
+
+    print_report(results)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n=== Compared with baseline (p50) ===")
+        for line in compare(results, baseline):
+            print(line)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import storage
+from thresholds import DUPLICATE_THRESHOLD, MAX_SAMPLE_DISTANCE
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def collect_from_directory(directory):
+    """Group image paths by username.
+
+    Either `directory/<username>.<ext>` (one photo per person) or
+    `directory/<username>/*.<ext>` (several photos per person).
+    """
+    people = {}
+    for entry in sorted(os.listdir(directory)):
+        path = os.path.join(directory, entry)
+        if os.path.isdir(path):
+            images = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                      if name.lower().endswith(IMAGE_EXTENSIONS)]
+            if images:
+                people.setdefault(entry, []).extend(images)
+        elif entry.lower().endswith(IMAGE_EXTENSIONS):
+            people.setdefault(os.path.splitext(entry)[0], []).append(path)
+    return people
+
+
+def collect_from_manifest(manifest_path):
+    """Group image paths by username from a CSV with `username,path` rows.
+
+    Relative paths are resolved against the manifest's directory.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    people = {}
+    with open(manifest_path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].strip().lower() == "username":
+                continue
+            username, path = row[0].strip(), row[1].strip()
+            people.setdefault(username, []).append(os.path.join(base_dir, path))
+    return people
+
+
+def encode_person(username, image_paths):
+    """Decode and encode every image of one person (runs in a worker process).
+
+    Returns (username, encodings, rejections) where `rejections` lists a
+    reason for every image that produced no encoding.
+    """
+    import face_recognition
+
+    encodings = []
+    rejections = []
+    for path in image_paths:
+        try:
+            image = face_recognition.load_image_file(path)
+        except Exception:
+            rejections.append("unreadable_image")
+            continue
+        face_locations = face_recognition.face_locations(image, number_of_times_to_upsample=1, model="hog")
+        if len(face_locations) == 0:
+            rejections.append("no_face")
+        elif len(face_locations) > 1:
+            rejections.append("multiple_faces")
+        else:
+            encodings.extend(face_recognition.face_encodings(image, face_locations))
+    return username, encodings, rejections
+
+
+def load_gallery(conn):
+    """Load the enrolled encodings and the set of taken usernames"""
+    gallery = storage.load_gallery(conn)
+    return gallery, set(gallery.names)
+
+
+class BulkEnroller:
+    """Enroll many people from still photos.
+
+    Images are decoded and encoded in a process pool. Each person then goes
+    through the same checks as a camera registration: samples must agree
+    with their average, and the average must not be within the duplicate
+    threshold of anyone already enrolled or accepted earlier in the batch.
+    Accepted people are inserted in batched transactions.
+    """
+
+    def __init__(self, db_path=storage.DEFAULT_DB_PATH, workers=None, batch_size=500,
+                 duplicate_threshold=DUPLICATE_THRESHOLD, max_sample_distance=MAX_SAMPLE_DISTANCE,
+                 dry_run=False):
+        self.db_path = db_path
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.duplicate_threshold = duplicate_threshold
+        self.max_sample_distance = max_sample_distance
+        self.dry_run = dry_run
+
+        self.rejections = Counter()
+        self.image_rejections = Counter()
+        self.enrolled = 0
+        self.images = 0
+        self.elapsed = 0.0
+
+    def check_person(self, username, encodings, gallery, taken_usernames):
+        """Return (avg_encoding, None) if the person can be enrolled, else (None, reason)"""
+        if username in taken_usernames:
+            return None, "username_exists"
+        if not encodings:
+            return None, "no_usable_image"
+
+        avg_encoding = np.mean(encodings, axis=0)
+        if len(encodings) > 1:
+            sample_distances = np.linalg.norm(np.asarray(encodings) - avg_encoding, axis=1)
+            if sample_distances.max() > self.max_sample_distance:
+                return None, "inconsistent_samples"
+
+        matches = gallery.search(avg_encoding, k=1)
+        if matches and matches[0][2] < self.duplicate_threshold:
+            return None, "duplicate_face"
+        return avg_encoding, None
+
+    def flush(self, conn, pending):
+        """Insert a batch of (username, encoding) rows in one transaction.
+
+        If the batch is refused, e.g. because another process registered
+        one of the usernames meanwhile, the rows are inserted one at a time
+        and the refused ones are reported and skipped. Returns the number
+        of rows written.
+        """
+        if not pending or self.dry_run:
+            return len(pending)
+        try:
+            storage.insert_users(conn, pending)
+            return len(pending)
+        except sqlite3.IntegrityError:
+            pass
+
+        inserted = 0
+        for username, encoding in pending:
+            try:
+                storage.insert_user(conn, username, encoding)
+                inserted += 1
+            except sqlite3.IntegrityError as e:
+                self.rejections["insert_failed"] += 1
+                print(f"Skipped {username}: {e}", file=sys.stderr)
+        return inserted
+
+    def run(self, people):
+        """Enroll every person in the `people` {username: [paths]} mapping"""
+        start_time = time.time()
+        conn = storage.connect(self.db_path)
+        try:
+            gallery, taken_usernames = load_gallery(conn)
+            # Batch members get provisional negative ids so they are checked
+            # against each other as well as against the stored gallery
+            provisional_id = 0
+            pending = []
+
+            usernames = list(people)
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = pool.map(encode_person, usernames, [people[u] for u in usernames],
+                                   chunksize=max(1, len(usernames) // (self.workers * 4)))
+                for username, encodings, image_rejections in results:
+                    self.images += len(people[username])
+                    self.image_rejections.update(image_rejections)
+
+                    avg_encoding, reason = self.check_person(username, encodings, gallery, taken_usernames)
+                    if reason is not None:
+                        self.rejections[reason] += 1
+                        continue
+
+                    provisional_id -= 1
+                    gallery.add(provisional_id, username, avg_encoding)
+                    taken_usernames.add(username)
+                    pending.append((username, avg_encoding))
+                    if len(pending) >= self.batch_size:
+                        self.enrolled += self.flush(conn, pending)
+                        pending = []
+
+            self.enrolled += self.flush(conn, pending)
+        finally:
+            conn.close()
+        self.elapsed = time.time() - start_time
+
+    def print_summary(self, total_people):
+        """Print throughput and rejection counts"""
+        elapsed = max(self.elapsed, 1e-9)
+        print("\n=== Bulk Enrollment Summary ===")
+        print(f"People processed: {total_people}")
+        print(f"Images processed: {self.images}")
+        print(f"Enrolled: {self.enrolled}" + (" (dry run, nothing written)" if self.dry_run else ""))
+        print(f"Rejected: {sum(self.rejections.values())}")
+        for reason, count in self.rejections.most_common():
+            print(f"  {reason}: {count}")
+        if self.image_rejections:
+            print("Skipped images:")
+            for reason, count in self.image_rejections.most_common():
+                print(f"  {reason}: {count}")
+        print(f"Elapsed: {elapsed:.1f} s")
+        print(f"Throughput: {self.images / elapsed:.1f} images/s, {total_people / elapsed:.1f} people/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Enroll users in bulk from ID photos")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="Directory of <username>.jpg files or <username>/ folders")
+    source.add_argument("--manifest", help="CSV file with username,path rows")
+    parser.add_argument("--db", default=storage.DEFAULT_DB_PATH, help="Path to the SQLite database")
+    parser.add_argument("--workers", type=int, default=None, help="Encoder processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per insert transaction")
+    parser.add_argument("--dry-run", action="store_true", help="Run all checks but do not write to the database")
+    args = parser.parse_args(argv)
+
+    people = collect_from_directory(args.dir) if args.dir else collect_from_manifest(args.manifest)
+    if not people:
+        print("No images found")
+        return 1
+
+    enroller = BulkEnroller(db_path=args.db, workers=args.workers,
+                            batch_size=args.batch_size, dry_run=args.dry_run)
+    enroller.run(people)
+    enroller.print_summary(len(people))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
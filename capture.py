@@ -0,0 +1,112 @@
+import threading
+import time
+
+
+class FrameGrabber:
+    """Continuously drain a camera on a background thread.
+
+    Only the newest frame is kept (a single-slot buffer), stamped with a
+    sequence number and the time it was read, so consumers always see the
+    most recent image instead of whatever the driver had queued. Frames
+    that are overwritten before any consumer picked them up are counted as
+    dropped.
+
+    `camera` is a cv2.VideoCapture or any frame source from frame_sources.
+    With `wait_for_consumer` the thread reads the next frame only after the
+    previous one was taken, so replaying a recording as fast as possible
+    hands every frame to the pipeline. When a recorded source runs out the
+    thread exits and `finished` becomes True.
+    """
+
+    def __init__(self, camera, retry_delay=0.01, wait_for_consumer=False):
+        self.camera = camera
+        self.retry_delay = retry_delay
+        self.wait_for_consumer = wait_for_consumer
+        self.finished = False
+
+        # Also signalled when a consumer takes a frame
+        self._lock = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._frame = None
+        self._timestamp = 0.0
+        self._seq = 0
+        self._consumed_seq = 0
+
+        # Counters
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.read_failures = 0
+        self.consecutive_failures = 0
+
+    @property
+    def is_running(self):
+        return self._running
+
+    def start(self):
+        """Start the capture thread"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="FrameGrabber", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """Stop the capture thread and wait for it to exit"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        """Capture loop, runs until `stop` is called"""
+        while self._running:
+            if self.wait_for_consumer:
+                with self._lock:
+                    while self._running and self._seq > self._consumed_seq:
+                        self._lock.wait(0.1)
+                if not self._running:
+                    break
+
+            ret, frame = self.camera.read()
+            timestamp = time.time()
+            if not ret:
+                if getattr(self.camera, "finished", False):
+                    self.finished = True
+                    break
+                self.read_failures += 1
+                self.consecutive_failures += 1
+                time.sleep(self.retry_delay)
+                continue
+
+            with self._lock:
+                if self._seq > self._consumed_seq:
+                    self.frames_dropped += 1
+                self._frame = frame
+                self._timestamp = timestamp
+                self._seq += 1
+                self.frames_captured += 1
+            self.consecutive_failures = 0
+
+    def latest(self, after_seq=0):
+        """Return (seq, timestamp, frame) for the newest frame.
+
+        Returns None if nothing newer than `after_seq` has been captured,
+        which lets a consumer skip work when the camera has not produced a
+        new image since its last call. The returned frame must be treated
+        as read-only if several consumers share the grabber.
+        """
+        with self._lock:
+            if self._frame is None or self._seq <= after_seq:
+                return None
+            self._consumed_seq = self._seq
+            self._lock.notify()
+            return self._seq, self._timestamp, self._frame
+
+    def stats(self):
+        """Snapshot of the capture counters"""
+        return {
+            "frames_captured": self.frames_captured,
+            "frames_dropped": self.frames_dropped,
+            "read_failures": self.read_failures,
+        }
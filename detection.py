@@ -0,0 +1,97 @@
+import cv2
+import face_recognition
+
+
+def _scale_image(image, scale):
+    """Resize `image` by `scale` with an area filter (no-op for scale 1)"""
+    if scale == 1:
+        return image
+    return cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+class FaceDetector:
+    """HOG face detection that avoids scanning the full frame every time.
+
+    Full-frame detection runs on a downscaled copy and the boxes are mapped
+    back to full resolution. While exactly one face is being followed, the
+    next frames are only searched inside a padded region around its last
+    box, shrunk so the face is just above the HOG window size. A full-frame
+    pass is forced every `redetect_interval` frames, or as soon as the face
+    is lost or a second face shows up in the search region, so the "no face"
+    and "multiple faces" checks keep seeing the whole picture.
+
+    Returned locations use face_recognition's (top, right, bottom, left)
+    order in full-frame coordinates.
+    """
+
+    def __init__(self, downscale=0.5, upsample=1, redetect_interval=10,
+                 roi_padding=0.5, roi_face_size=120):
+        self.downscale = downscale  # Scale of the full-frame detection pass
+        self.upsample = upsample  # HOG upsampling for the full-frame pass
+        self.redetect_interval = redetect_interval  # Frames between forced full passes
+        self.roi_padding = roi_padding  # Padding around the last box, relative to its size
+        self.roi_face_size = roi_face_size  # Target face height in pixels inside the ROI
+
+        self.track_id = 0  # Increments every time a new face starts being tracked
+        self.full_detections = 0
+        self.roi_detections = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the tracked face so the next call does a full-frame pass"""
+        self.last_box = None
+        self.frames_since_full = 0
+
+    def detect(self, rgb_frame):
+        """Return face locations for `rgb_frame`"""
+        if self.last_box is not None and self.frames_since_full < self.redetect_interval:
+            locations = self._detect_in_roi(rgb_frame)
+            if locations is not None:
+                return locations
+        return self._detect_full(rgb_frame)
+
+    def _detect_scaled(self, image, scale, upsample):
+        """Run HOG on `image` resized by `scale` and map boxes back"""
+        locations = face_recognition.face_locations(
+            _scale_image(image, scale), number_of_times_to_upsample=upsample, model="hog"
+        )
+        return [tuple(int(round(v / scale)) for v in location) for location in locations]
+
+    def _detect_full(self, rgb_frame):
+        """Full-frame detection on the downscaled image"""
+        self.full_detections += 1
+        self.frames_since_full = 0
+        locations = self._detect_scaled(rgb_frame, self.downscale, self.upsample)
+        if len(locations) == 1:
+            if self.last_box is None:
+                self.track_id += 1
+            self.last_box = locations[0]
+        else:
+            self.last_box = None
+        return locations
+
+    def _detect_in_roi(self, rgb_frame):
+        """Search around the last box. Returns None when tracking is lost"""
+        self.roi_detections += 1
+        height, width = rgb_frame.shape[:2]
+        top, right, bottom, left = self.last_box
+        pad_y = int((bottom - top) * self.roi_padding)
+        pad_x = int((right - left) * self.roi_padding)
+        y0, y1 = max(0, top - pad_y), min(height, bottom + pad_y)
+        x0, x1 = max(0, left - pad_x), min(width, right + pad_x)
+        if y1 <= y0 or x1 <= x0:
+            self.reset()
+            return None
+
+        scale = min(1.0, self.roi_face_size / max(1, bottom - top))
+        locations = self._detect_scaled(rgb_frame[y0:y1, x0:x1], scale, 0)
+        if len(locations) != 1:
+            # Lost the face or a second one appeared: fall back to a full pass
+            if not locations:
+                self.reset()
+            return None
+
+        roi_top, roi_right, roi_bottom, roi_left = locations[0]
+        self.last_box = (roi_top + y0, roi_right + x0, roi_bottom + y0, roi_left + x0)
+        self.frames_since_full += 1
+        return [self.last_box]
@@ -0,0 +1,101 @@
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def crop_signature(rgb_frame, box, size=16):
+    """Cheap fingerprint of a face crop: a tiny mean-subtracted grey thumbnail.
+
+    Comparing two signatures tells whether the face changed (pose,
+    expression, lighting) without computing an encoding.
+    """
+    top, right, bottom, left = box
+    height, width = rgb_frame.shape[:2]
+    crop = rgb_frame[max(top, 0):min(bottom, height), max(left, 0):min(right, width)]
+    if crop.size == 0:
+        return None
+    thumbnail = cv2.resize(cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY), (size, size),
+                           interpolation=cv2.INTER_AREA).astype(np.float32)
+    thumbnail -= thumbnail.mean()
+    return thumbnail
+
+
+class EncodingCache:
+    """LRU cache of face encodings keyed by tracked face.
+
+    Each key (usually FaceDetector.track_id) holds the last encoding
+    computed for that face with the box and crop signature it came from.
+    A lookup only hits if the entry is younger than `ttl` seconds, the box
+    has not moved or resized by more than `max_shift` of its size, and the
+    signature differs by less than `max_signature_change` grey levels on
+    average; otherwise the face may look different and should be encoded
+    again.
+    """
+
+    def __init__(self, max_entries=32, ttl=0.5, max_shift=0.1, max_signature_change=6.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_shift = max_shift
+        self.max_signature_change = max_signature_change
+        self._entries = OrderedDict()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _same_face(self, entry, box, signature):
+        """True if `box`/`signature` show the cached face essentially unchanged"""
+        cached_box, cached_signature = entry[1], entry[2]
+        top, right, bottom, left = box
+        c_top, c_right, c_bottom, c_left = cached_box
+        size = max(c_right - c_left, c_bottom - c_top, 1)
+        if abs((left + right) - (c_left + c_right)) / 2 > self.max_shift * size:
+            return False
+        if abs((top + bottom) - (c_top + c_bottom)) / 2 > self.max_shift * size:
+            return False
+        if abs(max(right - left, bottom - top) - size) > self.max_shift * size:
+            return False
+        if signature is None or cached_signature is None or signature.shape != cached_signature.shape:
+            return False
+        return float(np.mean(np.abs(signature - cached_signature))) <= self.max_signature_change
+
+    def lookup(self, key, box, signature, now=None, ttl=None):
+        """Return the cached encoding for `key` if the face has not changed, else None.
+
+        `ttl` overrides the cache-wide age limit for this lookup.
+        """
+        now = time.time() if now is None else now
+        ttl = self.ttl if ttl is None else ttl
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[0] > ttl:
+            del self._entries[key]
+            self.evictions += 1
+            entry = None
+        if entry is None or not self._same_face(entry, box, signature):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[3]
+
+    def store(self, key, box, signature, encoding, now=None):
+        """Remember `encoding` as the latest one for `key`"""
+        now = time.time() if now is None else now
+        self._entries[key] = (now, tuple(box), signature, encoding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key):
+        """Forget `key`, e.g. when its session ends"""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,283 @@
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+# Written next to recorded frames; holds capture timestamps for replay
+SESSION_MANIFEST = "session.json"
+# (width, height) requested from live cameras
+CAPTURE_RESOLUTION = (800, 600)
+
+
+class FrameSource:
+    """Base class for everything FrameGrabber can read from.
+
+    Sources follow the cv2.VideoCapture interface (`read`, `isOpened`,
+    `release`). Recorded sources set `finished` once they run out of
+    frames. With `realtime` they sleep so frames come out at the pace they
+    were captured; without it they return frames as fast as they are read
+    and the grabber hands every one of them to the pipeline.
+    """
+
+    is_live = False
+
+    def __init__(self, fps=30.0, realtime=True, loop=False):
+        self.fps = fps
+        self.realtime = realtime
+        self.loop = loop
+        self.finished = False
+        self.frames_read = 0
+        self._start_time = None
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        if self.finished:
+            return False, None
+        frame, offset = self._next_frame()
+        if frame is None and self.loop and self.frames_read > 0:
+            self._rewind()
+            # Pace the next pass from its own first frame
+            self._start_time = None
+            frame, offset = self._next_frame()
+        if frame is None:
+            self.finished = True
+            return False, None
+
+        if self.realtime:
+            if self._start_time is None:
+                self._start_time = time.time() - offset
+            delay = self._start_time + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        self.frames_read += 1
+        return True, frame
+
+    def _next_frame(self):
+        """Return (frame, seconds since the first frame) or (None, None) at the end"""
+        raise NotImplementedError
+
+    def _rewind(self):
+        """Start over from the first frame"""
+        raise NotImplementedError
+
+    def release(self):
+        self.finished = True
+
+
+class CameraSource(FrameSource):
+    """Live camera opened with cv2.VideoCapture"""
+
+    is_live = True
+
+    def __init__(self, index=0, resolution=CAPTURE_RESOLUTION, fps=60):
+        super().__init__(fps=fps, realtime=True)
+        self.index = index
+        self.capture = cv2.VideoCapture(index)
+        if self.capture.isOpened():
+            # Set camera properties for better performance
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+            self.capture.set(cv2.CAP_PROP_FPS, fps)
+            self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Reduce buffer size for real-time processing
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def read(self):
+        # The camera paces itself
+        ret, frame = self.capture.read()
+        if ret:
+            self.frames_read += 1
+        return ret, frame
+
+    def release(self):
+        self.capture.release()
+
+
+class VideoFileSource(FrameSource):
+    """Frames decoded from a video file"""
+
+    def __init__(self, path, realtime=True, loop=False):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        super().__init__(fps=self.capture.get(cv2.CAP_PROP_FPS) or 30.0, realtime=realtime, loop=loop)
+        self._index = 0
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def _next_frame(self):
+        ret, frame = self.capture.read()
+        if not ret:
+            return None, None
+        offset = self._index / self.fps
+        self._index += 1
+        return frame, offset
+
+    def _rewind(self):
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self._index = 0
+
+    def release(self):
+        super().release()
+        self.capture.release()
+
+
+class ImageSequenceSource(FrameSource):
+    """Frames read from a directory of images in file name order.
+
+    A directory written by SessionRecorder carries the original capture
+    timestamps, which realtime replay follows instead of a fixed rate.
+    """
+
+    def __init__(self, directory, fps=30.0, realtime=True, loop=False):
+        super().__init__(fps=fps, realtime=realtime, loop=loop)
+        self.directory = directory
+        self.paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                      if name.lower().endswith(IMAGE_EXTENSIONS)]
+        self.offsets = None
+        manifest_path = os.path.join(directory, SESSION_MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            frames = manifest.get("frames", [])
+            self.paths = [os.path.join(directory, entry["file"]) for entry in frames]
+            self.offsets = [entry["offset"] for entry in frames]
+            self.fps = manifest.get("fps") or self.fps
+        self._index = 0
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def _next_frame(self):
+        while self._index < len(self.paths):
+            index = self._index
+            self._index += 1
+            frame = cv2.imread(self.paths[index])
+            if frame is not None:
+                return frame, self.offsets[index] if self.offsets else index / self.fps
+        return None, None
+
+    def _rewind(self):
+        self._index = 0
+
+
+class ArraySource(FrameSource):
+    """Frames held in memory, e.g. synthetic frames in a benchmark"""
+
+    def __init__(self, frames, fps=30.0, realtime=False, loop=False):
+        super().__init__(fps=fps, realtime=realtime, loop=loop)
+        self.frames = list(frames)
+        self._index = 0
+
+    def isOpened(self):
+        return bool(self.frames)
+
+    def _next_frame(self):
+        if self._index >= len(self.frames):
+            return None, None
+        frame = self.frames[self._index]
+        self._index += 1
+        return frame, (self._index - 1) / self.fps
+
+    def _rewind(self):
+        self._index = 0
+
+
+class SessionRecorder:
+    """Wrap a frame source and save every frame it produces to a directory.
+
+    Frames are written by a background thread so the capture loop is not
+    slowed down by image encoding; if the writer falls behind by more than
+    `max_pending` frames, further frames are not recorded and counted in
+    `frames_skipped`. The directory can be replayed with
+    ImageSequenceSource, which follows the recorded timestamps.
+    """
+
+    def __init__(self, source, directory, image_format=".png", max_pending=64):
+        self.source = source
+        self.directory = directory
+        self.image_format = image_format
+        os.makedirs(directory, exist_ok=True)
+
+        self.frames = []
+        self.frames_recorded = 0
+        self.frames_skipped = 0
+        self._start_time = None
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._write_frames, name="SessionRecorder", daemon=True)
+        self._writer.start()
+
+    @property
+    def finished(self):
+        return getattr(self.source, "finished", False)
+
+    @property
+    def realtime(self):
+        return getattr(self.source, "realtime", True)
+
+    @property
+    def fps(self):
+        return getattr(self.source, "fps", None)
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    def read(self):
+        ret, frame = self.source.read()
+        if ret:
+            now = time.time()
+            if self._start_time is None:
+                self._start_time = now
+            name = f"frame_{len(self.frames) + self.frames_skipped:06d}{self.image_format}"
+            try:
+                # Copy, since the caller may draw on the frame before it is written
+                self._pending.put_nowait((name, frame.copy()))
+                self.frames.append({"file": name, "offset": now - self._start_time})
+            except queue.Full:
+                self.frames_skipped += 1
+        return ret, frame
+
+    def _write_frames(self):
+        """Writer loop; a None item ends it"""
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            name, frame = item
+            cv2.imwrite(os.path.join(self.directory, name), frame)
+            self.frames_recorded += 1
+
+    def release(self):
+        """Release the source, finish writing and save the manifest"""
+        self.source.release()
+        self._pending.put(None)
+        self._writer.join()
+        manifest = {
+            "fps": self.fps,
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "frames": self.frames,
+        }
+        with open(os.path.join(self.directory, SESSION_MANIFEST), "w") as f:
+            json.dump(manifest, f)
+
+
+def open_source(spec, realtime=True, loop=False, resolution=CAPTURE_RESOLUTION, fps=60):
+    """Open a frame source from a camera index, a video file or an image directory.
+
+    `spec` may also be a callable returning a source, e.g. one that builds
+    an ArraySource.
+    """
+    if callable(spec):
+        return spec()
+    if isinstance(spec, int) or (isinstance(spec, str) and spec.isdigit()):
+        return CameraSource(int(spec), resolution=resolution, fps=fps)
+    if os.path.isdir(spec):
+        return ImageSequenceSource(spec, realtime=realtime, loop=loop)
+    return VideoFileSource(spec, realtime=realtime, loop=loop)
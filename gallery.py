@@ -0,0 +1,297 @@
+import numpy as np
+
+
+def last_occurrences(user_ids, names, encodings):
+    """Drop all but the last row of any user id repeated within one batch.
+
+    A later row for the same user supersedes an earlier one, as it would
+    if the rows were added one at a time.
+    """
+    last_row = {int(user_id): i for i, user_id in enumerate(user_ids)}
+    if len(last_row) == len(user_ids):
+        return user_ids, names, encodings
+    keep = sorted(last_row.values())
+    return [user_ids[i] for i in keep], [names[i] for i in keep], encodings[keep]
+
+
+class FaceGallery:
+    """In-memory gallery of enrolled face encodings.
+
+    Encodings live in one preallocated (capacity, dim) float32 matrix with
+    their squared norms cached alongside, so a query is a single
+    matrix-vector product instead of re-stacking a list of arrays on every
+    login attempt. User ids and names are kept in parallel arrays.
+    """
+
+    def __init__(self, dim=128, capacity=1024):
+        self.dim = dim
+        self._size = 0
+        self._matrix = np.empty((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._names = np.empty(capacity, dtype=object)
+        self._row_by_id = {}
+        self.index = None
+
+    @classmethod
+    def from_arrays(cls, ids, names, encodings, sq_norms=None, row_by_id=None):
+        """Wrap existing arrays without copying them, e.g. the memory-mapped
+        blocks of a gallery snapshot.
+
+        `names` may be a list or any sequence indexed like an array, and
+        `row_by_id` a read-only mapping with `get` and `in`, so a snapshot
+        can decode names and find rows on demand. Read-only arrays and such
+        sequences are copied into private memory only when the gallery is
+        first modified, so until then several processes can share the same
+        pages.
+        """
+        encodings = np.asarray(encodings)
+        gallery = cls(dim=encodings.shape[1], capacity=0)
+        gallery._matrix = encodings
+        gallery._sq_norms = (np.einsum("ij,ij->i", encodings, encodings).astype(np.float32)
+                             if sq_norms is None else sq_norms)
+        gallery._ids = np.asarray(ids)
+        if isinstance(names, (list, tuple)):
+            gallery._names = np.empty(len(encodings), dtype=object)
+            gallery._names[:] = names
+        else:
+            gallery._names = names
+        if row_by_id is None:
+            row_by_id = {user_id: row for row, user_id in enumerate(gallery._ids.tolist())}
+        gallery._row_by_id = row_by_id
+        gallery._size = len(encodings)
+        return gallery
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, user_id):
+        return user_id in self._row_by_id
+
+    @property
+    def encodings(self):
+        """View of the stored encodings, one row per user"""
+        return self._matrix[:self._size]
+
+    @property
+    def ids(self):
+        """View of the user ids, aligned with `encodings`"""
+        return self._ids[:self._size]
+
+    @property
+    def names(self):
+        """View of the usernames, aligned with `encodings`"""
+        return self._names[:self._size]
+
+    def _is_writable(self):
+        return (self._matrix.flags.writeable and self._sq_norms.flags.writeable and self._ids.flags.writeable
+                and isinstance(self._names, np.ndarray) and isinstance(self._row_by_id, dict))
+
+    def _make_writable(self):
+        """Copy read-only (e.g. memory-mapped) arrays before the first change"""
+        if self._is_writable():
+            return
+        self._matrix = np.array(self._matrix[:self._size], dtype=np.float32)
+        self._sq_norms = np.array(self._sq_norms[:self._size], dtype=np.float32)
+        self._ids = np.array(self._ids[:self._size], dtype=np.int64)
+        names = np.empty(self._size, dtype=object)
+        names[:] = list(self._names[:self._size])
+        self._names = names
+        self._row_by_id = {user_id: row for row, user_id in enumerate(self._ids.tolist())}
+
+    def _reserve(self, capacity):
+        """Grow the backing arrays so they can hold at least `capacity` rows"""
+        if capacity <= len(self._ids):
+            return
+        new_capacity = max(capacity, 2 * len(self._ids), 16)
+
+        matrix = np.empty((new_capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        sq_norms = np.empty(new_capacity, dtype=np.float32)
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        ids = np.empty(new_capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        names = np.empty(new_capacity, dtype=object)
+        names[:self._size] = self._names[:self._size]
+
+        self._matrix = matrix
+        self._sq_norms = sq_norms
+        self._ids = ids
+        self._names = names
+
+    def add(self, user_id, name, encoding):
+        """Append a single encoding, replacing any existing row for `user_id`"""
+        self.add_many([user_id], [name], np.asarray(encoding).reshape(1, -1))
+
+    def add_many(self, user_ids, names, encodings):
+        """Append several encodings at once (amortized O(1) per row)"""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if len(user_ids) != len(encodings) or len(names) != len(encodings):
+            raise ValueError("user_ids, names and encodings must have the same length")
+        user_ids, names, encodings = last_occurrences(user_ids, names, encodings)
+
+        for user_id in user_ids:
+            if user_id in self._row_by_id:
+                self.remove(user_id)
+
+        count = len(encodings)
+        self._make_writable()
+        self._reserve(self._size + count)
+        start, end = self._size, self._size + count
+
+        self._matrix[start:end] = encodings
+        self._sq_norms[start:end] = np.einsum("ij,ij->i", encodings, encodings)
+        self._ids[start:end] = user_ids
+        self._names[start:end] = names
+        for row, user_id in enumerate(user_ids, start):
+            self._row_by_id[int(user_id)] = row
+        self._size = end
+
+        if self.index is not None:
+            self.index.add(user_ids, encodings)
+
+    def remove(self, user_id):
+        """Remove the row for `user_id` by moving the last row into its slot.
+
+        Returns True if the user was present.
+        """
+        if int(user_id) not in self._row_by_id:
+            return False
+        self._make_writable()
+        row = self._row_by_id.pop(int(user_id))
+        if self.index is not None:
+            self.index.remove(user_id)
+
+        last = self._size - 1
+        if row != last:
+            self._matrix[row] = self._matrix[last]
+            self._sq_norms[row] = self._sq_norms[last]
+            self._ids[row] = self._ids[last]
+            self._names[row] = self._names[last]
+            self._row_by_id[int(self._ids[row])] = row
+        self._names[last] = None
+        self._size = last
+        return True
+
+    def clear(self):
+        """Remove every row while keeping the allocated capacity"""
+        if not self._is_writable():
+            # Drop the read-only arrays instead of copying them
+            self._matrix = np.empty((0, self.dim), dtype=np.float32)
+            self._sq_norms = np.empty(0, dtype=np.float32)
+            self._ids = np.empty(0, dtype=np.int64)
+            self._names = np.empty(0, dtype=object)
+            self._row_by_id = {}
+        self._names[:self._size] = None
+        self._row_by_id.clear()
+        self._size = 0
+        if self.index is not None:
+            self.index.clear()
+
+    def get_encoding(self, user_id):
+        """Return a copy of the stored encoding for `user_id`, or None"""
+        row = self._row_by_id.get(int(user_id))
+        if row is None:
+            return None
+        return self._matrix[row].copy()
+
+    def get_encodings(self, user_ids):
+        """Like `get_encoding` for several users at once"""
+        return [self.get_encoding(user_id) for user_id in user_ids]
+
+    def get_name(self, user_id):
+        """Return the username stored for `user_id`, or None"""
+        row = self._row_by_id.get(int(user_id))
+        if row is None:
+            return None
+        return self._names[row]
+
+    def holds(self, user_ids, names, encodings):
+        """For each row, whether the gallery already stores that user with
+        this name and encoding"""
+        stored = self.get_encodings(user_ids)
+        return [encoding is not None and self.get_name(user_id) == name and (encoding == new).all()
+                for user_id, name, new, encoding in zip(user_ids, names, encodings, stored)]
+
+    def distances(self, encoding, rows=None):
+        """Euclidean distances from `encoding` to every stored row.
+
+        Uses |a - b|^2 = |a|^2 + |b|^2 - 2 a.b so the whole gallery is
+        scanned with one BLAS matrix-vector product. `rows` optionally
+        restricts the computation to a subset of row indices.
+        """
+        query = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        if rows is None:
+            matrix = self._matrix[:self._size]
+            sq_norms = self._sq_norms[:self._size]
+        else:
+            matrix = self._matrix[rows]
+            sq_norms = self._sq_norms[rows]
+
+        sq_distances = matrix @ query
+        sq_distances *= -2.0
+        sq_distances += sq_norms
+        sq_distances += np.dot(query, query)
+        np.maximum(sq_distances, 0.0, out=sq_distances)
+        return np.sqrt(sq_distances, out=sq_distances)
+
+    def attach_index(self, index):
+        """Route searches through an approximate index such as `IVFIndex`.
+
+        The index must already contain every row; from here on the gallery
+        keeps it up to date on add and remove. Pass None to detach.
+        """
+        self.index = index
+
+    def search(self, encoding, k=1, nprobe=None):
+        """Return the `k` closest users as a list of (user_id, name, distance).
+
+        With an index attached only its shortlist is scanned, but distances
+        are always recomputed exactly from the stored encodings so callers
+        can apply thresholds to them unchanged. `nprobe` overrides the
+        index's recall/speed setting for this query.
+        """
+        if self._size == 0:
+            return []
+        if self.index is not None:
+            shortlist = self.index.candidates(encoding, nprobe=nprobe)
+            rows = np.array([self._row_by_id[user_id] for user_id in shortlist.tolist()
+                             if user_id in self._row_by_id], dtype=np.int64)
+            if len(rows) >= k:
+                return self._top_k(self.distances(encoding, rows=rows), rows, k)
+        distances = self.distances(encoding)
+        return self._top_k(distances, np.arange(self._size), k)
+
+    def search_batch(self, encodings, k=1, nprobe=None):
+        """Search several encodings at once; returns one result list per encoding.
+
+        Without an index the whole batch is scored with a single
+        matrix-matrix product, which is cheaper than one scan per query.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if self._size == 0:
+            return [[] for _ in range(len(encodings))]
+        if self.index is not None or len(encodings) == 1:
+            return [self.search(encoding, k=k, nprobe=nprobe) for encoding in encodings]
+
+        sq_distances = encodings @ self._matrix[:self._size].T
+        sq_distances *= -2.0
+        sq_distances += self._sq_norms[:self._size]
+        sq_distances += np.einsum("ij,ij->i", encodings, encodings)[:, None]
+        np.maximum(sq_distances, 0.0, out=sq_distances)
+        distances = np.sqrt(sq_distances, out=sq_distances)
+        rows = np.arange(self._size)
+        return [self._top_k(row_distances, rows, k) for row_distances in distances]
+
+    def _top_k(self, distances, rows, k):
+        """Pick the `k` smallest `distances` and map them back to users"""
+        k = min(k, len(distances))
+        if k < len(distances):
+            candidates = np.argpartition(distances, k - 1)[:k]
+        else:
+            candidates = np.arange(len(distances))
+        candidates = candidates[np.argsort(distances[candidates], kind="stable")]
+        return [
+            (int(self._ids[rows[i]]), self._names[rows[i]], float(distances[i]))
+            for i in candidates
+        ]
@@ -0,0 +1,267 @@
+import argparse
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+import storage
+from gallery import FaceGallery
+
+MAGIC = b"FACEGAL\x00"
+# 2: rows sorted by user id
+SNAPSHOT_VERSION = 2
+# Only float32 encodings are written for now; the code leaves room for others
+DTYPE_CODES = {"float32": 1}
+# magic, version, dtype code, dim, count, change-log seq, crc32 of everything after the header
+HEADER = struct.Struct("<8sIIIQqI")
+HEADER_SIZE = 64
+ALIGNMENT = 64
+
+
+class SnapshotError(ValueError):
+    """The snapshot file is missing, truncated, corrupt or of another version"""
+
+
+def snapshot_path_for(db_path):
+    """Return the path of the gallery snapshot that sits next to `db_path`"""
+    return os.path.splitext(db_path)[0] + ".gallery"
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _layout(count, dim, names_size=0):
+    """Byte offsets of the encodings, norms, ids, name offsets and names blocks"""
+    encodings = HEADER_SIZE
+    sq_norms = _align(encodings + count * dim * 4)
+    ids = _align(sq_norms + count * 4)
+    name_offsets = _align(ids + count * 8)
+    names = _align(name_offsets + (count + 1) * 8)
+    return encodings, sq_norms, ids, name_offsets, names, names + names_size
+
+
+def write_snapshot(path, ids, names, encodings, change_seq):
+    """Write a snapshot of the given users, reflecting change-log `change_seq`.
+
+    Rows are stored sorted by user id so a reader can find them with a
+    binary search. The file is written next to `path` and moved into
+    place, so processes that have the old one mapped keep a consistent
+    view.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    ids = ids[order]
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(len(ids), storage.ENCODING_DIM)[order]
+    count, dim = encodings.shape
+    encoded_names = [names[i].encode("utf-8") for i in order.tolist()]
+    name_offsets = np.zeros(count + 1, dtype=np.uint64)
+    name_offsets[1:] = np.cumsum([len(name) for name in encoded_names], dtype=np.uint64)
+    layout = _layout(count, dim, int(name_offsets[-1]))
+
+    blocks = [
+        (layout[0], encodings.tobytes()),
+        (layout[1], np.einsum("ij,ij->i", encodings, encodings).astype(np.float32).tobytes()),
+        (layout[2], ids.tobytes()),
+        (layout[3], name_offsets.tobytes()),
+        (layout[4], b"".join(encoded_names)),
+    ]
+    body = bytearray(layout[5] - HEADER_SIZE)
+    for offset, data in blocks:
+        body[offset - HEADER_SIZE:offset - HEADER_SIZE + len(data)] = data
+    header = HEADER.pack(MAGIC, SNAPSHOT_VERSION, DTYPE_CODES["float32"], dim, count, change_seq,
+                         zlib.crc32(body))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\x00"))
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+class SnapshotNames:
+    """Usernames of a snapshot, decoded from the mapped blob on access"""
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _decode(self, row):
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        # A damaged name must not stop a search; the checksum reports it
+        return bytes(self._blob[start:end]).decode("utf-8", errors="replace")
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if not -len(self) <= key < len(self):
+                raise IndexError("row out of range")
+            return self._decode(int(key) % len(self))
+        rows = range(len(self))[key] if isinstance(key, slice) else np.asarray(key).tolist()
+        names = np.empty(len(rows), dtype=object)
+        names[:] = [self._decode(row) for row in rows]
+        return names
+
+
+class SnapshotRows:
+    """Read-only user id -> row mapping over a snapshot's sorted ids"""
+
+    def __init__(self, ids):
+        self._ids = ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, user_id, default=None):
+        row = int(np.searchsorted(self._ids, user_id))
+        if row < len(self._ids) and self._ids[row] == user_id:
+            return row
+        return default
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __getitem__(self, user_id):
+        row = self.get(user_id)
+        if row is None:
+            raise KeyError(user_id)
+        return row
+
+
+class GallerySnapshot:
+    """A snapshot file opened with np.memmap.
+
+    `encodings`, `sq_norms` and `ids` are views into the mapped file and
+    usernames are decoded on access, so opening costs the same for any
+    number of users and kiosk processes on one machine share the pages
+    through the OS page cache. The payload checksum is only read by
+    `verify`.
+    """
+
+    def __init__(self, path, verify=False):
+        self.path = path
+        try:
+            data = np.memmap(path, dtype=np.uint8, mode="r")
+        except (OSError, ValueError) as e:
+            raise SnapshotError(f"Cannot open snapshot {path}: {e}") from None
+        if len(data) < HEADER_SIZE:
+            raise SnapshotError(f"Snapshot {path} is truncated")
+
+        magic, version, dtype_code, dim, count, change_seq, checksum = HEADER.unpack(
+            bytes(data[:HEADER.size]))
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not a gallery snapshot")
+        if version != SNAPSHOT_VERSION or dtype_code != DTYPE_CODES["float32"]:
+            raise SnapshotError(f"Snapshot {path} has unsupported version {version} / dtype {dtype_code}")
+        layout = _layout(count, dim)
+        if len(data) < layout[4]:
+            raise SnapshotError(f"Snapshot {path} is truncated")
+
+        self.dim = dim
+        self.count = count
+        self.change_seq = change_seq
+        self.checksum = checksum
+        self._data = data
+        self.encodings = data[layout[0]:layout[0] + count * dim * 4].view(np.float32).reshape(count, dim)
+        self.sq_norms = data[layout[1]:layout[1] + count * 4].view(np.float32)
+        self.ids = data[layout[2]:layout[2] + count * 8].view(np.int64)
+        name_offsets = data[layout[3]:layout[3] + (count + 1) * 8].view(np.uint64)
+        if len(data) < layout[4] + int(name_offsets[-1]):
+            raise SnapshotError(f"Snapshot {path} is truncated")
+        self.names = SnapshotNames(name_offsets, data[layout[4]:layout[4] + int(name_offsets[-1])])
+        if verify:
+            self.verify()
+
+    def verify(self):
+        """Check the payload against the header checksum (reads the whole file)"""
+        if zlib.crc32(self._data[HEADER_SIZE:]) != self.checksum:
+            raise SnapshotError(f"Snapshot {self.path} failed its checksum")
+
+    def to_gallery(self):
+        """A FaceGallery backed by the mapped arrays (copied on first change)"""
+        return FaceGallery.from_arrays(self.ids, self.names, self.encodings, self.sq_norms,
+                                       row_by_id=SnapshotRows(self.ids))
+
+
+def build_snapshot(conn, path):
+    """Write a snapshot of every user in `conn`. Returns (change_seq, users)"""
+    conn.execute("BEGIN")
+    try:
+        seq = storage.latest_change_seq(conn)
+        ids, usernames, encodings = storage.load_encodings(conn)
+    finally:
+        conn.commit()
+    write_snapshot(path, ids, usernames, encodings, seq)
+    return seq, len(ids)
+
+
+def open_snapshot(conn, path, allow_behind=True, verify=False):
+    """Return the GallerySnapshot at `path` if it can stand in for the
+    users in `conn`, else None and the caller should load from SQLite.
+
+    A snapshot at the database's change-log seq with the same number of
+    users is used as is. With `allow_behind` an older one is used too when
+    the change log still covers everything since, so a GallerySync started
+    at its seq catches up. The checksum is only checked with `verify`.
+    """
+    try:
+        snapshot = GallerySnapshot(path, verify=verify)
+    except SnapshotError:
+        return None
+    latest = storage.latest_change_seq(conn)
+    if snapshot.change_seq == latest:
+        if snapshot.count != storage.count_users(conn):
+            # Same seq but different users: the database was replaced
+            return None
+    elif (not allow_behind or snapshot.change_seq > latest
+          or storage.fetch_changes(conn, snapshot.change_seq) is None):
+        return None
+    return snapshot
+
+
+def load_gallery_from_snapshot(conn, path, allow_behind=True, verify=True):
+    """Return (gallery, change_seq) from the snapshot at `path`, or None if
+    there is no usable one (see `open_snapshot`).
+
+    The checksum is verified first unless `verify` is False, e.g. for a
+    file this process just wrote or one that is checked in the background.
+    """
+    snapshot = open_snapshot(conn, path, allow_behind=allow_behind, verify=verify)
+    if snapshot is None:
+        return None
+    return snapshot.to_gallery(), snapshot.change_seq
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write or inspect the memory-mapped gallery snapshot")
+    parser.add_argument("--db", default=storage.DEFAULT_DB_PATH, help="Path to the SQLite database")
+    parser.add_argument("--output", default=None, help="Snapshot path (default: next to the database)")
+    parser.add_argument("--info", action="store_true", help="Show the snapshot header and whether it is current")
+    args = parser.parse_args(argv)
+
+    path = args.output or snapshot_path_for(args.db)
+    conn = storage.connect(args.db)
+    try:
+        if args.info:
+            try:
+                snapshot = GallerySnapshot(path, verify=True)
+            except SnapshotError as e:
+                print(e)
+                return 1
+            current = storage.latest_change_seq(conn)
+            print(f"{path}: {snapshot.count} users, dim {snapshot.dim}, change seq {snapshot.change_seq} "
+                  f"(database at {current}, {'current' if snapshot.change_seq == current else 'behind'})")
+            return 0
+        seq, count = build_snapshot(conn, path)
+        print(f"Wrote {count} users to {path} at change seq {seq}")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import queue
+import sqlite3
+import threading
+
+import storage
+
+
+class GallerySync:
+    """Follow the users change log and hand deltas to the gallery owner.
+
+    A background thread with its own connection checks `PRAGMA
+    data_version`, which only changes when another connection commits, and
+    reads new `user_changes` entries when it does. It never touches the
+    gallery itself: updates are queued and the owner applies them with
+    `apply_to` at a convenient point, so the camera loop never waits on the
+    database. If the log has been pruned past the last applied entry the
+    thread queues a full reload instead.
+    """
+
+    def __init__(self, db_path, last_seq, poll_interval=0.5):
+        self.db_path = db_path
+        self.last_seq = last_seq
+        self.poll_interval = poll_interval
+
+        self._updates = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Counters
+        self.polls = 0
+        self.reloads = 0
+        self.errors = 0
+
+    def start(self):
+        """Start the polling thread"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="GallerySync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        """Stop the polling thread"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        """Poll loop, runs until `stop` is called"""
+        conn = None
+        data_version = None
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    if conn is None:
+                        conn = storage.connect(self.db_path)
+                    current = conn.execute("PRAGMA data_version").fetchone()[0]
+                    if current != data_version:
+                        data_version = current
+                        self.poll(conn)
+                except sqlite3.Error as e:
+                    # Database busy or replaced; retry with a fresh connection
+                    self.errors += 1
+                    print(f"Gallery sync failed: {e}")
+                    if conn is not None:
+                        conn.close()
+                    conn = None
+                    data_version = None
+                self._stop_event.wait(self.poll_interval)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def poll(self, conn):
+        """Read changes newer than `last_seq` and queue them"""
+        self.polls += 1
+        conn.execute("BEGIN")
+        try:
+            changes = storage.fetch_changes(conn, self.last_seq)
+            if changes is None:
+                seq = storage.latest_change_seq(conn)
+                ids, usernames, encodings = storage.load_encodings(conn)
+                self._updates.put(("reload", seq, ids, usernames, encodings))
+                self.reloads += 1
+                self.last_seq = seq
+                return
+            if not changes:
+                return
+
+            # Only the final operation per user matters
+            final_ops = {}
+            for _, user_id, op in changes:
+                final_ops[user_id] = op
+            upserted = [user_id for user_id, op in final_ops.items() if op != "delete"]
+            ids, usernames, encodings = storage.load_users(conn, upserted)
+            # Anything that is gone from users by now counts as deleted
+            removed = set(final_ops) - set(ids)
+        finally:
+            conn.commit()
+
+        seq = changes[-1][0]
+        self._updates.put(("delta", seq, sorted(removed), ids, usernames, encodings))
+        self.last_seq = seq
+
+    def apply_to(self, gallery):
+        """Apply every queued update to `gallery`. Returns True if it changed"""
+        changed = False
+        while True:
+            try:
+                update = self._updates.get_nowait()
+            except queue.Empty:
+                return changed
+
+            if update[0] == "reload":
+                _, _, ids, usernames, encodings = update
+                gallery.clear()
+                if ids:
+                    gallery.add_many(ids, usernames, encodings)
+                changed = True
+            else:
+                _, _, removed, ids, usernames, encodings = update
+                for user_id in removed:
+                    changed = gallery.remove(user_id) or changed
+                # Skip rows the gallery already holds with identical data,
+                # e.g. a registration made by this same process
+                fresh = [i for i, held in enumerate(gallery.holds(ids, usernames, encodings)) if not held]
+                if fresh:
+                    gallery.add_many([ids[i] for i in fresh], [usernames[i] for i in fresh], encodings[fresh])
+                    changed = True
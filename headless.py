@@ -0,0 +1,156 @@
+import argparse
+import json
+import sys
+import time
+
+import storage
+from auth_engine import FaceAuthEngine
+
+
+class HeadlessRunner:
+    """Drive FaceAuthEngine from the command line without a display.
+
+    Engine events are written to stdout as one JSON object per line so a
+    supervising process can consume them.
+    """
+
+    def __init__(self, engine, idle_sleep=0.005):
+        self.engine = engine
+        self.engine.listener = self.handle_event
+        self.idle_sleep = idle_sleep
+        self.retry_login = False
+        self.result = None
+
+    def handle_event(self, event, data):
+        """Print an engine event and remember the outcome of the session"""
+        print(json.dumps({"event": event, "time": time.time(), **data}), flush=True)
+        if event in ("registration_completed", "login_succeeded"):
+            self.result = True
+        elif event == "registration_failed":
+            self.result = False
+        elif event == "login_failed":
+            if data["final"]:
+                self.result = False
+            elif not data["retrying"]:
+                self.retry_login = True
+
+    def run_session(self, timeout=None):
+        """Feed frames to the engine until the current session ends"""
+        start_time = time.time()
+        deadline = None if timeout is None else start_time + timeout
+        start_frames = self.engine.frames_processed.value
+        completed = True
+        while self.engine.is_camera_active:
+            if deadline is not None and time.time() > deadline:
+                self.engine.stop_camera()
+                self.handle_event("timeout", {})
+                completed = False
+                break
+            if self.engine.process_frame() is None:
+                time.sleep(self.idle_sleep)
+
+        # Throughput of the session, e.g. for a recording replayed as fast as possible
+        elapsed = time.time() - start_time
+        frames = self.engine.frames_processed.value - start_frames
+        self.handle_event("session_stats", {"frames": frames, "elapsed": elapsed,
+                                            "fps": frames / elapsed if elapsed > 0 else 0.0})
+        return completed
+
+    def register(self, username, timeout=None):
+        """Register `username`. Returns True on success"""
+        if self.engine.check_username_exists(username):
+            self.handle_event("error", {"title": "Error", "message": f"Username '{username}' is already registered"})
+            return False
+        self.result = None
+        if not self.engine.start_registration(username):
+            return False
+        self.run_session(timeout)
+        return bool(self.result)
+
+    def login(self, timeout=None, claimed_username=None):
+        """Run one login, including its retries. Returns True on success.
+
+        With `claimed_username` the face is only checked against that user.
+        """
+        if len(self.engine.gallery) == 0:
+            self.handle_event("info", {"title": "Info", "message": "No registered users found. Please register first."})
+            return False
+        self.result = None
+        started = self.engine.start_login(claimed_username=claimed_username)
+        while started:
+            self.retry_login = False
+            if not self.run_session(timeout):
+                return False
+            if not self.retry_login:
+                break
+            started = self.engine.start_login(reset_attempts=False)
+        return bool(self.result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run face registration or login without a GUI")
+    parser.add_argument("--db", default=storage.DEFAULT_DB_PATH, help="Path to the SQLite database")
+    parser.add_argument("--camera", type=int, default=0, help="Camera index to open")
+    parser.add_argument("--delay", type=float, default=None,
+                        help="Seconds to wait before recognition starts (default: engine setting)")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Give up on a session after this many seconds")
+    parser.add_argument("--source", default=None,
+                        help="Video file or image directory to read instead of the camera")
+    parser.add_argument("--fast", action="store_true",
+                        help="Replay --source as fast as possible instead of at its recorded pace")
+    parser.add_argument("--record", default=None, metavar="DIR",
+                        help="Save the frames of every session under DIR for later replay")
+    parser.add_argument("--gallery-precision", choices=["int8", "float16"], default=None,
+                        help="Keep the gallery quantized in memory to save RAM on small devices")
+    parser.add_argument("--gallery-shards", type=int, default=None, metavar="N",
+                        help="Search the gallery with N worker processes (large galleries on many-core hosts)")
+    parser.add_argument("--recognition-worker", action="store_true",
+                        help="Run detection, quality checks and encoding in a separate process")
+    parser.add_argument("--no-snapshot", action="store_true",
+                        help="Always load the gallery from the database instead of the snapshot file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    register_parser = subparsers.add_parser("register", help="Register a new user")
+    register_parser.add_argument("username")
+
+    login_parser = subparsers.add_parser("login", help="Identify the person in front of the camera")
+    login_parser.add_argument("--loop", action="store_true",
+                              help="Keep serving logins until interrupted (daemon mode)")
+    login_parser.add_argument("--user", default=None,
+                              help="Only verify that the face belongs to this user (1:1 match)")
+    args = parser.parse_args(argv)
+
+    try:
+        engine = FaceAuthEngine(db_path=args.db, gallery_precision=args.gallery_precision,
+                                gallery_shards=args.gallery_shards, use_gallery_snapshot=not args.no_snapshot,
+                                use_recognition_worker=args.recognition_worker)
+    except Exception as e:
+        print(json.dumps({"event": "error", "title": "Startup Error", "message": str(e)}), flush=True)
+        return 2
+
+    engine.camera_index = args.camera
+    engine.frame_source = args.source
+    engine.replay_realtime = not args.fast
+    engine.record_sessions_dir = args.record
+    if args.delay is not None:
+        engine.recognition_delay = args.delay
+        engine.streaming_login_delay = args.delay
+    runner = HeadlessRunner(engine)
+
+    try:
+        if args.command == "register":
+            return 0 if runner.register(args.username, timeout=args.timeout) else 1
+        if args.loop:
+            while True:
+                runner.login(timeout=args.timeout, claimed_username=args.user)
+                time.sleep(1)  # Give the last person time to step away
+        return 0 if runner.login(timeout=args.timeout, claimed_username=args.user) else 1
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        engine.cleanup()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
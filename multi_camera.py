@@ -0,0 +1,324 @@
+import argparse
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import storage
+from ann_index import index_path_for, load_or_build_index
+from capture import FrameGrabber
+from detection import FaceDetector
+from frame_sources import open_source
+from gallery_sync import GallerySync
+from sharded_gallery import ShardedGallery
+
+
+class BatchEncoder:
+    """Compute face encodings for crops from several frames in one call.
+
+    Landmarks are found per face, each face is cut into an aligned 150x150
+    chip, and all chips go through dlib's recognition network together,
+    which amortises the per-call overhead across streams. The chips are
+    the same ones face_recognition.face_encodings would use, so encodings
+    stay comparable with the enrolled ones.
+    """
+
+    def __init__(self):
+        import dlib
+        import face_recognition.api as face_recognition_api
+
+        self.dlib = dlib
+        self.pose_predictor = face_recognition_api.pose_predictor_5_point
+        self.face_encoder = face_recognition_api.face_encoder
+        self.batches = 0
+        self.faces = 0
+
+    def encode(self, items):
+        """Return one encoding per (rgb_frame, (top, right, bottom, left)) item"""
+        if not items:
+            return []
+        chips = []
+        for rgb_frame, (top, right, bottom, left) in items:
+            shape = self.pose_predictor(rgb_frame, self.dlib.rectangle(left, top, right, bottom))
+            chips.append(self.dlib.get_face_chip(rgb_frame, shape, size=150, padding=0.25))
+        descriptors = self.face_encoder.compute_face_descriptor(chips)
+        self.batches += 1
+        self.faces += len(items)
+        return [np.array(descriptor, dtype=np.float32) for descriptor in descriptors]
+
+
+class StreamState:
+    """Per-entrance state: frame source, tracker, cooldown and latency stats.
+
+    This replaces the engine's `current_username` / `login_mode`
+    attributes, which only work for a single camera.
+    """
+
+    def __init__(self, name, source, latency_window=1000):
+        self.name = name
+        self.source = source
+        self.grabber = FrameGrabber(source, wait_for_consumer=not getattr(source, "realtime", True))
+        self.detector = FaceDetector(downscale=0.5, redetect_interval=10)
+        self.last_frame_seq = 0
+        self.cooldown_until = 0.0
+        self.low_light_frames = 0
+
+        # Stats
+        self.frames = 0  # Frames run through detection
+        self.cooldown_frames = 0  # Frames read but skipped during the cooldown
+        self.decisions = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    @property
+    def finished(self):
+        return self.grabber.finished
+
+    def start(self):
+        self.grabber.start()
+
+    def stop(self):
+        self.grabber.stop()
+        self.source.release()
+
+    def latency_stats(self):
+        """p50/p95 in milliseconds from capture to decision over the recent window"""
+        if not self.latencies:
+            return {"p50_ms": None, "p95_ms": None}
+        ordered = sorted(self.latencies)
+        return {
+            "p50_ms": ordered[len(ordered) // 2] * 1000,
+            "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        }
+
+
+class MultiCameraService:
+    """Serve logins on several frame sources at once from one process.
+
+    Every tick takes the newest frame of each stream, runs detection for
+    all streams on a thread pool, encodes every single-face crop in one
+    batch and matches the batch against the shared gallery. Each stream
+    then waits `cooldown` seconds before it reports the next person.
+    Events go to `listener(event, data)` like FaceAuthEngine's, with the
+    stream name in `data`.
+    """
+
+    def __init__(self, sources, db_path=storage.DEFAULT_DB_PATH, listener=None,
+                 realtime=True, detection_workers=None, gallery_shards=None):
+        self.db_path = db_path
+        self.listener = listener
+        self.streams = [StreamState(str(name), open_source(spec, realtime=realtime))
+                        for name, spec in sources]
+
+        # Recognition parameters, same meaning as in FaceAuthEngine
+        self.recognition_threshold = 0.4
+        self.low_light_threshold = 40
+        self.max_low_light_frames = 10
+        self.cooldown = 3.0  # Seconds a stream stays quiet after a decision
+        self.idle_sleep = 0.005
+        self.ann_min_gallery_size = 10000
+        self.ann_nprobe = 8
+        self.use_ann_index = gallery_shards is None  # Shards always scan exactly
+        self.ann_index_path = index_path_for(db_path)
+
+        self.detection_pool = ThreadPoolExecutor(max_workers=detection_workers or len(self.streams),
+                                                 thread_name_prefix="Detect")
+        self.encoder = BatchEncoder()
+
+        self.conn = storage.connect(db_path)
+        if gallery_shards is not None:
+            # Every tick's batch is scanned by all shard processes at once
+            self.gallery, seq = storage.load_gallery_with_seq(self.conn, ShardedGallery(num_shards=gallery_shards))
+        else:
+            self.gallery, seq = storage.load_gallery_with_seq(self.conn)
+        self.init_ann_index()
+        self.gallery_sync = GallerySync(db_path, seq)
+        self.gallery_sync.start()
+
+        self.start_time = None
+        self.total_frames = 0
+
+    def init_ann_index(self):
+        """Attach the persisted ANN index to the gallery once it is large enough"""
+        if not self.use_ann_index or len(self.gallery) < self.ann_min_gallery_size:
+            return
+        try:
+            self.gallery.attach_index(load_or_build_index(self.ann_index_path, self.gallery,
+                                                          nprobe=self.ann_nprobe))
+        except (OSError, ValueError) as e:
+            print(f"ANN index unavailable, using exact search: {e}", file=sys.stderr)
+
+    def sync_gallery(self):
+        """Apply user changes made by other processes, attaching or saving
+        the ANN index as the gallery grows"""
+        if not self.gallery_sync.apply_to(self.gallery):
+            return
+        if self.gallery.index is None:
+            self.init_ann_index()
+            return
+        try:
+            self.gallery.index.save(self.ann_index_path)
+        except OSError as e:
+            print(f"Failed to save ANN index: {e}", file=sys.stderr)
+
+    def emit(self, event, **data):
+        """Send an event to the listener, if any"""
+        if self.listener is not None:
+            self.listener(event, data)
+
+    def start(self):
+        """Start capturing on every stream"""
+        for stream in self.streams:
+            if not stream.source.isOpened():
+                self.emit("error", stream=stream.name, message="Could not open frame source")
+            stream.start()
+        self.start_time = time.time()
+
+    def stop(self):
+        """Stop every stream and release shared resources"""
+        self.gallery_sync.stop()
+        for stream in self.streams:
+            stream.stop()
+        self.detection_pool.shutdown(wait=True)
+        if isinstance(self.gallery, ShardedGallery):
+            self.gallery.close()
+        self.conn.close()
+
+    @property
+    def finished(self):
+        """True once every stream has run out of frames (recorded sources only)"""
+        return all(stream.finished for stream in self.streams)
+
+    def detect(self, stream, frame):
+        """Lighting check and detection for one stream (runs on the pool)"""
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        # Mean over a subsampled BGR frame is close enough to grey-level brightness
+        if np.mean(frame[::4, ::4]) < self.low_light_threshold:
+            stream.low_light_frames += 1
+            if stream.low_light_frames >= self.max_low_light_frames:
+                return rgb_frame, None
+        else:
+            stream.low_light_frames = 0
+        return rgb_frame, stream.detector.detect(rgb_frame)
+
+    def tick(self):
+        """Process the newest frame of every stream once. Returns frames processed"""
+        self.sync_gallery()
+
+        now = time.time()
+        pending = []
+        for stream in self.streams:
+            frame_data = stream.grabber.latest(after_seq=stream.last_frame_seq)
+            if frame_data is None:
+                continue
+            stream.last_frame_seq, timestamp, frame = frame_data
+            if now < stream.cooldown_until:
+                stream.cooldown_frames += 1
+                continue
+            stream.frames += 1
+            pending.append((stream, timestamp, self.detection_pool.submit(self.detect, stream, frame)))
+        self.total_frames += len(pending)
+
+        # Gather single-face crops from all streams into one encoder batch
+        batch = []
+        for stream, timestamp, future in pending:
+            rgb_frame, face_locations = future.result()
+            if face_locations is not None and len(face_locations) == 1:
+                batch.append((stream, timestamp, rgb_frame, face_locations[0]))
+        if not batch:
+            return len(pending)
+
+        encodings = self.encoder.encode([(rgb_frame, box) for _, _, rgb_frame, box in batch])
+        matches = self.gallery.search_batch(encodings, k=1)
+        decided_at = time.time()
+        for (stream, timestamp, _, _), match in zip(batch, matches):
+            stream.latencies.append(decided_at - timestamp)
+            stream.decisions += 1
+            stream.cooldown_until = decided_at + self.cooldown
+            if match and match[0][2] <= self.recognition_threshold:
+                _, username, distance = match[0]
+                self.emit("login_succeeded", stream=stream.name, username=username, distance=distance)
+            else:
+                distance = match[0][2] if match else None
+                self.emit("login_failed", stream=stream.name, distance=distance,
+                          message="User not found in the database.")
+        return len(pending)
+
+    def stats(self):
+        """Aggregate throughput and per-stream latency"""
+        elapsed = max(time.time() - (self.start_time or time.time()), 1e-9)
+        return {
+            "elapsed": elapsed,
+            "frames": self.total_frames,
+            "fps": self.total_frames / elapsed,
+            "encoder_batches": self.encoder.batches,
+            "mean_batch_size": self.encoder.faces / self.encoder.batches if self.encoder.batches else 0.0,
+            "streams": {
+                stream.name: {
+                    "frames": stream.frames,
+                    "fps": stream.frames / elapsed,
+                    "cooldown_frames": stream.cooldown_frames,
+                    "decisions": stream.decisions,
+                    "frames_dropped": stream.grabber.frames_dropped,
+                    **stream.latency_stats(),
+                }
+                for stream in self.streams
+            },
+        }
+
+    def run(self, report_interval=10.0, duration=None):
+        """Serve until interrupted, `duration` passes or all recorded sources end"""
+        self.start()
+        next_report = time.time() + report_interval
+        deadline = None if duration is None else time.time() + duration
+        try:
+            while not self.finished:
+                if self.tick() == 0:
+                    time.sleep(self.idle_sleep)
+                now = time.time()
+                if now >= next_report:
+                    self.emit("stats", **self.stats())
+                    next_report = now + report_interval
+                if deadline is not None and now >= deadline:
+                    break
+        finally:
+            self.emit("stats", **self.stats())
+            self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve face logins on several cameras from one process")
+    parser.add_argument("--source", action="append", required=True, metavar="[NAME=]SOURCE",
+                        help="Camera index, video file or image directory; repeat once per entrance")
+    parser.add_argument("--db", default=storage.DEFAULT_DB_PATH, help="Path to the SQLite database")
+    parser.add_argument("--fast", action="store_true", help="Replay recorded sources as fast as possible")
+    parser.add_argument("--workers", type=int, default=None, help="Detection threads (default: one per stream)")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="Search the gallery with this many worker processes")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Seconds between stats events")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+    args = parser.parse_args(argv)
+
+    sources = []
+    for index, entry in enumerate(args.source):
+        name, _, spec = entry.rpartition("=")
+        sources.append((name or f"stream{index}", spec))
+
+    def print_event(event, data):
+        print(json.dumps({"event": event, "time": time.time(), **data}), flush=True)
+
+    service = MultiCameraService(sources, db_path=args.db, listener=print_event,
+                                 realtime=not args.fast, detection_workers=args.workers,
+                                 gallery_shards=args.shards)
+    try:
+        service.run(report_interval=args.report_interval, duration=args.duration)
+    except KeyboardInterrupt:
+        return 130
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import math
+
+import cv2
+import numpy as np
+
+# Side length the face crop is resized to before measuring sharpness, so
+# the Laplacian variance does not depend on how close the face is
+SHARPNESS_SIZE = 96
+
+
+def frame_scores(frame, step=4):
+    """Brightness and contrast of a BGR frame, measured on every `step`-th pixel.
+
+    Uses the same luma weights as cv2.COLOR_BGR2GRAY without converting the
+    full frame.
+    """
+    sample = frame[::step, ::step].astype(np.float32)
+    gray = sample[..., 0] * 0.114 + sample[..., 1] * 0.587 + sample[..., 2] * 0.299
+    return {"brightness": float(gray.mean()), "contrast": float(gray.std())}
+
+
+def pose_from_landmarks(landmarks):
+    """Return (yaw, roll_degrees) from face_recognition's 5-point landmarks.
+
+    Yaw is the nose tip's horizontal offset from the midpoint between the
+    eyes, in eye distances: about 0 for a frontal face and growing as the
+    head turns. Roll is the angle of the line between the eyes.
+    """
+    eyes = sorted([np.mean(landmarks["left_eye"], axis=0), np.mean(landmarks["right_eye"], axis=0)],
+                  key=lambda point: point[0])
+    nose = np.mean(landmarks["nose_tip"], axis=0)
+    eye_vector = eyes[1] - eyes[0]
+    eye_distance = max(float(np.hypot(*eye_vector)), 1e-6)
+    midpoint = (eyes[0] + eyes[1]) / 2
+    yaw = float(nose[0] - midpoint[0]) / eye_distance
+    roll = math.degrees(math.atan2(eye_vector[1], eye_vector[0]))
+    return yaw, roll
+
+
+class QualityGate:
+    """Reject frames and faces that are not worth detecting or encoding.
+
+    `check_frame` runs on a subsampled frame before detection;
+    `check_face` runs on the detected face before encoding and also finds
+    the 5-point landmarks for the pose check, which costs far less than an
+    encoding. Both return (ok, reason, scores); `scores["score"]` in
+    `check_face` combines everything into 0..1 so callers can prefer the
+    best samples.
+    """
+
+    def __init__(self, min_brightness=40, max_brightness=220, min_contrast=12,
+                 min_sharpness=40.0, min_face_size=80, max_yaw=0.35, max_roll=20.0):
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_contrast = min_contrast
+        self.min_sharpness = min_sharpness
+        self.min_face_size = min_face_size
+        self.max_yaw = max_yaw
+        self.max_roll = max_roll
+
+    def check_exposure(self, scores):
+        """Return the reason `scores` fail the exposure limits, or None"""
+        if scores["brightness"] < self.min_brightness:
+            return "too_dark"
+        if scores["brightness"] > self.max_brightness:
+            return "too_bright"
+        if scores["contrast"] < self.min_contrast:
+            return "low_contrast"
+        return None
+
+    def check_frame(self, frame):
+        """Exposure check on the whole BGR frame"""
+        scores = frame_scores(frame)
+        reason = self.check_exposure(scores)
+        return reason is None, reason, scores
+
+    def check_face(self, rgb_frame, box):
+        """Size, exposure, sharpness and pose check of the face in `box`"""
+        top, right, bottom, left = box
+        height, width = rgb_frame.shape[:2]
+        size = min(right - left, bottom - top)
+        scores = {"face_size": size}
+        if size < self.min_face_size:
+            return False, "face_too_small", scores
+
+        crop = rgb_frame[max(top, 0):min(bottom, height), max(left, 0):min(right, width)]
+        if crop.size == 0:
+            return False, "face_too_small", scores
+        gray = cv2.resize(cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY), (SHARPNESS_SIZE, SHARPNESS_SIZE),
+                          interpolation=cv2.INTER_AREA)
+        scores["brightness"] = float(gray.mean())
+        scores["contrast"] = float(gray.std())
+        scores["sharpness"] = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+        reason = self.check_exposure(scores)
+        if reason is None and scores["sharpness"] < self.min_sharpness:
+            reason = "blurred"
+
+        if reason is None:
+            import face_recognition
+
+            landmarks = face_recognition.face_landmarks(rgb_frame, [box], model="small")
+            if landmarks:
+                scores["yaw"], scores["roll"] = pose_from_landmarks(landmarks[0])
+                if abs(scores["yaw"]) > self.max_yaw or abs(scores["roll"]) > self.max_roll:
+                    reason = "off_angle"
+
+        scores["score"] = self.combined_score(scores)
+        return reason is None, reason, scores
+
+    def combined_score(self, scores):
+        """Average of the individual scores, each mapped to 0..1"""
+        parts = [
+            min(scores["face_size"] / (2 * self.min_face_size), 1.0),
+            1.0 - min(abs(scores["brightness"] - 128) / 128, 1.0),
+            min(scores["contrast"] / (4 * self.min_contrast), 1.0),
+            min(scores["sharpness"] / (4 * self.min_sharpness), 1.0),
+        ]
+        if "yaw" in scores:
+            parts.append(1.0 - min(abs(scores["yaw"]) / self.max_yaw, 1.0))
+            parts.append(1.0 - min(abs(scores["roll"]) / self.max_roll, 1.0))
+        return sum(parts) / len(parts)
+
+
+# Shown to the user when a face fails the gate
+REASON_MESSAGES = {
+    "too_dark": "Low light detected. Please improve lighting conditions.",
+    "too_bright": "Image is overexposed. Please avoid direct light behind or on the camera.",
+    "low_contrast": "Image is washed out. Please improve lighting conditions.",
+    "face_too_small": "Face too small. Please move closer to the camera.",
+    "blurred": "Image is blurred. Please hold still.",
+    "off_angle": "Please look straight at the camera.",
+}
@@ -0,0 +1,313 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from gallery import FaceGallery, last_occurrences
+
+# Storage type of each supported precision
+CODE_DTYPES = {"int8": np.int8, "float16": np.float16}
+
+# Value range assumed per dimension until enough encodings have been seen
+# to measure it; face_recognition encodings stay well inside it
+DEFAULT_RANGE = (-0.5, 0.5)
+
+# Relative and absolute slack added to the re-rank bound
+BOUND_RTOL = 1e-5
+BOUND_ATOL = 1e-6
+
+
+class QuantizedGallery(FaceGallery):
+    """FaceGallery that keeps its encodings in int8 or float16.
+
+    With "int8" every dimension d is stored as round((x - offset[d]) /
+    scale[d]), with offset and scale measured on the first batch loaded;
+    "float16" stores the values as they are. Either cuts the matrix to a
+    quarter or a half of the float32 one and the scan reads that much less
+    memory.
+
+    A search scans the compact matrix first. Each row also remembers how
+    far its stored value is from the real encoding, which bounds how much
+    its coarse distance can be off, so every row that could still be among
+    the true top `k` is known. Only those rows are re-ranked with the full
+    precision encodings fetched through `loader(user_ids) -> (ids,
+    usernames, encodings)`, e.g. `storage.load_users` on the database, and
+    the results match an exact FaceGallery's. Without a loader the coarse
+    distances are returned as they are.
+    """
+
+    def __init__(self, dim=128, capacity=1024, precision="int8", loader=None,
+                 full_cache_size=1024, min_calibration_rows=64, scan_block=4096):
+        if precision not in CODE_DTYPES:
+            raise ValueError(f"Unsupported precision {precision!r}, expected one of {sorted(CODE_DTYPES)}")
+        self.precision = precision
+        self.code_dtype = CODE_DTYPES[precision]
+        self.loader = loader
+        self.full_cache_size = full_cache_size
+        self.min_calibration_rows = min_calibration_rows
+        self.scan_block = scan_block
+        self._full_cache = OrderedDict()
+        self._calibrated = False
+        self.offset = np.zeros(dim, dtype=np.float32)
+        self.scale = np.ones(dim, dtype=np.float32)
+        if precision == "int8":
+            self._fit(np.array([[DEFAULT_RANGE[0]] * dim, [DEFAULT_RANGE[1]] * dim], dtype=np.float32))
+
+        super().__init__(dim=dim, capacity=0)
+        self._errors = np.empty(0, dtype=np.float32)
+        self._reserve(capacity)
+
+        # Counters
+        self.reranked = 0
+        self.full_loads = 0
+
+    def _fit(self, encodings, headroom=1.1):
+        """Measure the per-dimension offset and scale on `encodings`"""
+        low = encodings.min(axis=0)
+        high = encodings.max(axis=0)
+        self.offset = ((low + high) / 2).astype(np.float32)
+        half_range = np.maximum((high - low) / 2 * headroom, 1e-6)
+        self.scale = (half_range / 127).astype(np.float32)
+
+    def _reserve(self, capacity):
+        """Grow the backing arrays so they can hold at least `capacity` rows"""
+        if capacity <= len(self._ids):
+            return
+        new_capacity = max(capacity, 2 * len(self._ids), 16)
+
+        matrix = np.empty((new_capacity, self.dim), dtype=self.code_dtype)
+        matrix[:self._size] = self._matrix[:self._size]
+        sq_norms = np.empty(new_capacity, dtype=np.float32)
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        errors = np.empty(new_capacity, dtype=np.float32)
+        errors[:self._size] = self._errors[:self._size]
+        ids = np.empty(new_capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        names = np.empty(new_capacity, dtype=object)
+        names[:self._size] = self._names[:self._size]
+
+        self._matrix = matrix
+        self._sq_norms = sq_norms
+        self._errors = errors
+        self._ids = ids
+        self._names = names
+
+    def quantize(self, encodings):
+        """Return the stored codes for float `encodings`"""
+        if self.precision == "float16":
+            return encodings.astype(np.float16)
+        codes = np.rint((encodings - self.offset) / self.scale)
+        return np.clip(codes, -127, 127).astype(np.int8)
+
+    def dequantize(self, codes):
+        """Approximate float32 encodings for stored `codes`"""
+        if self.precision == "float16":
+            return codes.astype(np.float32)
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    @property
+    def encodings(self):
+        """Approximate (dequantized) copy of the stored encodings, one row per user"""
+        return self.dequantize(self._matrix[:self._size])
+
+    @property
+    def nbytes(self):
+        """Memory held by the per-row arrays, excluding the usernames"""
+        return self._matrix.nbytes + self._sq_norms.nbytes + self._errors.nbytes + self._ids.nbytes
+
+    def add_many(self, user_ids, names, encodings):
+        """Append several encodings at once (amortized O(1) per row)"""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if len(user_ids) != len(encodings) or len(names) != len(encodings):
+            raise ValueError("user_ids, names and encodings must have the same length")
+        user_ids, names, encodings = last_occurrences(user_ids, names, encodings)
+
+        for user_id in user_ids:
+            if user_id in self._row_by_id:
+                self.remove(user_id)
+            self._full_cache.pop(int(user_id), None)
+
+        if (self.precision == "int8" and not self._calibrated and self._size == 0
+                and len(encodings) >= self.min_calibration_rows):
+            self._fit(encodings)
+            self._calibrated = True
+
+        count = len(encodings)
+        self._reserve(self._size + count)
+        start, end = self._size, self._size + count
+
+        codes = self.quantize(encodings)
+        approx = self.dequantize(codes)
+        self._matrix[start:end] = codes
+        centred = approx - self.offset
+        self._sq_norms[start:end] = np.einsum("ij,ij->i", centred, centred)
+        # Bound on |true distance - coarse distance| for any query
+        self._errors[start:end] = np.linalg.norm(encodings - approx, axis=1)
+        self._ids[start:end] = user_ids
+        self._names[start:end] = names
+        for row, user_id in enumerate(user_ids, start):
+            self._row_by_id[int(user_id)] = row
+        self._size = end
+
+        if self.index is not None:
+            self.index.add(user_ids, encodings)
+
+    def remove(self, user_id):
+        """Remove the row for `user_id`. Returns True if the user was present"""
+        row = self._row_by_id.get(int(user_id))
+        if row is not None and row != self._size - 1:
+            self._errors[row] = self._errors[self._size - 1]
+        self._full_cache.pop(int(user_id), None)
+        return super().remove(user_id)
+
+    def clear(self):
+        """Remove every row; the next large batch recalibrates the scale"""
+        super().clear()
+        self._full_cache.clear()
+        self._calibrated = False
+
+    def get_encoding(self, user_id):
+        """Return the encoding for `user_id`, or None.
+
+        Full precision when a loader is set, otherwise the stored
+        approximation.
+        """
+        row = self._row_by_id.get(int(user_id))
+        if row is None:
+            return None
+        if self.loader is not None:
+            full = self.full_encodings(np.array([user_id], dtype=np.int64))
+            if full[0] is not None:
+                return full[0].copy()
+        return self.dequantize(self._matrix[row])
+
+    def get_encodings(self, user_ids):
+        """Like `get_encoding` for several users, with a single loader call
+        for the ones not in the cache"""
+        rows = [self._row_by_id.get(int(user_id)) for user_id in user_ids]
+        present = np.array([int(user_id) for user_id, row in zip(user_ids, rows) if row is not None],
+                           dtype=np.int64)
+        full = iter(self.full_encodings(present) if self.loader is not None else [None] * len(present))
+        result = []
+        for row in rows:
+            if row is None:
+                result.append(None)
+                continue
+            encoding = next(full)
+            result.append(encoding.copy() if encoding is not None else self.dequantize(self._matrix[row]))
+        return result
+
+    def holds(self, user_ids, names, encodings):
+        """For each row, whether the gallery already stores that user with
+        this name and encoding.
+
+        Answered from memory: the loader would return the database's
+        current value, not what the codes were built from, so a row only
+        counts as held when its cached full-precision encoding and its
+        codes both match. Anything else is simply re-added.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        codes = self.quantize(encodings)
+        held = []
+        for user_id, name, encoding, code in zip(user_ids, names, encodings, codes):
+            row = self._row_by_id.get(int(user_id))
+            cached = self._full_cache.get(int(user_id))
+            held.append(row is not None and cached is not None and self._names[row] == name
+                        and (cached == encoding).all() and (self._matrix[row] == code).all())
+        return held
+
+    def full_encodings(self, user_ids):
+        """Full precision encodings for `user_ids` (None where the loader has
+        no row), served from a small LRU cache in front of the loader"""
+        result = [None] * len(user_ids)
+        missing = []
+        for i, user_id in enumerate(user_ids.tolist()):
+            encoding = self._full_cache.get(user_id)
+            if encoding is None:
+                missing.append(i)
+            else:
+                self._full_cache.move_to_end(user_id)
+                result[i] = encoding
+
+        if missing:
+            ids, _, encodings = self.loader([int(user_ids[i]) for i in missing])
+            self.full_loads += len(ids)
+            loaded = dict(zip(ids, encodings))
+            for i in missing:
+                encoding = loaded.get(int(user_ids[i]))
+                if encoding is None:
+                    continue
+                result[i] = encoding
+                self._full_cache[int(user_ids[i])] = encoding
+            while len(self._full_cache) > self.full_cache_size:
+                self._full_cache.popitem(last=False)
+        return result
+
+    def distances(self, encoding, rows=None):
+        """Coarse Euclidean distances from `encoding` to the stored rows.
+
+        The matrix is converted to float32 `scan_block` rows at a time so
+        the scan never holds a full-precision copy of the gallery.
+        """
+        query = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        codes = self._matrix[:self._size] if rows is None else self._matrix[rows]
+        sq_norms = self._sq_norms[:self._size] if rows is None else self._sq_norms[rows]
+
+        # |q - (offset + scale * c)|^2 = |q - offset|^2 - 2 c . ((q - offset) * scale) + |scale * c|^2,
+        # the last term being the cached row norm (float16 has offset 0 and scale 1)
+        shifted = query - self.offset
+        weights = shifted * self.scale
+        sq_distances = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.scan_block):
+            block = codes[start:start + self.scan_block]
+            sq_distances[start:start + len(block)] = block.astype(np.float32) @ weights
+        sq_distances *= -2.0
+        sq_distances += sq_norms
+        sq_distances += np.dot(shifted, shifted)
+        np.maximum(sq_distances, 0.0, out=sq_distances)
+        return np.sqrt(sq_distances, out=sq_distances)
+
+    def search(self, encoding, k=1, nprobe=None):
+        """Return the `k` closest users as a list of (user_id, name, distance).
+
+        Distances are exact when a loader is set (see the class docstring).
+        """
+        if self._size == 0:
+            return []
+        rows = None
+        if self.index is not None:
+            shortlist = self.index.candidates(encoding, nprobe=nprobe)
+            rows = np.array([self._row_by_id[user_id] for user_id in shortlist.tolist()
+                             if user_id in self._row_by_id], dtype=np.int64)
+            if len(rows) < k:
+                rows = None
+        if rows is None:
+            rows = np.arange(self._size)
+
+        coarse = self.distances(encoding, rows=rows)
+        if self.loader is None:
+            return self._top_k(coarse, rows, k)
+
+        # Keep every row whose lower bound beats the k-th best upper bound
+        errors = self._errors[rows]
+        k = min(k, len(rows))
+        upper = coarse + errors
+        bound = np.partition(upper, k - 1)[k - 1]
+        # Slack for float32 rounding in the coarse distances
+        bound = bound * (1 + BOUND_RTOL) + BOUND_ATOL
+        candidates = np.flatnonzero(coarse - errors <= bound)
+        self.reranked += len(candidates)
+
+        candidate_rows = rows[candidates]
+        full = self.full_encodings(self._ids[candidate_rows])
+        kept = [i for i, encoding_ in enumerate(full) if encoding_ is not None]
+        if not kept:
+            return []
+        candidate_rows = candidate_rows[kept]
+        query = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        exact = np.linalg.norm(np.array([full[i] for i in kept], dtype=np.float32) - query, axis=1)
+        return self._top_k(exact.astype(np.float32), candidate_rows, k)
+
+    def search_batch(self, encodings, k=1, nprobe=None):
+        """Search several encodings at once; returns one result list per encoding"""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        return [self.search(encoding, k=k, nprobe=nprobe) for encoding in encodings]
@@ -0,0 +1,198 @@
+import multiprocessing as mp
+import queue
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Control messages sent on the request queue alongside (seq, slot, want_encoding)
+_STOP = "stop"
+_RESET = "reset"
+
+
+def _worker_main(shm_name, frame_shape, slots, requests, results, detector_options, quality_gate):
+    """Entry point of the recognition process.
+
+    Frames are read straight out of the shared-memory ring; only small
+    (seq, slot, want_encoding) tuples and the detection results cross the
+    queues. When several requests are waiting only the newest one is
+    processed and the others are answered as dropped so their slots are
+    released.
+
+    With want_encoding and a single face, the face is also quality checked
+    and fingerprinted on the same frame it was found in, and only encoded
+    if it passes the check.
+    """
+    import cv2
+    import face_recognition
+    from detection import FaceDetector
+    from encoding_cache import crop_signature
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray((slots,) + tuple(frame_shape), dtype=np.uint8, buffer=shm.buf)
+    detector = FaceDetector(**detector_options)
+    try:
+        while True:
+            message = requests.get()
+            # Skip ahead to the newest request
+            pending = [message]
+            while True:
+                try:
+                    pending.append(requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            if _STOP in pending:
+                for request in pending:
+                    if isinstance(request, tuple):
+                        results.put((request[0], request[1], None, None, None, None))
+                break
+            if _RESET in pending:
+                detector.reset()
+            frames = [request for request in pending if isinstance(request, tuple)]
+            if not frames:
+                continue
+            for seq, slot, _ in frames[:-1]:
+                results.put((seq, slot, None, None, None, None))
+
+            seq, slot, want_encoding = frames[-1]
+            rgb_frame = cv2.cvtColor(ring[slot], cv2.COLOR_BGR2RGB)
+            face_locations = detector.detect(rgb_frame)
+            face_encodings = []
+            face_check = signature = None
+            if want_encoding and len(face_locations) == 1:
+                face_check = quality_gate.check_face(rgb_frame, face_locations[0])
+                signature = crop_signature(rgb_frame, face_locations[0])
+                if face_check[0]:
+                    face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+            results.put((seq, slot, face_locations, face_encodings, face_check, signature))
+    finally:
+        del ring
+        shm.close()
+
+
+class RecognitionWorker:
+    """Run face detection and encoding in a separate process.
+
+    The GUI copies each BGR frame into a free slot of a shared-memory ring
+    and posts the slot number; the worker answers with face locations and,
+    when asked, the quality check, crop signature and encoding of a single
+    face. A slot stays reserved until its result comes
+    back, so the worker never reads a slot that is being overwritten, and
+    `submit` simply declines frames while every slot is in flight.
+    """
+
+    def __init__(self, frame_shape, slots=3, detector_options=None, quality_gate=None):
+        self.frame_shape = tuple(frame_shape)
+        self.slots = slots
+        self.detector_options = detector_options or {}
+        if quality_gate is None:
+            from quality import QualityGate
+
+            quality_gate = QualityGate()
+        self.quality_gate = quality_gate
+
+        self._shm = None
+        self._ring = None
+        self._process = None
+        self._requests = None
+        self._results = None
+        self._free_slots = []
+        self._seq = 0
+        self._min_seq = 0
+
+        # Counters
+        self.frames_submitted = 0
+        self.frames_declined = 0
+        self.frames_dropped = 0
+
+    @property
+    def is_running(self):
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        """Allocate the shared ring and launch the worker process"""
+        frame_bytes = int(np.prod(self.frame_shape))
+        self._shm = shared_memory.SharedMemory(create=True, size=frame_bytes * self.slots)
+        self._ring = np.ndarray((self.slots,) + self.frame_shape, dtype=np.uint8, buffer=self._shm.buf)
+        self._free_slots = list(range(self.slots))
+
+        self._requests = mp.Queue()
+        self._results = mp.Queue()
+        self._process = mp.Process(
+            target=_worker_main,
+            args=(self._shm.name, self.frame_shape, self.slots,
+                  self._requests, self._results, self.detector_options, self.quality_gate),
+            name="RecognitionWorker",
+            daemon=True,
+        )
+        self._process.start()
+
+    def submit(self, frame, want_encoding=False):
+        """Queue `frame` for recognition. Returns its sequence number, or None
+        if the frame was declined because all slots are busy"""
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match worker shape {self.frame_shape}")
+        if not self._free_slots:
+            self.frames_declined += 1
+            return None
+
+        slot = self._free_slots.pop()
+        self._ring[slot] = frame
+        self._seq += 1
+        self._requests.put((self._seq, slot, want_encoding))
+        self.frames_submitted += 1
+        return self._seq
+
+    def poll(self):
+        """Return (seq, face_locations, face_encodings, face_check,
+        signature) for the newest finished frame, or None if no new result
+        arrived since the last call. `face_check` is QualityGate.check_face's
+        (ok, reason, scores) and `signature` the crop_signature of the face,
+        both None unless the frame was submitted with want_encoding and had
+        a single face"""
+        latest = None
+        while True:
+            try:
+                seq, slot, face_locations, face_encodings, face_check, signature = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._free_slots.append(slot)
+            if face_locations is None:
+                self.frames_dropped += 1
+            elif seq <= self._min_seq:
+                # Submitted before the last reset, belongs to an old session
+                continue
+            elif latest is None or seq > latest[0]:
+                latest = (seq, face_locations, face_encodings, face_check, signature)
+        return latest
+
+    def reset(self):
+        """Start a new session: drop tracking state in the worker and ignore
+        results for frames submitted before this call"""
+        self._min_seq = self._seq
+        if self._requests is not None:
+            self._requests.put(_RESET)
+
+    def stop(self, timeout=2.0):
+        """Stop the worker process and release the shared memory"""
+        if self._process is not None:
+            if self._process.is_alive():
+                self._requests.put(_STOP)
+                self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join(timeout)
+            self._process = None
+
+        for q in (self._requests, self._results):
+            if q is not None:
+                q.cancel_join_thread()
+                q.close()
+        self._requests = self._results = None
+
+        if self._shm is not None:
+            self._ring = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        self._free_slots = []
@@ -0,0 +1,77 @@
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+BOX_COLOR = (0, 255, 0)
+
+
+class FrameRenderer:
+    """Draw RGB camera frames into a Tk label with reusable buffers.
+
+    The frame is area-resized straight into a preallocated array, copied
+    into a persistent PIL image and pasted into one PhotoImage that the
+    label keeps showing, so no per-frame image objects are created. The
+    face box is drawn on the small display buffer rather than the full
+    frame. `max_fps` limits how often the label is redrawn, independently
+    of how fast frames are captured and processed.
+    """
+
+    def __init__(self, label, display_size=(640, 480), max_fps=30):
+        self.label = label
+        self.display_size = display_size
+        self.max_fps = max_fps
+
+        width, height = display_size
+        self.buffer = np.zeros((height, width, 3), dtype=np.uint8)
+        self.image = Image.new("RGB", display_size)
+        self.photo = None
+
+        self.last_render = 0.0
+        self.frames_rendered = 0
+        self.frames_skipped = 0
+
+    def is_due(self, now=None):
+        """True if enough time has passed since the last redraw"""
+        if not self.max_fps:
+            return True
+        now = time.perf_counter() if now is None else now
+        return now - self.last_render >= 1.0 / self.max_fps
+
+    def render(self, rgb_frame, face_box=None):
+        """Show `rgb_frame` with an optional (top, right, bottom, left) box.
+
+        Returns False if the frame was skipped because of the FPS cap.
+        """
+        now = time.perf_counter()
+        if not self.is_due(now):
+            self.frames_skipped += 1
+            return False
+        self.last_render = now
+
+        cv2.resize(rgb_frame, self.display_size, dst=self.buffer, interpolation=cv2.INTER_AREA)
+        if face_box is not None:
+            top, right, bottom, left = face_box
+            scale_x = self.display_size[0] / rgb_frame.shape[1]
+            scale_y = self.display_size[1] / rgb_frame.shape[0]
+            cv2.rectangle(self.buffer, (int(left * scale_x), int(top * scale_y)),
+                          (int(right * scale_x), int(bottom * scale_y)), BOX_COLOR, 2)
+
+        # Decode into the existing image instead of wrapping a new one
+        self.image.frombytes(self.buffer.data)
+        if self.photo is None:
+            self.photo = ImageTk.PhotoImage(image=self.image)
+            self.label.config(image=self.photo)
+            # Keep a reference so Tk does not drop the image
+            self.label.image = self.photo
+        else:
+            self.photo.paste(self.image)
+        self.frames_rendered += 1
+        return True
+
+    def clear(self):
+        """Detach the image from the label, e.g. when the camera stops"""
+        self.label.config(image="")
+        self.label.image = None
+        self.photo = None
@@ -0,0 +1,413 @@
+import math
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from gallery import last_occurrences
+
+# Control messages sent on a shard's request queue
+_STOP = "stop"
+_ATTACH = "attach"
+_SEARCH = "search"
+
+# How often a waiting search checks that its shards are still running
+_LIVENESS_INTERVAL = 0.1
+
+
+def _shard_views(buf, capacity, dim):
+    """(matrix, sq_norms) arrays laid out back to back in a shard's shared block"""
+    matrix = np.ndarray((capacity, dim), dtype=np.float32, buffer=buf)
+    sq_norms = np.ndarray((capacity,), dtype=np.float32, buffer=buf, offset=capacity * dim * 4)
+    return matrix, sq_norms
+
+
+def _shard_main(shard_index, dim, requests, results):
+    """Entry point of a shard process.
+
+    The coordinator writes the shard's encodings into shared memory and
+    sends ("attach", name, capacity) whenever the block is replaced. A
+    ("search", seq, queries, size, k) request scans the first `size` rows
+    and answers with the top `k` row numbers and distances per query.
+    """
+    shm = None
+    matrix = sq_norms = None
+    try:
+        while True:
+            message = requests.get()
+            if message[0] == _STOP:
+                break
+            if message[0] == _ATTACH:
+                _, name, capacity = message
+                matrix = sq_norms = None
+                if shm is not None:
+                    shm.close()
+                shm = shared_memory.SharedMemory(name=name)
+                matrix, sq_norms = _shard_views(shm.buf, capacity, dim)
+                continue
+
+            _, seq, queries, size, k = message
+            # Same expansion as FaceGallery.distances, for the whole batch at once
+            sq_distances = queries @ matrix[:size].T
+            sq_distances *= -2.0
+            sq_distances += sq_norms[:size]
+            sq_distances += np.einsum("ij,ij->i", queries, queries)[:, None]
+            np.maximum(sq_distances, 0.0, out=sq_distances)
+            distances = np.sqrt(sq_distances, out=sq_distances)
+
+            top = min(k, size)
+            if top < size:
+                rows = np.argpartition(distances, top - 1, axis=1)[:, :top]
+            else:
+                rows = np.broadcast_to(np.arange(size), (len(queries), size))
+            results.put((seq, shard_index, rows, np.take_along_axis(distances, rows, axis=1)))
+    finally:
+        matrix = sq_norms = None
+        if shm is not None:
+            shm.close()
+
+
+class GalleryShard:
+    """One partition of a ShardedGallery, owned by the coordinator.
+
+    The coordinator keeps ids and names and writes encodings straight into
+    the shared block the worker process scans; only queries and top-k
+    results cross the queues.
+    """
+
+    def __init__(self, index, dim, capacity, results):
+        self.index = index
+        self.dim = dim
+        self.size = 0
+        self._results = results
+        self._shm = None
+        self._retired = []
+        self._matrix = None
+        self._sq_norms = None
+        self._ids = np.empty(0, dtype=np.int64)
+        self._names = np.empty(0, dtype=object)
+
+        self._requests = mp.Queue()
+        # Allocate before starting the worker so it shares our resource tracker
+        self._reserve(capacity)
+        self._process = mp.Process(target=_shard_main, args=(index, dim, self._requests, results),
+                                   name=f"GalleryShard-{index}", daemon=True)
+        self._process.start()
+
+    @property
+    def is_running(self):
+        return self._process is not None and self._process.is_alive()
+
+    def _reserve(self, capacity):
+        """Move to a larger shared block that holds at least `capacity` rows"""
+        if self._matrix is not None and capacity <= len(self._ids):
+            return
+        capacity = max(capacity, 2 * len(self._ids), 16)
+
+        shm = shared_memory.SharedMemory(create=True, size=capacity * (self.dim + 1) * 4)
+        matrix, sq_norms = _shard_views(shm.buf, capacity, self.dim)
+        ids = np.empty(capacity, dtype=np.int64)
+        names = np.empty(capacity, dtype=object)
+        if self._matrix is not None:
+            matrix[:self.size] = self._matrix[:self.size]
+            sq_norms[:self.size] = self._sq_norms[:self.size]
+            ids[:self.size] = self._ids[:self.size]
+            names[:self.size] = self._names[:self.size]
+        self._requests.put((_ATTACH, shm.name, capacity))
+
+        # The worker may not have attached to the old block yet, so it is
+        # only unlinked once the worker has answered a later request
+        self._matrix = self._sq_norms = None
+        if self._shm is not None:
+            self._retired.append(self._shm)
+        self._shm = shm
+        self._matrix, self._sq_norms = matrix, sq_norms
+        self._ids, self._names = ids, names
+
+    def append(self, user_ids, names, encodings):
+        """Store rows at the end; returns their row numbers"""
+        self._reserve(self.size + len(user_ids))
+        start, end = self.size, self.size + len(user_ids)
+        self._matrix[start:end] = encodings
+        self._sq_norms[start:end] = np.einsum("ij,ij->i", encodings, encodings)
+        self._ids[start:end] = user_ids
+        self._names[start:end] = names
+        self.size = end
+        return range(start, end)
+
+    def pop_row(self, row):
+        """Remove `row` by moving the last row into it; returns the user id
+        now at `row`, or None if `row` was the last one"""
+        last = self.size - 1
+        moved = None
+        if row != last:
+            self._matrix[row] = self._matrix[last]
+            self._sq_norms[row] = self._sq_norms[last]
+            self._ids[row] = self._ids[last]
+            self._names[row] = self._names[last]
+            moved = int(self._ids[row])
+        self._names[last] = None
+        self.size = last
+        return moved
+
+    def release_retired(self):
+        """Free blocks replaced before the worker's last answer"""
+        for shm in self._retired:
+            shm.close()
+            shm.unlink()
+        self._retired = []
+
+    def row(self, row):
+        """(user_id, name, encoding copy) stored at `row`"""
+        return int(self._ids[row]), self._names[row], self._matrix[row].copy()
+
+    def search(self, seq, queries, k):
+        """Send a search request; the answer arrives on the shared results queue"""
+        self._requests.put((_SEARCH, seq, queries, self.size, k))
+
+    def stop(self, timeout=2.0):
+        """Stop the worker process and release the shared block"""
+        if self._process is not None:
+            if self._process.is_alive():
+                self._requests.put((_STOP,))
+                self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join(timeout)
+            self._process = None
+        if self._requests is not None:
+            self._requests.cancel_join_thread()
+            self._requests.close()
+            self._requests = None
+        self._matrix = self._sq_norms = None
+        if self._shm is not None:
+            self._retired.append(self._shm)
+            self._shm = None
+        self.release_retired()
+
+
+class ShardedGallery:
+    """Gallery partitioned across worker processes, one per core.
+
+    Drop-in for FaceGallery where searches must use more than one core:
+    each shard keeps its encodings in shared memory scanned by its own
+    process, and a query is sent to every shard at once, with the
+    per-shard top `k` merged here. New users go to the smallest shard,
+    deletions to the shard that holds the user, and `add_shards` moves
+    rows onto new shards until all are even. Approximate indexes are not
+    supported; each shard always scans exactly.
+
+    Call `close` to stop the workers and free the shared memory.
+    """
+
+    def __init__(self, num_shards=None, dim=128, capacity=1024, search_timeout=5.0):
+        self.dim = dim
+        self.search_timeout = search_timeout
+        self.index = None
+        self._results = mp.Queue()
+        self._shards = []
+        self._shard_by_id = {}
+        self._row_by_id = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._capacity_per_shard = capacity
+        self.add_shards(num_shards or os.cpu_count() or 1)
+
+    def __len__(self):
+        return len(self._row_by_id)
+
+    def __contains__(self, user_id):
+        return int(user_id) in self._row_by_id
+
+    @property
+    def num_shards(self):
+        return len(self._shards)
+
+    @property
+    def shard_sizes(self):
+        return [shard.size for shard in self._shards]
+
+    @property
+    def ids(self):
+        """User ids of every shard, in shard order"""
+        return np.concatenate([shard._ids[:shard.size] for shard in self._shards])
+
+    @property
+    def names(self):
+        """Usernames aligned with `ids`"""
+        return np.concatenate([shard._names[:shard.size] for shard in self._shards])
+
+    @property
+    def encodings(self):
+        """Copy of every encoding, aligned with `ids`"""
+        return np.concatenate([shard._matrix[:shard.size] for shard in self._shards])
+
+    def attach_index(self, index):
+        if index is not None:
+            raise ValueError("ShardedGallery does not support an approximate index")
+
+    def add_shards(self, count=1):
+        """Start `count` more shard processes and rebalance rows onto them"""
+        with self._lock:
+            for _ in range(count):
+                self._shards.append(GalleryShard(len(self._shards), self.dim,
+                                                 self._capacity_per_shard, self._results))
+            self._rebalance()
+
+    def _rebalance(self):
+        """Move rows from the largest shards to the smallest until their
+        sizes differ by at most one"""
+        while True:
+            largest = max(self._shards, key=lambda shard: shard.size)
+            smallest = min(self._shards, key=lambda shard: shard.size)
+            excess = (largest.size - smallest.size) // 2
+            if excess == 0:
+                return
+            rows = [largest.row(row) for row in range(largest.size - excess, largest.size)]
+            for row in range(largest.size - 1, largest.size - excess - 1, -1):
+                self._remove_row(largest, row)
+            self._append(smallest, [r[0] for r in rows], [r[1] for r in rows],
+                         np.array([r[2] for r in rows], dtype=np.float32))
+
+    def _append(self, shard, user_ids, names, encodings):
+        for row, user_id in zip(shard.append(user_ids, names, encodings), user_ids):
+            self._shard_by_id[int(user_id)] = shard
+            self._row_by_id[int(user_id)] = row
+
+    def _remove_row(self, shard, row):
+        user_id = int(shard._ids[row])
+        moved = shard.pop_row(row)
+        if moved is not None:
+            self._row_by_id[moved] = row
+        del self._shard_by_id[user_id]
+        del self._row_by_id[user_id]
+
+    def add(self, user_id, name, encoding):
+        """Add a single encoding, replacing any existing row for `user_id`"""
+        self.add_many([user_id], [name], np.asarray(encoding).reshape(1, -1))
+
+    def add_many(self, user_ids, names, encodings):
+        """Add several encodings, filling the smallest shards first"""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if len(user_ids) != len(encodings) or len(names) != len(encodings):
+            raise ValueError("user_ids, names and encodings must have the same length")
+        user_ids, names, encodings = last_occurrences(user_ids, names, encodings)
+
+        with self._lock:
+            for user_id in user_ids:
+                if int(user_id) in self._row_by_id:
+                    self._remove_row(self._shard_by_id[int(user_id)], self._row_by_id[int(user_id)])
+
+            target = math.ceil((len(self) + len(encodings)) / len(self._shards))
+            start = 0
+            for shard in sorted(self._shards, key=lambda shard: shard.size):
+                count = min(max(target - shard.size, 0), len(encodings) - start)
+                if count:
+                    end = start + count
+                    self._append(shard, list(user_ids[start:end]), list(names[start:end]), encodings[start:end])
+                    start = end
+
+    def remove(self, user_id):
+        """Remove `user_id` from its shard. Returns True if the user was present"""
+        with self._lock:
+            shard = self._shard_by_id.get(int(user_id))
+            if shard is None:
+                return False
+            self._remove_row(shard, self._row_by_id[int(user_id)])
+            return True
+
+    def clear(self):
+        """Remove every row while keeping the shard processes"""
+        with self._lock:
+            for shard in self._shards:
+                shard._names[:shard.size] = None
+                shard.size = 0
+            self._shard_by_id.clear()
+            self._row_by_id.clear()
+
+    def get_encoding(self, user_id):
+        """Return a copy of the stored encoding for `user_id`, or None"""
+        shard = self._shard_by_id.get(int(user_id))
+        if shard is None:
+            return None
+        return shard.row(self._row_by_id[int(user_id)])[2]
+
+    def get_encodings(self, user_ids):
+        """Like `get_encoding` for several users at once"""
+        return [self.get_encoding(user_id) for user_id in user_ids]
+
+    def get_name(self, user_id):
+        """Return the username stored for `user_id`, or None"""
+        shard = self._shard_by_id.get(int(user_id))
+        if shard is None:
+            return None
+        return shard._names[self._row_by_id[int(user_id)]]
+
+    def holds(self, user_ids, names, encodings):
+        """For each row, whether the gallery already stores that user with
+        this name and encoding"""
+        stored = self.get_encodings(user_ids)
+        return [encoding is not None and self.get_name(user_id) == name and (encoding == new).all()
+                for user_id, name, new, encoding in zip(user_ids, names, encodings, stored)]
+
+    def search(self, encoding, k=1, nprobe=None):
+        """Return the `k` closest users as a list of (user_id, name, distance)"""
+        return self.search_batch(np.asarray(encoding).reshape(1, -1), k=k)[0]
+
+    def search_batch(self, encodings, k=1, nprobe=None):
+        """Scatter the queries to every shard and merge their top `k`.
+
+        Raises RuntimeError if a shard process has exited or does not
+        answer within `search_timeout` seconds.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            shards = [shard for shard in self._shards if shard.size]
+            if not shards:
+                return [[] for _ in range(len(encodings))]
+
+            self._seq += 1
+            for shard in shards:
+                shard.search(self._seq, encodings, k)
+
+            deadline = time.monotonic() + self.search_timeout
+            answers = []
+            while len(answers) < len(shards):
+                try:
+                    seq, shard_index, rows, distances = self._results.get(timeout=_LIVENESS_INTERVAL)
+                except queue.Empty:
+                    for shard in shards:
+                        if not shard.is_running:
+                            raise RuntimeError(f"Gallery shard {shard.index} exited") from None
+                    if time.monotonic() >= deadline:
+                        raise RuntimeError("A gallery shard did not answer in time") from None
+                    continue
+                if seq == self._seq:
+                    # Map rows to users now, before any write can move them
+                    shard = self._shards[shard_index]
+                    shard.release_retired()
+                    answers.append((shard._ids[rows], shard._names[rows], distances))
+
+        ids = np.concatenate([answer[0] for answer in answers], axis=1)
+        names = np.concatenate([answer[1] for answer in answers], axis=1)
+        distances = np.concatenate([answer[2] for answer in answers], axis=1)
+        matches = []
+        for query in range(len(encodings)):
+            order = np.argsort(distances[query], kind="stable")[:k]
+            matches.append([(int(ids[query, i]), names[query, i], float(distances[query, i])) for i in order])
+        return matches
+
+    def close(self):
+        """Stop every shard process and free the shared memory"""
+        with self._lock:
+            for shard in self._shards:
+                shard.stop()
+            self._shards = []
+            self._shard_by_id.clear()
+            self._row_by_id.clear()
+        self._results.cancel_join_thread()
+        self._results.close()
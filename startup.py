@@ -0,0 +1,49 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """Record how long each import and initialization phase takes.
+
+    Phases may run on different threads; each one is recorded with its
+    start offset from when the timer was created, so the report shows both
+    durations and how phases overlapped with painting the UI. Only the
+    standard library is used so the timer can be created before any heavy
+    import.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        """Seconds since the timer was created"""
+        return time.perf_counter() - self.origin
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, start, time.perf_counter() - start)
+
+    def mark(self, name):
+        """Record an instantaneous milestone such as "first paint\""""
+        self._record(name, time.perf_counter(), 0.0)
+
+    def _record(self, name, start, duration):
+        with self._lock:
+            self.phases.append((name, start - self.origin, duration, threading.current_thread().name))
+
+    def report(self):
+        """Return the recorded phases as a printable table"""
+        lines = [f"{'phase':<32} {'start ms':>9} {'took ms':>9}  thread"]
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        for name, start, duration, thread in phases:
+            lines.append(f"{name:<32} {start * 1000:9.1f} {duration * 1000:9.1f}  {thread}")
+        return "\n".join(lines)
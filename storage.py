@@ -0,0 +1,341 @@
+import sqlite3
+import sys
+
+import numpy as np
+
+DEFAULT_DB_PATH = "face_auth.db"
+
+# Bumped whenever the schema changes; stored in PRAGMA user_version.
+# 0: legacy users(id, username, face_encoding) with raw float64 blobs
+# 1: float32 blobs with encoding_dtype / encoding_dim columns
+# 2: user_changes change log fed by triggers on users
+SCHEMA_VERSION = 2
+
+ENCODING_DTYPE = "float32"
+ENCODING_DIM = 128
+
+# Applied to every connection. WAL lets the kiosk keep reading while the
+# admin tools write, and NORMAL sync is safe in WAL mode.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",  # 8 MB page cache
+    "PRAGMA mmap_size=67108864",  # 64 MB memory-mapped reads
+    "PRAGMA foreign_keys=ON",
+)
+
+MIGRATION_CHUNK_SIZE = 1000
+# Largest number of ids bound into one IN (...) query
+MAX_QUERY_IDS = 500
+# How long entries stay in user_changes before prune_changes removes them
+CHANGE_LOG_RETENTION = "-7 days"
+
+
+def connect(db_path=DEFAULT_DB_PATH, timeout=5.0, check_same_thread=True):
+    """Open `db_path` with the shared pragmas and an up-to-date schema"""
+    conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=check_same_thread)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    init_schema(conn)
+    return conn
+
+
+def init_schema(conn):
+    """Create the users table or migrate an older one in place"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    # Take the write lock first so two processes cannot migrate at once
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    face_encoding BLOB NOT NULL,
+                    encoding_dtype TEXT NOT NULL DEFAULT '{ENCODING_DTYPE}',
+                    encoding_dim INTEGER NOT NULL DEFAULT {ENCODING_DIM}
+                )
+            ''')
+            if version < 1:
+                _migrate_to_v1(conn)
+            if version < 2:
+                _migrate_to_v2(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _migrate_to_v1(conn):
+    """Add dtype/dim columns and rewrite float64 blobs as float32"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    if "encoding_dtype" not in columns:
+        # Existing rows were written with ndarray.tobytes() on float64 data
+        conn.execute("ALTER TABLE users ADD COLUMN encoding_dtype TEXT NOT NULL DEFAULT 'float64'")
+        conn.execute(f"UPDATE users SET encoding_dtype = '{ENCODING_DTYPE}' "
+                     f"WHERE length(face_encoding) = {ENCODING_DIM * 4}")
+    if "encoding_dim" not in columns:
+        conn.execute(f"ALTER TABLE users ADD COLUMN encoding_dim INTEGER NOT NULL DEFAULT {ENCODING_DIM}")
+
+    last_id = -1
+    while True:
+        rows = conn.execute(
+            "SELECT id, face_encoding FROM users WHERE encoding_dtype = 'float64' AND id > ? "
+            "ORDER BY id LIMIT ?", (last_id, MIGRATION_CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            f"UPDATE users SET face_encoding = ?, encoding_dtype = '{ENCODING_DTYPE}' WHERE id = ?",
+            [(encode_encoding(np.frombuffer(blob, dtype=np.float64)), user_id) for user_id, blob in rows]
+        )
+        last_id = rows[-1][0]
+
+
+def _migrate_to_v2(conn):
+    """Add the user_changes log and the triggers that feed it"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_after_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO user_changes (user_id, op) VALUES (NEW.id, 'insert');
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_after_update AFTER UPDATE OF username, face_encoding ON users
+        BEGIN
+            INSERT INTO user_changes (user_id, op) VALUES (NEW.id, 'update');
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_after_delete AFTER DELETE ON users
+        BEGIN
+            INSERT INTO user_changes (user_id, op) VALUES (OLD.id, 'delete');
+        END
+    ''')
+
+
+def encode_encoding(encoding):
+    """Serialize a face encoding for the face_encoding column"""
+    return np.asarray(encoding, dtype=ENCODING_DTYPE).tobytes()
+
+
+def decode_encoding(blob, dtype=ENCODING_DTYPE, dim=ENCODING_DIM):
+    """Deserialize a face_encoding blob written with `dtype`"""
+    return np.frombuffer(blob, dtype=dtype, count=dim)
+
+
+def load_encodings(conn):
+    """Return (ids, usernames, encodings) for every user.
+
+    Encodings come back as one (N, 128) float32 matrix decoded in a single
+    pass rather than one array per row.
+    """
+    rows = conn.execute(
+        "SELECT id, username, face_encoding, encoding_dtype, encoding_dim FROM users ORDER BY id"
+    ).fetchall()
+    ids = [row[0] for row in rows]
+    usernames = [row[1] for row in rows]
+    if all(row[3] == ENCODING_DTYPE and row[4] == ENCODING_DIM for row in rows):
+        encodings = np.frombuffer(b"".join(row[2] for row in rows), dtype=ENCODING_DTYPE)
+        encodings = encodings.reshape(len(rows), ENCODING_DIM)
+    else:
+        encodings = np.array([decode_encoding(row[2], row[3], row[4]) for row in rows],
+                             dtype=ENCODING_DTYPE).reshape(len(rows), ENCODING_DIM)
+    return ids, usernames, encodings
+
+
+def load_users(conn, user_ids):
+    """Return (ids, usernames, encodings) for the given user ids that still exist"""
+    user_ids = list(user_ids)
+    rows = []
+    for start in range(0, len(user_ids), MAX_QUERY_IDS):
+        chunk = user_ids[start:start + MAX_QUERY_IDS]
+        rows.extend(conn.execute(
+            "SELECT id, username, face_encoding, encoding_dtype, encoding_dim FROM users "
+            f"WHERE id IN ({','.join('?' * len(chunk))})", chunk
+        ))
+    encodings = np.array([decode_encoding(row[2], row[3], row[4]) for row in rows],
+                         dtype=ENCODING_DTYPE).reshape(len(rows), ENCODING_DIM)
+    return [row[0] for row in rows], [row[1] for row in rows], encodings
+
+
+def load_user_by_username(conn, username):
+    """Return (id, username, encoding) for one user, or None.
+
+    Served by the index behind the UNIQUE username constraint, so the cost
+    does not grow with the number of users.
+    """
+    row = conn.execute(
+        "SELECT id, username, face_encoding, encoding_dtype, encoding_dim FROM users WHERE username = ?",
+        (username,)
+    ).fetchone()
+    if row is None:
+        return None
+    return row[0], row[1], decode_encoding(row[2], row[3], row[4])
+
+
+def _prefix_range(prefix):
+    """[low, high) username bounds matching `prefix`, so the UNIQUE index on
+    username serves the search (LIKE 'x%' would scan the table)"""
+    if not prefix:
+        return None, None
+    last = prefix[-1]
+    if ord(last) == sys.maxunicode:
+        return prefix, None
+    return prefix, prefix[:-1] + chr(ord(last) + 1)
+
+
+def count_users(conn, prefix=None):
+    """Number of users, or of users whose username starts with `prefix`"""
+    low, high = _prefix_range(prefix)
+    if low is None:
+        return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    if high is None:
+        return conn.execute("SELECT COUNT(*) FROM users WHERE username >= ?", (low,)).fetchone()[0]
+    return conn.execute("SELECT COUNT(*) FROM users WHERE username >= ? AND username < ?",
+                        (low, high)).fetchone()[0]
+
+
+def users_page(conn, after=None, limit=200, prefix=None, before=None):
+    """One page of (id, username) rows using keyset pagination.
+
+    Without `prefix` rows come in id order and `after` is the last id of
+    the previous page. With `prefix` only usernames starting with it are
+    returned, in username order, and `after` is the last username. Passing
+    `before` (the first key of the following page) instead returns the
+    page that precedes it, still in ascending order. Either way each page
+    is an index range scan, however deep into the list it is.
+    """
+    low, high = _prefix_range(prefix)
+    key = "id" if low is None else "username"
+    conditions, params = [], []
+    if low is not None:
+        conditions.append("username >= ?")
+        params.append(low)
+        if high is not None:
+            conditions.append("username < ?")
+            params.append(high)
+    if after is not None:
+        conditions.append(f"{key} > ?")
+        params.append(after)
+    if before is not None:
+        conditions.append(f"{key} < ?")
+        params.append(before)
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    order = "DESC" if before is not None else "ASC"
+    rows = conn.execute(f"SELECT id, username FROM users {where}ORDER BY {key} {order} LIMIT ?",
+                        params + [limit]).fetchall()
+    if before is not None:
+        rows.reverse()
+    return rows
+
+
+def iter_users(conn, page_size=1000):
+    """Yield (id, username) for every user, reading one page at a time"""
+    after = 0
+    while True:
+        rows = users_page(conn, after=after, limit=page_size)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = rows[-1][0]
+
+
+def load_gallery(conn, gallery=None):
+    """Fill a FaceGallery (a new one unless `gallery` is given) from the users table"""
+    from gallery import FaceGallery
+
+    ids, usernames, encodings = load_encodings(conn)
+    if gallery is None:
+        gallery = FaceGallery(capacity=max(len(ids), 1024))
+    if ids:
+        gallery.add_many(ids, usernames, encodings)
+    return gallery
+
+
+def load_gallery_with_seq(conn, gallery=None):
+    """Like `load_gallery`, but also return the change-log position the
+    gallery reflects, read in the same transaction"""
+    conn.execute("BEGIN")
+    try:
+        seq = latest_change_seq(conn)
+        gallery = load_gallery(conn, gallery)
+    finally:
+        conn.commit()
+    return gallery, seq
+
+
+def latest_change_seq(conn):
+    """Sequence number of the newest change-log entry (0 if empty)"""
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM user_changes").fetchone()[0]
+
+
+def fetch_changes(conn, after_seq):
+    """Return (seq, user_id, op) change-log entries newer than `after_seq`.
+
+    Returns None if entries after `after_seq` have already been pruned, in
+    which case the caller has to reload the whole gallery.
+    """
+    oldest = conn.execute("SELECT MIN(seq) FROM user_changes").fetchone()[0]
+    if oldest is not None and after_seq < oldest - 1:
+        return None
+    return conn.execute(
+        "SELECT seq, user_id, op FROM user_changes WHERE seq > ? ORDER BY seq", (after_seq,)
+    ).fetchall()
+
+
+def prune_changes(conn, retention=CHANGE_LOG_RETENTION):
+    """Drop change-log entries older than `retention` (an SQLite date modifier).
+
+    The newest entry is always kept so sequence numbers stay monotonic.
+    """
+    with conn:
+        conn.execute(
+            "DELETE FROM user_changes WHERE changed_at < datetime('now', ?) "
+            "AND seq < (SELECT MAX(seq) FROM user_changes)", (retention,)
+        )
+
+
+def insert_user(conn, username, encoding):
+    """Insert one user and return the new id"""
+    with conn:
+        cursor = conn.execute(
+            "INSERT INTO users (username, face_encoding, encoding_dtype, encoding_dim) VALUES (?, ?, ?, ?)",
+            (username, encode_encoding(encoding), ENCODING_DTYPE, ENCODING_DIM)
+        )
+    return cursor.lastrowid
+
+
+def insert_users(conn, rows):
+    """Insert (username, encoding) pairs with one prepared statement in a single transaction"""
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (username, face_encoding, encoding_dtype, encoding_dim) VALUES (?, ?, ?, ?)",
+            ((username, encode_encoding(encoding), ENCODING_DTYPE, ENCODING_DIM) for username, encoding in rows)
+        )
+
+
+def delete_user(conn, user_id):
+    """Delete one user by id"""
+    with conn:
+        conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+
+
+def delete_all_users(conn):
+    """Delete every user"""
+    with conn:
+        conn.execute("DELETE FROM users")
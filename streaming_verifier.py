@@ -0,0 +1,81 @@
+import math
+
+ACCEPT = "accept"
+REJECT = "reject"
+
+
+class StreamingVerifier:
+    """Sequential probability ratio test over per-frame match distances.
+
+    Genuine and impostor distances are modelled as normal with spread
+    `sigma`, centred `margin` below and above `threshold`. The per-frame
+    log-likelihood ratio then reduces to 2 * margin * (threshold - d) /
+    sigma^2, so evidence for a user grows with every frame that matches
+    them well below the threshold and shrinks with every frame above it.
+    The test accepts once one user's evidence reaches log((1 - beta) /
+    alpha), and rejects once even the best match of every frame adds up to
+    less than log(beta / (1 - alpha)). `alpha` is the tolerated false-accept
+    rate and `beta` the tolerated false-reject rate per attempt.
+    """
+
+    def __init__(self, threshold=0.4, margin=0.05, sigma=0.05, alpha=0.01, beta=0.05,
+                 min_frames=2, max_frames=15):
+        self.threshold = threshold
+        self.margin = margin
+        self.sigma = sigma
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        self.accept_bound = math.log((1 - beta) / alpha)
+        self.reject_bound = math.log(beta / (1 - alpha))
+        self.reset()
+
+    def reset(self):
+        """Forget all evidence, e.g. before the next attempt"""
+        self.frames = 0
+        self.evidence = {}
+        self.distances = {}
+        self.names = {}
+        # Evidence of the best match of every frame: no user can have more
+        self.best_evidence = 0.0
+
+    def log_likelihood_ratio(self, distance):
+        """Evidence one frame at `distance` adds for a genuine match, clipped
+        so a single outlier frame cannot decide on its own"""
+        llr = 2 * self.margin * (self.threshold - distance) / (self.sigma ** 2)
+        return max(-self.accept_bound, min(self.accept_bound, llr))
+
+    def update(self, matches):
+        """Add one frame's gallery matches, [(user_id, name, distance), ...]
+        sorted by distance.
+
+        Returns (ACCEPT, user_id, name, mean_distance), (REJECT, None, None,
+        best_distance) or None while undecided. Users outside this frame's
+        matches are scored as if at the last match's distance, which is a
+        lower bound on their real distance.
+        """
+        self.frames += 1
+        if not matches:
+            return REJECT, None, None, float("inf")
+
+        floor_llr = self.log_likelihood_ratio(matches[-1][2])
+        seen = set()
+        for user_id, name, distance in matches:
+            self.evidence[user_id] = self.evidence.get(user_id, 0.0) + self.log_likelihood_ratio(distance)
+            self.distances.setdefault(user_id, []).append(distance)
+            self.names[user_id] = name
+            seen.add(user_id)
+        for user_id in self.evidence:
+            if user_id not in seen:
+                self.evidence[user_id] += floor_llr
+        self.best_evidence += self.log_likelihood_ratio(matches[0][2])
+
+        leader = matches[0][0]
+        if self.frames >= self.min_frames and self.evidence[leader] >= self.accept_bound:
+            distances = self.distances[leader]
+            return ACCEPT, leader, self.names[leader], sum(distances) / len(distances)
+        if self.frames >= self.min_frames and self.best_evidence <= self.reject_bound:
+            return REJECT, None, None, matches[0][2]
+        if self.frames >= self.max_frames:
+            # Inconclusive after the frame budget counts as a failed attempt
+            return REJECT, None, None, matches[0][2]
+        return None
@@ -0,0 +1,7 @@
+# Distance thresholds shared by the engine and the offline tools. Kept out
+# of auth_engine so the tools can run without the camera/dlib stack.
+
+# A new face closer than this to an enrolled one is treated as a duplicate
+DUPLICATE_THRESHOLD = 0.5
+# Registration samples further than this from their average are rejected
+MAX_SAMPLE_DISTANCE = 0.3
@@ -0,0 +1,41 @@
+from collections import OrderedDict
+
+import storage
+
+
+class UserLookup:
+    """Claimed-identity lookups: username -> (user_id, username, encoding).
+
+    Misses go to the database through the username index; the most
+    recently used `max_entries` users are kept in memory. Call `clear`
+    whenever users may have changed, e.g. after a gallery sync applied
+    updates.
+    """
+
+    def __init__(self, conn, max_entries=256):
+        self.conn = conn
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username):
+        """Return (user_id, username, encoding) for `username`, or None if not registered"""
+        entry = self._entries.get(username)
+        if entry is not None:
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = storage.load_user_by_username(self.conn, username)
+        if entry is not None:
+            self._entries[username] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        self._entries.clear()
@@ -2,6 +2,7 @@ import sqlite3
 import tkinter as tk
 from tkinter import messagebox, ttk
 import os
+import storage
 
 class UserManagement:
     def __init__(self):
@@ -9,6 +10,18 @@ class UserManagement:
         self.root.title("User Management")
         self.root.geometry("600x400")
         
+        # The list holds a window of keyset pages that moves as it is scrolled
+        self.page_size = 200
+        self.max_pages = 3  # Pages kept in the Treeview at once
+        self.search_prefix = None
+        self.pages = []  # [first_key, last_key, iids] for each page shown, in order
+        self.at_start = True  # Whether the first page shown is the first page
+        self.all_loaded = False  # Whether the last page shown is the last page
+        self.loading = False
+        self.loaded_users = 0  # Rows currently in the Treeview
+        self.users_above = 0  # Rows in the pages dropped above the window
+        self.total_users = 0
+        
         # Initialize database connection
         self.init_database()
         
@@ -18,8 +31,10 @@ class UserManagement:
     def init_database(self):
         """Initialize database connection"""
         try:
-            self.conn = sqlite3.connect('face_auth.db')
+            self.conn = storage.connect()
             self.cursor = self.conn.cursor()
+            # Keep the change log that running kiosks follow from growing forever
+            storage.prune_changes(self.conn)
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", f"Failed to connect to database: {str(e)}")
             self.root.destroy()
@@ -30,16 +45,28 @@ class UserManagement:
         title_label = tk.Label(self.root, text="User Management", font=("Arial", 16, "bold"))
         title_label.pack(pady=20)
         
+        # Username prefix search
+        search_frame = tk.Frame(self.root)
+        search_frame.pack(padx=20, fill="x")
+        tk.Label(search_frame, text="Search username:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        search_entry = tk.Entry(search_frame, textvariable=self.search_var, width=25)
+        search_entry.pack(side=tk.LEFT, padx=5)
+        search_entry.bind("<Return>", lambda event: self.search_users())
+        tk.Button(search_frame, text="Search", command=self.search_users).pack(side=tk.LEFT)
+        self.count_label = tk.Label(search_frame, text="")
+        self.count_label.pack(side=tk.RIGHT)
+        
         # Create Treeview for user list
         self.tree = ttk.Treeview(self.root, columns=("ID", "Username"), show="headings")
         self.tree.heading("ID", text="ID")
         self.tree.heading("Username", text="Username")
         self.tree.pack(pady=10, padx=20, fill="both", expand=True)
         
-        # Add scrollbar
-        scrollbar = ttk.Scrollbar(self.root, orient="vertical", command=self.tree.yview)
-        scrollbar.pack(side="right", fill="y")
-        self.tree.configure(yscrollcommand=scrollbar.set)
+        # Add scrollbar; scrolling near either end moves the window of pages
+        self.scrollbar = ttk.Scrollbar(self.root, orient="vertical", command=self.tree.yview)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.configure(yscrollcommand=self.on_tree_scroll)
         
         # Buttons frame
         button_frame = tk.Frame(self.root)
@@ -67,18 +94,119 @@ class UserManagement:
         self.refresh_user_list()
         
     def refresh_user_list(self):
-        """Refresh the user list in the Treeview"""
+        """Reload the user list from its first page"""
         # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-            
-        # Fetch and display users
+        self.clear_pages()
+        self.all_loaded = False
+        
         try:
-            self.cursor.execute("SELECT id, username FROM users")
-            for user_id, username in self.cursor.fetchall():
-                self.tree.insert("", "end", values=(user_id, username))
+            self.total_users = storage.count_users(self.conn, self.search_prefix)
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", f"Failed to load users: {str(e)}")
+            return
+        self.load_next_page()
+        
+    def clear_pages(self):
+        """Empty the Treeview and forget the pages it held"""
+        self.tree.delete(*self.tree.get_children())
+        self.pages = []
+        self.at_start = True
+        self.loaded_users = 0
+        self.users_above = 0
+        
+    def fetch_page(self, after=None, before=None):
+        """Read one page of users, or None if the query failed"""
+        if self.loading:
+            return None
+        self.loading = True
+        try:
+            return storage.users_page(self.conn, after=after, before=before,
+                                      limit=self.page_size, prefix=self.search_prefix)
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"Failed to load users: {str(e)}")
+            return None
+        finally:
+            self.loading = False
+            
+    def page_key(self, row):
+        """Searches page by username, the full list by id"""
+        return row[1] if self.search_prefix else row[0]
+        
+    def load_next_page(self):
+        """Append the next page of users, dropping the top page if over the limit"""
+        if self.all_loaded:
+            return
+        rows = self.fetch_page(after=self.pages[-1][1] if self.pages else None)
+        if rows is None:
+            return
+        self.all_loaded = len(rows) < self.page_size
+        if rows:
+            iids = []
+            for user_id, username in rows:
+                iids.append(self.tree.insert("", "end", iid=str(user_id), values=(user_id, username)))
+            self.pages.append([self.page_key(rows[0]), self.page_key(rows[-1]), iids])
+            self.loaded_users += len(iids)
+            if len(self.pages) > self.max_pages:
+                dropped = self.drop_page(0)
+                self.users_above += dropped
+                self.at_start = False
+                # Rows above the view went away, so scroll back by as many to stay put
+                self.tree.yview_scroll(-dropped, "units")
+        self.update_count_label()
+        
+    def load_previous_page(self):
+        """Prepend the page before the window, dropping the bottom page if over the limit"""
+        if self.at_start or not self.pages:
+            return
+        rows = self.fetch_page(before=self.pages[0][0])
+        if rows is None:
+            return
+        if rows:
+            iids = []
+            for index, (user_id, username) in enumerate(rows):
+                iids.append(self.tree.insert("", index, iid=str(user_id), values=(user_id, username)))
+            self.pages.insert(0, [self.page_key(rows[0]), self.page_key(rows[-1]), iids])
+            self.loaded_users += len(iids)
+            self.users_above = max(0, self.users_above - len(iids))
+            # Rows were added above the view, so scroll on by as many to stay put
+            self.tree.yview_scroll(len(iids), "units")
+            if len(self.pages) > self.max_pages:
+                self.drop_page(len(self.pages) - 1)
+                self.all_loaded = False
+        # A short page, or none at all, means nothing comes before it
+        self.at_start = len(rows) < self.page_size
+        if self.at_start:
+            self.users_above = 0
+        self.update_count_label()
+        
+    def drop_page(self, index):
+        """Remove one page from the Treeview and return how many rows it held"""
+        first_key, last_key, iids = self.pages.pop(index)
+        self.tree.delete(*iids)
+        self.loaded_users -= len(iids)
+        return len(iids)
+        
+    def on_tree_scroll(self, first, last):
+        """Keep the scrollbar in sync and move the window near either end"""
+        self.scrollbar.set(first, last)
+        if float(last) > 0.9 and not self.all_loaded:
+            self.root.after_idle(self.load_next_page)
+        elif float(first) < 0.1 and not self.at_start:
+            self.root.after_idle(self.load_previous_page)
+            
+    def update_count_label(self):
+        """Show which of the matching users are loaded"""
+        if self.loaded_users:
+            first = self.users_above + 1
+            last = self.users_above + self.loaded_users
+            self.count_label.config(text=f"Showing {first}-{last} of {self.total_users} users")
+        else:
+            self.count_label.config(text=f"Showing 0 of {self.total_users} users")
+        
+    def search_users(self):
+        """List only users whose username starts with the search text"""
+        self.search_prefix = self.search_var.get().strip() or None
+        self.refresh_user_list()
             
     def delete_selected_user(self):
         """Delete the selected user from the database"""
@@ -94,10 +222,17 @@ class UserManagement:
         if messagebox.askyesno("Confirm Deletion", 
                              f"Are you sure you want to delete user '{username}'?"):
             try:
-                self.cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-                self.conn.commit()
+                storage.delete_user(self.conn, user_id)
+                # Drop just this row; the page keys already loaded stay valid
+                self.tree.delete(selected_item[0])
+                for page in self.pages:
+                    if selected_item[0] in page[2]:
+                        page[2].remove(selected_item[0])
+                        self.loaded_users -= 1
+                        break
+                self.total_users -= 1
+                self.update_count_label()
                 messagebox.showinfo("Success", f"User '{username}' has been deleted")
-                self.refresh_user_list()
             except sqlite3.Error as e:
                 messagebox.showerror("Database Error", f"Failed to delete user: {str(e)}")
                 
@@ -107,10 +242,12 @@ class UserManagement:
         if messagebox.askyesno("Confirm Deletion", 
                              "Are you sure you want to delete ALL users?\nThis action cannot be undone!"):
             try:
-                self.cursor.execute("DELETE FROM users")
-                self.conn.commit()
+                storage.delete_all_users(self.conn)
+                self.clear_pages()
+                self.total_users = 0
+                self.all_loaded = True
+                self.update_count_label()
                 messagebox.showinfo("Success", "All users have been deleted")
-                self.refresh_user_list()
             except sqlite3.Error as e:
                 messagebox.showerror("Database Error", f"Failed to delete users: {str(e)}")
                 
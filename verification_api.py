@@ -0,0 +1,412 @@
+import base64
+import binascii
+import hmac
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+import metrics
+import storage
+from gallery_sync import GallerySync
+from user_lookup import UserLookup
+
+# Upper bounds for the number of requests answered by one batch
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class VerificationError(Exception):
+    """A request that cannot be answered; `status` is the HTTP status to return"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Probe:
+    """One identify or verify request waiting in the batcher's queue"""
+
+    def __init__(self, kind, encoding=None, image=None, username=None, k=1):
+        self.kind = kind
+        self.encoding = encoding
+        self.image = image
+        self.username = username
+        self.k = k
+        self.future = Future()
+
+
+class VerificationService:
+    """Answer identify (1:N) and verify (1:1) requests in micro-batches.
+
+    Requests from any number of HTTP threads are queued; a single batching
+    thread waits up to `batch_window` seconds after the first one for more
+    to arrive, then serves up to `max_batch` of them together: images are
+    decoded and detected on a small thread pool, every face is encoded in
+    one BatchEncoder call and all identify probes are matched with one
+    `search_batch` against the gallery. The service keeps its own gallery
+    and change-log follower, so it never touches the engine's.
+
+    At most `max_pending` requests may wait; beyond that `submit` raises a
+    503 VerificationError so clients back off instead of piling up.
+    """
+
+    def __init__(self, db_path=storage.DEFAULT_DB_PATH, max_batch=32, batch_window=0.005,
+                 max_pending=256, request_timeout=2.0, detection_workers=2,
+                 metrics_registry=None):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.request_timeout = request_timeout
+        self.detection_workers = detection_workers
+        self.recognition_threshold = 0.4  # Same meaning as in FaceAuthEngine
+        self.max_k = 10
+
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._ready = threading.Event()
+        self._start_error = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        registry = metrics_registry or metrics.REGISTRY
+        self.requests_total = registry.counter(
+            "face_auth_api_requests_total", "Identify and verify requests accepted by the API")
+        self.requests_rejected = registry.counter(
+            "face_auth_api_requests_rejected_total", "API requests refused because the queue was full")
+        self.requests_timed_out = registry.counter(
+            "face_auth_api_requests_timed_out_total", "API requests not answered within the timeout")
+        self.batch_size = registry.histogram(
+            "face_auth_api_batch_size", "Requests answered together in one batch", buckets=BATCH_SIZE_BUCKETS)
+        self.batch_seconds = registry.histogram(
+            "face_auth_api_batch_seconds", "Time to decode, encode and match one batch")
+
+    def start(self):
+        """Start the batching thread and wait until its gallery is loaded"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="VerificationBatcher", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._start_error is not None:
+            raise self._start_error
+
+    def stop(self, timeout=2.0):
+        """Stop the batching thread; queued requests fail with a 503"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, probe):
+        """Queue `probe`. Returns its future; raises a 503 VerificationError
+        if too many requests are already waiting"""
+        try:
+            self._pending.put_nowait(probe)
+        except queue.Full:
+            self.requests_rejected.inc()
+            raise VerificationError("Server busy, please retry shortly", status=503) from None
+        self.requests_total.inc()
+        return probe.future
+
+    def wait(self, probe, deadline):
+        """Result of a submitted `probe`, or a 504 VerificationError once
+        `deadline` (a time.monotonic() value) passes"""
+        try:
+            return probe.future.result(timeout=max(deadline - time.monotonic(), 0.0))
+        except FutureTimeoutError:
+            probe.future.cancel()
+            self.requests_timed_out.inc()
+            raise VerificationError("Request timed out", status=504) from None
+
+    def run_probes(self, probes):
+        """Submit `probes` together and return one result or VerificationError each"""
+        deadline = time.monotonic() + self.request_timeout
+        submitted = []
+        for probe in probes:
+            try:
+                self.submit(probe)
+                submitted.append(probe)
+            except VerificationError as e:
+                probe.future.set_exception(e)
+        results = []
+        for probe in probes:
+            try:
+                results.append(self.wait(probe, deadline) if probe in submitted else probe.future.result())
+            except VerificationError as e:
+                results.append(e)
+        return results
+
+    def _run(self):
+        """Batch loop, runs until `stop` is called"""
+        conn = None
+        gallery_sync = None
+        try:
+            conn = storage.connect(self.db_path)
+            gallery, seq = storage.load_gallery_with_seq(conn)
+            gallery_sync = GallerySync(self.db_path, seq)
+            gallery_sync.start()
+            lookup = UserLookup(conn)
+        except Exception as e:
+            # Release whatever was opened before the failure
+            if gallery_sync is not None:
+                gallery_sync.stop()
+            if conn is not None:
+                conn.close()
+            self._start_error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        self._encoder = None
+        self._detection_pool = None
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    first = self._pending.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                batch = [first]
+                window_end = time.monotonic() + self.batch_window
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self._pending.get(timeout=max(window_end - time.monotonic(), 0.0)))
+                    except queue.Empty:
+                        break
+
+                if gallery_sync.apply_to(gallery):
+                    lookup.clear()
+                # Requests whose caller already gave up are skipped
+                batch = [probe for probe in batch if probe.future.set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+                self.batch_size.observe(len(batch))
+                with self.batch_seconds.time():
+                    try:
+                        self.process_batch(batch, gallery, lookup)
+                    except Exception as e:
+                        for probe in batch:
+                            if not probe.future.done():
+                                probe.future.set_exception(VerificationError(f"Internal error: {e}", status=500))
+        finally:
+            while True:
+                try:
+                    probe = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                if probe.future.set_running_or_notify_cancel():
+                    probe.future.set_exception(VerificationError("Server is shutting down", status=503))
+            gallery_sync.stop()
+            if self._detection_pool is not None:
+                self._detection_pool.shutdown(wait=False)
+            conn.close()
+
+    def detect(self, image_bytes):
+        """Decode an image and find its single face (runs on the pool)"""
+        import cv2
+        import face_recognition
+
+        frame = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise VerificationError("Image could not be decoded")
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        face_locations = face_recognition.face_locations(rgb_frame)
+        if not face_locations:
+            raise VerificationError("No face detected in the image", status=422)
+        if len(face_locations) > 1:
+            raise VerificationError("Multiple faces detected in the image", status=422)
+        return rgb_frame, face_locations[0]
+
+    def encode_images(self, probes):
+        """Fill in `probe.encoding` for probes that sent an image; probes
+        whose image has no usable face get their exception set"""
+        if self._encoder is None:
+            from multi_camera import BatchEncoder
+
+            self._encoder = BatchEncoder()
+            self._detection_pool = ThreadPoolExecutor(max_workers=self.detection_workers,
+                                                      thread_name_prefix="ApiDetect")
+        detections = list(zip(probes, self._detection_pool.map(self._try_detect, [p.image for p in probes])))
+        faces = []
+        for probe, detection in detections:
+            if isinstance(detection, VerificationError):
+                probe.future.set_exception(detection)
+            else:
+                faces.append((probe, detection))
+        for (probe, _), encoding in zip(faces, self._encoder.encode([detection for _, detection in faces])):
+            probe.encoding = encoding
+
+    def _try_detect(self, image_bytes):
+        """`detect`, returning the failure instead of raising so that one
+        bad image only fails its own request"""
+        try:
+            return self.detect(image_bytes)
+        except VerificationError as e:
+            return e
+        except Exception as e:
+            return VerificationError(f"Image could not be processed: {e}")
+
+    def process_batch(self, batch, gallery, lookup):
+        """Encode, match and answer one batch of probes"""
+        images = [probe for probe in batch if probe.encoding is None]
+        if images:
+            self.encode_images(images)
+        batch = [probe for probe in batch if not probe.future.done()]
+
+        identify = [probe for probe in batch if probe.kind == "identify"]
+        if identify:
+            k = max(probe.k for probe in identify)
+            all_matches = gallery.search_batch(np.stack([probe.encoding for probe in identify]), k=k)
+            for probe, matches in zip(identify, all_matches):
+                matches = [{"username": name, "distance": distance} for _, name, distance in matches[:probe.k]]
+                best = matches[0] if matches and matches[0]["distance"] <= self.recognition_threshold else None
+                probe.future.set_result({"recognized": best is not None, "match": best, "matches": matches})
+
+        verify = [probe for probe in batch if probe.kind == "verify"]
+        claims = [(probe, lookup.get(probe.username)) for probe in verify]
+        for probe, claim in claims:
+            if claim is None:
+                probe.future.set_exception(VerificationError(f"Username '{probe.username}' is not registered", status=404))
+        claims = [(probe, claim) for probe, claim in claims if claim is not None]
+        if claims:
+            probes = np.stack([probe.encoding for probe, _ in claims])
+            enrolled = np.stack([claim[2] for _, claim in claims])
+            distances = np.linalg.norm(probes - enrolled, axis=1)
+            for (probe, _), distance in zip(claims, distances.tolist()):
+                probe.future.set_result({"username": probe.username, "distance": distance,
+                                         "verified": distance <= self.recognition_threshold})
+
+
+def parse_probe(kind, payload, files=None, max_k=10):
+    """Build a Probe from a JSON object with "encoding" (128 floats) or
+    "image" (base64), or from an uploaded "image" file"""
+    if not isinstance(payload, dict):
+        raise VerificationError("Expected a JSON object")
+    username = payload.get("username")
+    if kind == "verify" and not isinstance(username, str):
+        raise VerificationError("verify needs a \"username\"")
+    try:
+        k = int(payload.get("k", 1))
+    except (TypeError, ValueError):
+        raise VerificationError("\"k\" must be an integer") from None
+    if not 1 <= k <= max_k:
+        raise VerificationError(f"\"k\" must be between 1 and {max_k}")
+
+    if payload.get("encoding") is not None:
+        try:
+            encoding = np.asarray(payload["encoding"], dtype=np.float32)
+        except (TypeError, ValueError):
+            raise VerificationError("\"encoding\" must be a list of numbers") from None
+        if encoding.shape != (storage.ENCODING_DIM,) or not np.isfinite(encoding).all():
+            raise VerificationError(f"\"encoding\" must have {storage.ENCODING_DIM} finite values")
+        return Probe(kind, encoding=encoding, username=username, k=k)
+    if payload.get("image") is not None:
+        try:
+            image = base64.b64decode(payload["image"], validate=True)
+        except (TypeError, ValueError, binascii.Error):
+            raise VerificationError("\"image\" must be base64 encoded") from None
+    elif files is not None and "image" in files:
+        image = files["image"].read()
+    else:
+        raise VerificationError("Send an \"encoding\" or an \"image\"")
+    if not image:
+        raise VerificationError("\"image\" is empty")
+    return Probe(kind, image=image, username=username, k=k)
+
+
+def register_routes(app, db_path=storage.DEFAULT_DB_PATH, max_batch_requests=64, token=None):
+    """Add /api/identify, /api/verify and /api/batch to a Flask `app`.
+
+    The service starts with the first request, so an app that never
+    serves the API does not load a second gallery. With a `token` every
+    request must send "Authorization: Bearer <token>".
+    """
+    from flask import jsonify, request
+
+    state = {"service": None}
+    lock = threading.Lock()
+
+    def get_service():
+        with lock:
+            if state["service"] is None:
+                service = VerificationService(db_path=db_path)
+                service.start()
+                state["service"] = service
+            return state["service"]
+
+    def error_response(error):
+        response = jsonify({"error": str(error)})
+        response.status_code = error.status
+        if error.status == 503:
+            response.headers["Retry-After"] = "1"
+        return response
+
+    if token is not None:
+        @app.before_request
+        def check_token():
+            if not request.path.startswith("/api/"):
+                return None
+            sent = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(sent.encode(), f"Bearer {token}".encode()):
+                response = error_response(VerificationError("Missing or wrong API token", status=401))
+                response.headers["WWW-Authenticate"] = "Bearer"
+                return response
+            return None
+
+    def request_payload():
+        if request.files or request.form:
+            return request.form.to_dict()
+        return request.get_json(silent=True)
+
+    def single(kind):
+        try:
+            service = get_service()
+            probe = parse_probe(kind, request_payload(), request.files, max_k=service.max_k)
+            result = service.run_probes([probe])[0]
+        except VerificationError as e:
+            return error_response(e)
+        if isinstance(result, VerificationError):
+            return error_response(result)
+        return jsonify(result)
+
+    @app.route('/api/identify', methods=['POST'])
+    def api_identify():
+        return single("identify")
+
+    @app.route('/api/verify', methods=['POST'])
+    def api_verify():
+        return single("verify")
+
+    @app.route('/api/batch', methods=['POST'])
+    def api_batch():
+        # {"requests": [{"type": "identify" | "verify", ...}, ...]}; each
+        # entry gets its own result or {"error", "status"}
+        payload = request.get_json(silent=True)
+        entries = payload.get("requests") if isinstance(payload, dict) else None
+        if not isinstance(entries, list) or not entries:
+            return error_response(VerificationError("Expected a non-empty \"requests\" list"))
+        if len(entries) > max_batch_requests:
+            return error_response(VerificationError(f"At most {max_batch_requests} requests per batch", status=413))
+        try:
+            service = get_service()
+        except VerificationError as e:
+            return error_response(e)
+
+        results = [None] * len(entries)
+        probes = []
+        for i, entry in enumerate(entries):
+            try:
+                kind = entry.get("type") if isinstance(entry, dict) else None
+                if kind not in ("identify", "verify"):
+                    raise VerificationError("\"type\" must be \"identify\" or \"verify\"")
+                probes.append((i, parse_probe(kind, entry, max_k=service.max_k)))
+            except VerificationError as e:
+                results[i] = e
+        for (i, _), result in zip(probes, service.run_probes([probe for _, probe in probes])):
+            results[i] = result
+        return jsonify({"results": [
+            {"error": str(result), "status": result.status} if isinstance(result, VerificationError) else result
+            for result in results
+        ]})
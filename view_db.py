@@ -1,23 +1,20 @@
 import sqlite3
 import numpy as np
+import storage
 
 def view_database():
+    conn = None
     try:
         # Connect to the database
-        conn = sqlite3.connect('face_auth.db')
-        cursor = conn.cursor()
-        
-        # Get all users
-        cursor.execute("SELECT id, username FROM users")
-        users = cursor.fetchall()
+        conn = storage.connect()
         
         print("\n=== Registered Users ===")
-        print("Total users:", len(users))
+        print("Total users:", storage.count_users(conn))
         print("\nUser Details:")
         print("-" * 50)
         
-        for user in users:
-            user_id, username = user
+        # Stream users page by page instead of loading them all at once
+        for user_id, username in storage.iter_users(conn):
             print(f"ID: {user_id}")
             print(f"Username: {username}")
             print("-" * 50)